@@ -58,7 +58,7 @@ def make(to_do, petanque_port: int, pet_timeout: int):
 
             if modified:
                 state = init_state()
-                timeout(pet_timeout)(pet.run)(state, reproof)
+                timeout(pet_timeout)(pet.run)(state, reproof, timeout=pet_timeout)
             else:
                 assert (proof == reproof)
 
@@ -68,14 +68,14 @@ def make(to_do, petanque_port: int, pet_timeout: int):
 
         except PetanqueError as err:
             error = "-> " + err.message
-        except Exception as err:
-            error = "-> " + str(err.args[0])
         except TimeoutError as err:
             error = "-> timeout"
             stop_pet_server(pet_server)
             pet_server = start_pet_server(petanque_port)
             pet = Pytanque("127.0.0.1", petanque_port)
             pet.connect()
+        except Exception as err:
+            error = "-> " + str(err.args[0])
 
         if len(error) > 0:
             theorem["error"] = error
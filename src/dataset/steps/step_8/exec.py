@@ -6,7 +6,8 @@ import random
 
 from tqdm import tqdm
 from src.embedding.models.factory import get_embedding_model
-from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.index.cosim_index import FaissIndex, chunks
+from src.embedding.index.search_filter import SearchFilter
 
 """
 Step 8: Keep best search from new queries generated in previous step.
@@ -27,6 +28,14 @@ def parse_output(output: str):
 
     return blocks
 
+def target_filter(entry, dictionary):
+    """Filter hiding the lemmas defined after the target theorem (see step 9)."""
+    fqn = entry['fqn'].replace('export.output.steps.step_0', 'mathcomp')
+    fqn_clear = fqn.split('_have')[0]
+    if fqn_clear not in dictionary:
+        return None
+    return SearchFilter.defined_before(dictionary[fqn_clear])
+
 def filter_best_search(block):
     """Keep only the best search result among several candidates."""
     assert block['kind'] == 'searchs', 'Block must be a "searchs" (*plural*) block'
@@ -53,6 +62,7 @@ if __name__ == '__main__':
     parser.add_argument('--model-name', default='qwen_embedding_4b', help="Embedding model's name")
     parser.add_argument('--device', default='cpu', help="Device for embedding model")
     parser.add_argument('--batch-size', default=32, help="Batch size used to pre compute embedding", type=int)
+    parser.add_argument('--max-tokens', default=None, help="Maximum number of tokens of a batch, padding included", type=int)
     parser.add_argument('--top-k', default=20, help="Top-k parameter use for retrieval", type=int)
     args = parser.parse_args()
 
@@ -64,19 +74,35 @@ if __name__ == '__main__':
         content = json.load(file)
     
     model = get_embedding_model(args.model_name, device=args.device)
-    index = FaissIndex(model, dictionary, batch_size=args.batch_size)
+    index = FaissIndex(model, dictionary, batch_size=args.batch_size, max_tokens=args.max_tokens)
 
-    for entry in tqdm(list(content.values())):
+    # Collect the queries of all the blocks, to embed and search them in batches
+    pending = []
+    for entry in content.values():
         if 'output_blocks' not in entry:
             entry['output_blocks'] = parse_output(entry['CoT'])
-        blocks = entry['output_blocks']
-        for block in blocks:
-            if block['kind'] == 'search':
-                if 'search_result' not in block:
-                    block['search_result'] = index.query(block['content'], top_k=3*args.top_k)
-            if block['kind'] == 'searchs':
-                if 'search_result' not in block:
-                    block['searchs_result'] = [index.query(content, top_k=3*args.top_k) for content in block["content"]]
+        search_filter = target_filter(entry, dictionary)
+        for block in entry['output_blocks']:
+            if block['kind'] == 'search' and 'search_result' not in block:
+                pending.append((block, None, block['content'], search_filter))
+            if block['kind'] == 'searchs' and 'search_result' not in block:
+                block['searchs_result'] = [None] * len(block['content'])
+                for k, query in enumerate(block['content']):
+                    pending.append((block, k, query, search_filter))
+
+    for batch in tqdm(list(chunks(pending, args.batch_size))):
+        search_results = index.query_batch(
+            [query for _, _, query, _ in batch], top_k=args.top_k, filters=[f for _, _, _, f in batch]
+        )
+        for (block, k, _, _), search_result in zip(batch, search_results):
+            if k is None:
+                block['search_result'] = search_result
+            else:
+                block['searchs_result'][k] = search_result
+
+    for entry in content.values():
+        for block in entry['output_blocks']:
+            if block['kind'] == 'searchs' and 'search_result' not in block:
                 filter_best_search(block)
     with open(os.path.join(args.output, 'result.json'), 'w') as file:
         json.dump(content, file, indent=4)
\ No newline at end of file
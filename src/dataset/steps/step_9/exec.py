@@ -41,6 +41,7 @@ def is_valid(entry, dictionary, top_k=10):
         if block_next['kind'] != 'think':
             return False, None
         
+        # Results of step 8 are already filtered, older results may not be
         filtered_search_result = []
         for score, element, fqn in block_prev['search_result']:
             # TODO: old artifact, need to merge all notation to have coherent keys
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.index.index_config import IndexConfig, INDEX_TYPES
+from src.embedding.models.factory import get_embedding_model
+
+"""
+Benchmark of the approximate index types: recall@k against the flat index, QPS and size.
+
+    python -m src.embedding.index.benchmark --index-types ivf_flat ivf_pq hnsw --nprobe 8 16 32
+"""
+
+
+def search_positions(index: FaissIndex, embeddings: np.ndarray, top_k: int):
+    """Positions (in `all_fqn`) of the top_k results of each query."""
+    _, ids = index.index.search(embeddings, top_k)
+    return [[index.positions[int(id)] for id in row if id >= 0] for row in ids]
+
+
+def recall_at_k(results, ground_truth) -> float:
+    """Fraction of the exact top-k found, averaged over the queries."""
+    return float(np.mean([
+        len(set(result) & set(truth)) / len(truth) for result, truth in zip(results, ground_truth)
+    ]))
+
+
+def measure(index: FaissIndex, embeddings: np.ndarray, top_k: int, ground_truth):
+    start = time.perf_counter()
+    results = search_positions(index, embeddings, top_k)
+    batch_time = time.perf_counter() - start
+
+    # One query at a time, as issued by a single beam
+    start = time.perf_counter()
+    for row in range(len(embeddings)):
+        index.index.search(embeddings[row : row + 1], top_k)
+    single_time = time.perf_counter() - start
+
+    index_file = os.path.join(index.cache_path, sorted(
+        name for name in os.listdir(index.cache_path)
+        if name.startswith(f"index_{index.index_config.index_type}-")
+    )[-1])
+    return {
+        "recall": recall_at_k(results, ground_truth),
+        "batch_qps": len(embeddings) / batch_time,
+        "single_qps": len(embeddings) / single_time,
+        "latency_ms": 1000 * single_time / len(embeddings),
+        "size_mb": os.path.getsize(index_file) / 2**20,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docstrings-path', default='/lustre/fsn1/projects/rech/tdm/commun/dataset/docstrings.json', help='Docstrings path')
+    parser.add_argument('--embedding-cache-path', default='/lustre/fsn1/projects/rech/tdm/commun/cache/', help='Embedding cache path')
+    parser.add_argument('--model-name', default='qwen_embedding_4b', help="Embedding model's name")
+    parser.add_argument('--device', default='cpu', help="Device for embedding model")
+    parser.add_argument('--batch-size', default=32, help="Batch size used to pre compute embedding", type=int)
+    parser.add_argument('--queries', default=None, help="JSON list of queries (default: docstrings sampled from the corpus)")
+    parser.add_argument('--num-queries', default=1000, help="Number of sampled queries", type=int)
+    parser.add_argument('--top-k', default=10, help="Top-k parameter use for retrieval", type=int)
+    parser.add_argument('--index-types', nargs='+', default=['ivf_flat', 'ivf_pq', 'hnsw'], choices=INDEX_TYPES)
+    parser.add_argument('--nlist', default=1024, type=int, help="Number of clusters of IVF indexes")
+    parser.add_argument('--pq-m', default=16, type=int, help="Number of codes of IVF-PQ indexes")
+    parser.add_argument('--hnsw-m', default=32, type=int, help="Number of neighbours of HNSW indexes")
+    parser.add_argument('--nprobe', nargs='+', default=[16], type=int, help="Values of nprobe to evaluate (IVF)")
+    parser.add_argument('--ef-search', nargs='+', default=[64], type=int, help="Values of efSearch to evaluate (HNSW)")
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--output', default=None, help="JSON file for the results")
+    args = parser.parse_args()
+
+    with open(args.docstrings_path, 'r') as file:
+        docstrings = json.load(file)
+    if args.queries:
+        with open(args.queries, 'r') as file:
+            queries = json.load(file)
+    else:
+        random.seed(args.seed)
+        elements = random.sample(list(docstrings.values()), min(args.num_queries, len(docstrings)))
+        queries = [element['docstring'] for element in elements]
+
+    model = get_embedding_model(args.model_name, device=args.device)
+    start = time.perf_counter()
+    flat = FaissIndex(model, docstrings, cache_path=args.embedding_cache_path, batch_size=args.batch_size)
+    print(f"flat: loaded in {time.perf_counter() - start:.1f}s ({flat.index.ntotal} docstrings)")
+    embeddings = np.concatenate([
+        flat.embed_queries(queries[i : i + args.batch_size]) for i in range(0, len(queries), args.batch_size)
+    ])
+    ground_truth = search_positions(flat, embeddings, args.top_k)
+
+    rows = [dict(index_type="flat", **measure(flat, embeddings, args.top_k, ground_truth))]
+    for index_type in args.index_types:
+        config = IndexConfig(index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+        start = time.perf_counter()
+        index = FaissIndex(model, docstrings, cache_path=args.embedding_cache_path, batch_size=args.batch_size, index_config=config)
+        print(f"{config.spec}: loaded in {time.perf_counter() - start:.1f}s")
+        if index_type == "hnsw":
+            sweep = [("ef_search", value) for value in args.ef_search]
+        elif index_type == "flat":
+            sweep = [(None, None)]
+        else:
+            sweep = [("nprobe", value) for value in args.nprobe]
+        for name, value in sweep:
+            if name is not None:
+                setattr(config, name, value)
+                config.configure(index.index)
+            row = dict(index_type=config.spec, **({name: value} if name else {}))
+            row.update(measure(index, embeddings, args.top_k, ground_truth))
+            rows.append(row)
+
+    print(f"\n{'index':<45} {'param':>12} {'recall@' + str(args.top_k):>10} {'batch QPS':>10} {'single QPS':>11} {'ms/query':>9} {'MB':>8}")
+    for row in rows:
+        param = next((f"{key}={row[key]}" for key in ("nprobe", "ef_search") if key in row), "")
+        print(
+            f"{row['index_type']:<45} {param:>12} {row['recall']:>10.3f} {row['batch_qps']:>10.0f} "
+            f"{row['single_qps']:>11.0f} {row['latency_ms']:>9.3f} {row['size_mb']:>8.1f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(rows, file, indent=4)
@@ -1,14 +1,22 @@
 import os
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional, Union
 from abc import ABC, abstractmethod
 import copy
+import json
 import hashlib
 
+import numpy as np
 import torch
 import faiss
 from tqdm import tqdm
 
 from ..models.base import BaseEmbedding
+from ..models.batching import generate_batched, iter_generate_batched
+from .embedding_store import EmbeddingStore
+from .index_config import IndexConfig
+from .search_filter import EntryMetadata, SearchFilter
+from .query_cache import QueryCache, QueryEmbeddingStore, normalize_query
+from src.inference.tracing import span
 
 
 
@@ -34,68 +42,334 @@ class CosimIndex(ABC):
 
 class FaissIndex(CosimIndex):
     def __init__(
-        self, model: BaseEmbedding, content: Dict = None, cache_path: str="export/cache/", batch_size=1, load_cache_index=True
+        self, model: BaseEmbedding, content: Dict = None, cache_path: str="export/cache/", batch_size=1, load_cache_index=True,
+        query_cache_size=1024, cache_query_embeddings=True, index_config: IndexConfig = None, max_tokens: int = None
     ):
+        """
+        Args:
+            model: Embedding model
+            content: Dictionary of fully qualified name to element (with a "docstring")
+            cache_path: Directory of the cached embeddings and index
+            batch_size: Maximum number of docstrings embedded together
+            load_cache_index: Whether to reuse (or update) the saved index, otherwise it is built again
+            query_cache_size: Number of query results kept in memory
+            cache_query_embeddings: Whether to store the embeddings of the queries on disk,
+                                    so they are not encoded again in later runs
+            index_config: Type and parameters of the index (default: flat, exact search)
+            max_tokens: Maximum number of tokens of a batch, padding included (default: no limit).
+                        Inputs are grouped by length, so short docstrings are embedded in larger
+                        batches than long ones.
+        """
         super().__init__()
         self.model = model
-        self.all_embeddings = []
-        self.all_fqn = []
-        self.all_constants = []
         self.cache_path = os.path.join(cache_path, model.name())
         self.content = copy.deepcopy(content)
+        self.index_config = index_config or IndexConfig()
+        self.max_tokens = max_tokens
+        self.all_fqn = list(self.content.keys())
+        self.all_constants = list(self.content.values())
+        # Embeddings are stored by content, a changed docstring gets a new embedding
+        self.all_keys = [string_to_filename(element['docstring']) for element in self.all_constants]
+        self.metadata = EntryMetadata(self.all_fqn, self.all_constants)
 
         os.makedirs(self.cache_path, exist_ok=True)
+        store = QueryEmbeddingStore(os.path.join(self.cache_path, "queries.sqlite")) if cache_query_embeddings else None
+        self.query_cache = QueryCache(query_cache_size, store)
+        self.store = EmbeddingStore(self.cache_path)
         self._compute_and_save_embedding(batch_size=batch_size)
+        self._load_or_build_index(load_cache_index)
 
+    @property
+    def all_embeddings(self) -> np.ndarray:
+        """Normalized embeddings of the docstrings, in the order of `all_fqn`."""
+        return self.store.get(self.all_keys)
 
-        for qualid_name, element in self.content.items():
-            embedding = element["embedding"]
-            self.all_fqn.append(qualid_name)
-            self.all_constants.append(element)
-            self.all_embeddings.append(embedding.unsqueeze(0))
+    def _compute_and_save_embedding(self, batch_size=1, save_every=100):
+        """
+        Add the embeddings of the docstrings missing from the store.
 
-        self.all_embeddings = torch.cat(self.all_embeddings, dim=0).to(torch.float32).numpy()
-        d = self.all_embeddings.shape[1]
-        faiss.normalize_L2(self.all_embeddings)
-        
-        cache_index_path = os.path.join(cache_path, "index")
-        if load_cache_index and os.path.exists(cache_index_path):
-            self.index = faiss.read_index(cache_index_path)
+        Embeddings of the older cache (one `.pt` file per name) are migrated
+        instead of being computed again. They are found by name, as the older cache
+        did. A file that records the docstring it was computed from (or its hash) is
+        migrated only if it is still the current one.
+        """
+        to_do = {}
+        legacy = {}
+        for qualid_name, key, element in zip(self.all_fqn, self.all_keys, self.all_constants):
+            if key in self.store or key in to_do or key in legacy:
+                continue
+            legacy_path = os.path.join(self.cache_path, string_to_filename(qualid_name) + '.pt')
+            if os.path.exists(legacy_path):
+                legacy[key] = (legacy_path, element['docstring'])
+            else:
+                to_do[key] = element['docstring']
+
+        migrated = 0
+        for batch in tqdm(list(chunks(list(legacy.items()), batch_size)), desc="Migrating embeddings"):
+            keys, embeddings = [], []
+            for key, (path, docstring) in batch:
+                cache_element = torch.load(path)
+                recorded = cache_element.get('key')
+                if recorded is None and 'docstring' in cache_element:
+                    recorded = string_to_filename(cache_element['docstring'])
+                if recorded is None or recorded == key:
+                    keys.append(key)
+                    embeddings.append(cache_element['embedding'])
+                else:
+                    # Stale embedding
+                    to_do[key] = docstring
+            if keys:
+                self._append(keys, torch.stack(embeddings))
+                migrated += 1
+                if migrated % save_every == 0:
+                    self.store.save()
+
+        keys, docstrings = list(to_do.keys()), list(to_do.values())
+        batches = iter_generate_batched(self.model, docstrings, max_tokens=self.max_tokens, max_batch_size=batch_size)
+        with tqdm(total=len(docstrings)) as progress:
+            for k, (batch, embeddings) in enumerate(batches, start=1):
+                self._append([keys[i] for i in batch], embeddings)
+                progress.update(len(batch))
+                if k % save_every == 0:
+                    self.store.save()
+
+        if legacy or to_do:
+            self.store.save()
+
+    def _load_or_build_index(self, load_cache_index=True):
+        """
+        Load the index saved for the current docstrings, or update or build it.
+
+        Each index type has its own manifest, recording the model, the dimension,
+        the parameters of the index and the id and content key of each docstring.
+        The index is reused as is when the docstrings are the same, updated with the
+        added and removed docstrings when it is compatible, and built (and trained)
+        again otherwise.
+        """
+        config = self.index_config
+        entries = dict(zip(self.all_fqn, self.all_keys))
+        digest = string_to_filename(json.dumps(sorted(entries.items())))
+        # Identifies the docstrings, for the other indexes built on them
+        self.digest = digest
+        manifest_path = os.path.join(self.cache_path, f"index_{config.index_type}.json")
+        manifest = None
+        if load_cache_index and os.path.exists(manifest_path):
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+        compatible = (
+            manifest is not None
+            and manifest["model"] == self.model.name()
+            and manifest["dim"] == self.store.dim
+            and manifest["index_type"] == config.spec
+            and os.path.exists(os.path.join(self.cache_path, manifest["index_file"]))
+        )
+        if compatible and manifest["digest"] == digest:
+            self.index = faiss.read_index(os.path.join(self.cache_path, manifest["index_file"]))
+            ids = {fqn: entry[0] for fqn, entry in manifest["entries"].items()}
+            self._set_ids(ids)
+            config.configure(self.index)
+            return
+
+        if compatible:
+            old_entries = manifest["entries"]
+            removed = [id for fqn, (id, key) in old_entries.items() if entries.get(fqn) != key]
+            compatible = not removed or config.supports_remove
+        if compatible:
+            self.index = faiss.read_index(os.path.join(self.cache_path, manifest["index_file"]))
+            added = [fqn for fqn, key in entries.items() if fqn not in old_entries or old_entries[fqn][1] != key]
+            ids = {fqn: id for fqn, (id, key) in old_entries.items() if entries.get(fqn) == key}
+            next_id = manifest["next_id"]
         else:
-            self.index = faiss.IndexFlatIP(d)
-            self.index.add(self.all_embeddings)
-            faiss.write_index(self.index, cache_index_path)
-        
-
-    def _compute_and_save_embedding(self, batch_size=1):
-        to_do = []
-        for qualid_name, element in self.content.items():
-            filename = string_to_filename(qualid_name) + '.pt'
-            export_path = os.path.join(self.cache_path, filename)
-            if not os.path.exists(export_path):
-                to_do.append((export_path, element))
+            self.index = config.build(self.store.dim, self.all_embeddings)
+            removed, added, ids, next_id = [], self.all_fqn, {}, 0
+
+        if removed:
+            self.index.remove_ids(np.array(removed, dtype=np.int64))
+        for fqn in added:
+            ids[fqn] = next_id
+            next_id += 1
+        for batch in chunks(added, 65536):
+            embeddings = self.store.get([entries[fqn] for fqn in batch])
+            self.index.add_with_ids(embeddings, np.array([ids[fqn] for fqn in batch], dtype=np.int64))
+        self._set_ids(ids)
+        self._save_index(manifest_path, digest, ids, next_id)
+        config.configure(self.index)
+
+    def _set_ids(self, ids: Dict[str, int]) -> None:
+        """Map the ids of the index to the positions in `all_fqn`, and back."""
+        self.positions = {ids[fqn]: position for position, fqn in enumerate(self.all_fqn)}
+        self.position_ids = np.array([ids[fqn] for fqn in self.all_fqn], dtype=np.int64)
+
+    def _save_index(self, manifest_path: str, digest: str, ids: Dict[str, int], next_id: int) -> None:
+        """Save the index, then replace the manifest pointing to it."""
+        prefix = f"index_{self.index_config.index_type}-"
+        index_file = f"{prefix}{digest[:16]}.faiss"
+        faiss.write_index(self.index, os.path.join(self.cache_path, index_file))
+        manifest = {
+            "model": self.model.name(),
+            "dim": self.store.dim,
+            "index_type": self.index_config.spec,
+            "digest": digest,
+            "index_file": index_file,
+            "next_id": next_id,
+            "entries": {fqn: [ids[fqn], key] for fqn, key in zip(self.all_fqn, self.all_keys)},
+        }
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, manifest_path)
+        # Older versions of the index
+        for name in os.listdir(self.cache_path):
+            if name.startswith(prefix) and name.endswith(".faiss") and name != index_file:
+                os.remove(os.path.join(self.cache_path, name))
+
+    def _append(self, keys: List[str], embeddings) -> None:
+        embeddings = embeddings.detach().cpu().to(torch.float32).numpy().reshape(len(keys), -1).copy()
+        faiss.normalize_L2(embeddings)
+        self.store.append(keys, embeddings)
+
+    def embed_queries(self, queries: List[str]):
+        """
+        Embeddings of queries, of shape (len(queries), d).
+
+        Queries found in the on-disk store are not encoded again, the others are
+        encoded together in one padded forward pass (or in batches of similar lengths
+        under `max_tokens`).
+        """
+        keys = [normalize_query(query) for query in queries]
+        store = self.query_cache.store
+        embeddings = {}
+        if store is not None:
+            for key in set(keys):
+                embedding = store.get(key)
+                if embedding is not None:
+                    embeddings[key] = embedding
+        # Encode each missing query once, even if it appears several times
+        to_do = {key: query for key, query in zip(keys, queries) if key not in embeddings}
+        if to_do:
+            with span("search.embed", batch=len(to_do)):
+                if self.max_tokens is None:
+                    generated = self.model.generate(list(to_do.values()), query=True)
+                else:
+                    generated = generate_batched(self.model, list(to_do.values()), max_tokens=self.max_tokens, query=True)
+                generated = generated.detach().clone().cpu().to(torch.float32).numpy()
+            for key, embedding in zip(to_do, generated):
+                embedding = embedding.reshape(1, -1)
+                embeddings[key] = embedding
+                if store is not None:
+                    store.put(key, embedding)
+        return np.concatenate([embeddings[key] for key in keys], axis=0)
+
+    def embed_query(self, query: str):
+        """Embedding of a query, of shape (1, d)."""
+        return self.embed_queries([query])
+
+    def query(self, query: str, top_k=10, filter: Optional[SearchFilter] = None) -> List[Tuple[float, str, str]]:
+        return self.query_batch([query], top_k=top_k, filters=filter)[0]
+
+    def query_batch(
+        self, queries: List[str], top_k=10, filters: Union[None, SearchFilter, List[Optional[SearchFilter]]] = None
+    ) -> List[List[Tuple[float, str, str]]]:
+        """
+        Query the index with several queries at once.
+
+        The queries missing from the cache are embedded in one forward pass and
+        searched with one call to the index per distinct filter. Filtered entries are
+        skipped during the search, and the results of a filtered query are completed
+        by an exact search if the index returns fewer than top_k valid entries, so
+        there are exactly top_k results (or all the valid entries if there are fewer).
+
+        Args:
+            queries: Queries
+            top_k: Number of results per query
+            filters: A filter for all the queries, or one filter (or None) per query
+
+        Returns:
+            For each query, a list of score, element, fully qualified name
+        """
+        if filters is None or isinstance(filters, SearchFilter):
+            filters = [filters] * len(queries)
+        keys = [normalize_query(query) for query in queries]
+        results = [self.query_cache.get(key, (top_k, f)) for key, f in zip(keys, filters)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        query_embeddings = self.embed_queries([queries[i] for i in missing])
+        groups: Dict[Optional[SearchFilter], List[int]] = {}
+        for row, i in enumerate(missing):
+            groups.setdefault(filters[i], []).append(row)
+
+        for f, rows in groups.items():
+            embeddings = query_embeddings[rows]
+            if f is None:
+                with span("faiss.search", batch=len(rows)):
+                    distances, indices = self.index.search(embeddings, top_k)
+                group_results = [self._results(d, ids) for d, ids in zip(distances, indices)]
             else:
-                cache_element = torch.load(export_path)
-                element['embedding'] = cache_element['embedding']
-        to_do_chunk = list(chunks(to_do, batch_size))
-        for batch in tqdm(to_do_chunk):
-            docstring_lists = [e['docstring'] for (_, e) in batch]
-            embeddings = self.model.generate(docstring_lists)
-            for (export_path, element), embedding in zip(batch, embeddings):
-                embedding = embedding.detach().clone().cpu()
-                element['embedding'] = embedding
-                torch.save({'embedding': embedding}, export_path)
-
-    def query(self, query: str, top_k=10) -> List[Tuple[float, str, str]]:
-        query_embedding = self.model.generate(query, query=True).detach().clone().cpu().to(torch.float32)
-        distances, indices = self.index.search(query_embedding, top_k)
-
-        result = []
-        for i, idx in enumerate(indices[0]):
-            element = copy.deepcopy(self.all_constants[idx])
-            del element['embedding']
-            result.append(
-                (float(distances[0][i]), element, self.all_fqn[idx])
+                group_results = self._filtered_search(embeddings, top_k, f)
+            for row, result in zip(rows, group_results):
+                i = missing[row]
+                self.query_cache.put(keys[i], (top_k, f), result)
+                results[i] = result
+        return results
+
+    def _filtered_search(self, embeddings: np.ndarray, top_k: int, filter: SearchFilter) -> List[List[Tuple[float, str, str]]]:
+        mask = filter.mask(self.metadata)
+        expected = min(top_k, int(mask.sum()))
+        if expected == 0:
+            return [[] for _ in embeddings]
+
+        # Bitmap of the valid ids, kept alive during the search
+        valid = np.zeros(int(self.position_ids.max()) + 1, dtype=bool)
+        valid[self.position_ids[mask]] = True
+        bitmap = np.packbits(valid, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(valid), faiss.swig_ptr(bitmap))
+        with span("faiss.search", batch=len(embeddings), filtered=True):
+            distances, indices = self.index.search(
+                embeddings, top_k, params=self.index_config.search_parameters(selector)
             )
 
-        return result
+        results = [self._results(d, ids) for d, ids in zip(distances, indices)]
+        # Approximate indexes can miss valid entries, search them all for these queries
+        exact = [row for row, result in enumerate(results) if len(result) < expected]
+        if exact:
+            with span("faiss.exact_search", batch=len(exact)):
+                # The valid embeddings are read once for the whole batch
+                candidates = np.flatnonzero(mask)
+                candidate_embeddings = self.store.get([self.all_keys[position] for position in candidates])
+                all_scores = embeddings[exact] @ candidate_embeddings.T
+                for row, scores in zip(exact, all_scores):
+                    best = np.argpartition(-scores, expected - 1)[:expected]
+                    best = best[np.argsort(-scores[best])]
+                    results[row] = [self._element(float(scores[i]), int(candidates[i])) for i in best]
+        return results
+
+    def _results(self, distances: np.ndarray, ids: np.ndarray) -> List[Tuple[float, str, str]]:
+        # Negative ids: fewer than top_k (valid) elements found
+        return [
+            self._element(float(distance), self.positions[int(id)])
+            for distance, id in zip(distances, ids) if id >= 0
+        ]
+
+    def _element(self, score: float, position: int) -> Tuple[float, Dict, str]:
+        return (score, copy.deepcopy(self.all_constants[position]), self.all_fqn[position])
+
+    def filter_before(self, name: str, **kwargs) -> SearchFilter:
+        """
+        Filter hiding the entries defined after the entry `name` in its file.
+
+        `name` is a fully qualified name or a suffix of one (e.g. the name of a
+        theorem), the filter hides nothing if it is not found.
+        """
+        position = self.metadata.positions.get(name)
+        if position is None:
+            suffix = "." + name
+            position = next((p for p, fqn in enumerate(self.all_fqn) if fqn.endswith(suffix)), None)
+        if position is None:
+            return SearchFilter(**kwargs)
+        return SearchFilter.defined_before(self.all_constants[position], **kwargs)
+
+    def cache_stats(self) -> Dict:
+        """Hit rate statistics of the query cache."""
+        return self.query_cache.stats()
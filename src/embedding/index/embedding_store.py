@@ -0,0 +1,111 @@
+import os
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    Embeddings of the docstrings, stored as a single memory-mapped matrix.
+
+    The matrix is a raw float32 file with one row per embedding, and a JSON manifest
+    maps each key to its row. New embeddings are appended at the end of the file,
+    then `save` writes the manifest. Rows appended after the last `save` (e.g. by
+    an interrupted run) are not in the manifest, they are dropped when the store is
+    opened again.
+
+    Opening the store only reads the manifest, rows are read from the memory map
+    when they are used.
+    """
+
+    MATRIX = "embeddings.f32"
+    MANIFEST = "embeddings.json"
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the store.
+
+        Args:
+            path: Directory of the store
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.matrix_path = os.path.join(path, self.MATRIX)
+        self.manifest_path = os.path.join(path, self.MANIFEST)
+
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.rows: Dict[str, int] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as file:
+                manifest = json.load(file)
+            self.dim = manifest["dim"]
+            self.count = manifest["count"]
+            self.rows = manifest["rows"]
+
+        # Drop the rows not saved in the manifest
+        size = self.count * (self.dim or 0) * 4
+        if not os.path.exists(self.matrix_path):
+            open(self.matrix_path, "wb").close()
+        elif os.path.getsize(self.matrix_path) != size:
+            os.truncate(self.matrix_path, size)
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Read-only memory map of all the rows, of shape (count, dim)."""
+        if self._matrix is None or self._matrix.shape[0] != self.count:
+            if self.count == 0:
+                self._matrix = np.empty((0, self.dim or 0), dtype=np.float32)
+            else:
+                self._matrix = np.memmap(
+                    self.matrix_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)
+                )
+        return self._matrix
+
+    def get(self, keys: List[str]) -> np.ndarray:
+        """
+        Embeddings of `keys`, of shape (len(keys), dim).
+
+        When the keys are all the rows in order, the memory map itself is returned
+        without copy.
+        """
+        rows = [self.rows[key] for key in keys]
+        if len(rows) == self.count and rows == list(range(self.count)):
+            return self.matrix
+        return np.asarray(self.matrix[rows])
+
+    def append(self, keys: List[str], embeddings: np.ndarray) -> None:
+        """
+        Append embeddings (a key already in the store points to its new row).
+
+        Call `save` to make them persistent.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(keys), -1)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {embeddings.shape[1]}")
+        with open(self.matrix_path, "ab") as file:
+            file.write(embeddings.tobytes())
+        for key in keys:
+            self.rows[key] = self.count
+            self.count += 1
+
+    def save(self) -> None:
+        """Write the manifest (atomically, the previous one stays valid until replaced)."""
+        with open(self.matrix_path, "ab") as file:
+            os.fsync(file.fileno())
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"dim": self.dim, "count": self.count, "rows": self.rows}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,232 @@
+import os
+import re
+import copy
+import shutil
+from typing import Dict, List, Optional, Tuple, Union
+
+import bm25s
+from bm25s.stopwords import STOPWORDS_EN
+
+from .cosim_index import CosimIndex, FaissIndex
+from .query_cache import normalize_query
+from .search_filter import SearchFilter
+from src.inference.tracing import span
+
+
+IDENTIFIER = re.compile(r"[\w']+")
+STOPWORDS = set(STOPWORDS_EN)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased words and identifiers of a text, for BM25.
+
+    Identifiers with underscores are kept whole and also split into their parts,
+    so `addn_comm` matches both `addn_comm` and `addn comm`. Dots separate the
+    components of qualified names.
+    """
+    tokens = []
+    for word in IDENTIFIER.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        tokens.append(word)
+        parts = [part for part in word.split("_") if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 index over the names and docstrings of a `FaissIndex`, saved next to it.
+
+    The index is saved in the cache directory of the dense index under the digest
+    of its docstrings, and built again only when they change.
+    """
+
+    def __init__(self, dense: FaissIndex):
+        self.dense = dense
+        self.path = os.path.join(dense.cache_path, f"bm25-{dense.digest[:16]}")
+        if os.path.exists(self.path):
+            self.retriever = bm25s.BM25.load(self.path, mmap=True, show_progress=False)
+        else:
+            self.retriever = self._build()
+
+        # Fully qualified and short names, for exact matches
+        self.names: Dict[str, List[int]] = {}
+        for position, fqn in enumerate(dense.all_fqn):
+            element = dense.all_constants[position]
+            names = {fqn, fqn.rsplit(".", 1)[-1], element.get("fullname", fqn)}
+            for name in names:
+                self.names.setdefault(name, []).append(position)
+
+    def _build(self) -> bm25s.BM25:
+        corpus = [
+            tokenize(f"{fqn} {element.get('fullname', '')} {element.get('docstring', '')}")
+            for fqn, element in zip(self.dense.all_fqn, self.dense.all_constants)
+        ]
+        retriever = bm25s.BM25()
+        retriever.index(corpus, show_progress=False)
+        tmp_path = self.path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        retriever.save(tmp_path, show_progress=False)
+        os.replace(tmp_path, self.path)
+        # Indexes of older docstrings
+        for name in os.listdir(self.dense.cache_path):
+            path = os.path.join(self.dense.cache_path, name)
+            if name.startswith("bm25-") and path != self.path:
+                shutil.rmtree(path, ignore_errors=True)
+        return retriever
+
+    def exact(self, query: str) -> List[int]:
+        """Positions of the constants named exactly `query` (a single identifier)."""
+        return self.names.get(query.strip(), [])
+
+    def search_batch(self, queries: List[str], top_k: int) -> List[List[Tuple[float, int]]]:
+        """For each query, the (score, position) of its best matches (positive scores only)."""
+        top_k = min(top_k, len(self.dense.all_fqn))
+        if not queries or top_k == 0:
+            return [[] for _ in queries]
+        with span("bm25.search", batch=len(queries)):
+            positions, scores = self.retriever.retrieve(
+                [tokenize(query) for query in queries], k=top_k, show_progress=False
+            )
+        return [
+            [(float(score), int(position)) for position, score in zip(row_positions, row_scores) if score > 0]
+            for row_positions, row_scores in zip(positions, scores)
+        ]
+
+
+class HybridIndex(CosimIndex):
+    """
+    Dense search fused with BM25 by reciprocal-rank fusion (RRF).
+
+    A constant gets `weight / (rrf_k + rank)` from each ranking it appears in. When
+    the query is exactly the name of a constant, the named constants come first,
+    with the score of a constant ranked first by both rankings, followed by the
+    other results. The embedding model is skipped if the BM25 results are enough
+    to fill top_k. Filters apply to both rankings.
+    """
+
+    def __init__(
+        self,
+        dense: FaissIndex,
+        dense_weight: float = 1.0,
+        lexical_weight: float = 1.0,
+        rrf_k: int = 60,
+        depth: int = 50,
+        exact_match: bool = True,
+    ):
+        """
+        Args:
+            dense: Dense index
+            dense_weight: Weight of the dense ranking
+            lexical_weight: Weight of the BM25 ranking
+            rrf_k: Constant of the fusion, higher values flatten the contribution of the ranks
+            depth: Number of results of each ranking considered for the fusion
+            exact_match: Whether to skip the dense search for exact names
+        """
+        super().__init__()
+        self.dense = dense
+        self.lexical = LexicalIndex(dense)
+        self.dense_weight = dense_weight
+        self.lexical_weight = lexical_weight
+        self.rrf_k = rrf_k
+        self.depth = depth
+        self.exact_match = exact_match
+        self.exact_hits = 0
+
+    def query(self, query: str, top_k=10, filter: Optional[SearchFilter] = None) -> List[Tuple[float, str, str]]:
+        return self.query_batch([query], top_k=top_k, filters=filter)[0]
+
+    def query_batch(
+        self, queries: List[str], top_k=10, filters: Union[None, SearchFilter, List[Optional[SearchFilter]]] = None
+    ) -> List[List[Tuple[float, str, str]]]:
+        """Query the index with several queries (see `FaissIndex.query_batch`)."""
+        if filters is None or isinstance(filters, SearchFilter):
+            filters = [filters] * len(queries)
+        depth = max(top_k, self.depth)
+        queries = [normalize_query(query) for query in queries]
+        lexical_results = self.lexical.search_batch(queries, depth)
+        masks = {f: f.mask(self.dense.metadata) for f in set(filters) if f is not None}
+        for i, f in enumerate(filters):
+            if f is not None:
+                lexical_results[i] = [(score, p) for score, p in lexical_results[i] if masks[f][p]]
+
+        results = [None] * len(queries)
+        all_exact = [[] for _ in queries]
+        dense_queries = []
+        for i, query in enumerate(queries):
+            exact = self.lexical.exact(query) if self.exact_match else []
+            if filters[i] is not None:
+                exact = [position for position in exact if masks[filters[i]][position]]
+            all_exact[i] = exact
+            if exact:
+                self.exact_hits += 1
+                lexical = {position for _, position in lexical_results[i]}
+                if len(lexical.union(exact)) >= top_k:
+                    results[i] = self._exact_results(exact, lexical_results[i], top_k)
+                    continue
+            dense_queries.append(i)
+
+        if dense_queries:
+            dense_results = self.dense.query_batch(
+                [queries[i] for i in dense_queries], top_k=depth, filters=[filters[i] for i in dense_queries]
+            )
+            for i, dense_result in zip(dense_queries, dense_results):
+                results[i] = self._fuse(dense_result, lexical_results[i], top_k, all_exact[i])
+        return results
+
+    def _element(self, score: float, position: int) -> Tuple[float, Dict, str]:
+        return (score, copy.deepcopy(self.dense.all_constants[position]), self.dense.all_fqn[position])
+
+    @property
+    def exact_score(self) -> float:
+        """Score of an exact match, the highest fused score (first in both rankings)."""
+        return (self.dense_weight + self.lexical_weight) / (self.rrf_k + 1)
+
+    def _exact_results(self, exact: List[int], lexical: List[Tuple[float, int]], top_k: int):
+        result = [self._element(self.exact_score, position) for position in exact]
+        for rank, (_, position) in enumerate(lexical, start=1):
+            if position not in exact:
+                result.append(self._element(self.lexical_weight / (self.rrf_k + rank), position))
+        return result[:top_k]
+
+    def _fuse(
+        self,
+        dense: List[Tuple[float, Dict, str]],
+        lexical: List[Tuple[float, int]],
+        top_k: int,
+        exact: List[int] = (),
+    ):
+        scores: Dict[str, float] = {}
+        for rank, (_, _, fqn) in enumerate(dense, start=1):
+            scores[fqn] = scores.get(fqn, 0.0) + self.dense_weight / (self.rrf_k + rank)
+        positions = {}
+        for rank, (_, position) in enumerate(lexical, start=1):
+            fqn = self.dense.all_fqn[position]
+            positions[fqn] = position
+            scores[fqn] = scores.get(fqn, 0.0) + self.lexical_weight / (self.rrf_k + rank)
+
+        for position in exact:
+            fqn = self.dense.all_fqn[position]
+            positions[fqn] = position
+            scores[fqn] = self.exact_score
+        exact_fqns = {self.dense.all_fqn[position] for position in exact}
+
+        elements = {fqn: element for _, element, fqn in dense}
+        # Exact matches first, whatever the ties
+        best = sorted(scores.items(), key=lambda item: (item[0] not in exact_fqns, -item[1]))[:top_k]
+        result = []
+        for fqn, score in best:
+            if fqn in elements:
+                result.append((score, elements[fqn], fqn))
+            else:
+                result.append(self._element(score, positions[fqn]))
+        return result
+
+    def cache_stats(self) -> Dict:
+        """Hit rate statistics of the dense query cache, and number of exact matches."""
+        stats = self.dense.cache_stats()
+        stats["exact_hits"] = self.exact_hits
+        return stats
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+
+import numpy as np
+import faiss
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+@dataclass
+class IndexConfig:
+    """
+    Type and parameters of the FAISS index of the docstrings (inner product).
+
+    - flat: exhaustive search, exact results
+    - ivf_flat: inverted lists over `nlist` clusters, `nprobe` of them are searched
+    - ivf_pq: same with vectors compressed by product quantization (`pq_m` codes
+      of `pq_bits` bits), the smallest in memory
+    - hnsw: graph with `hnsw_m` neighbours per node, `ef_search` is the size of the
+      candidate list when searching. Elements cannot be removed from the graph, so
+      the index is built again when docstrings are removed.
+
+    Trained indexes (IVF) are saved with their training, later updates only add
+    and remove vectors.
+    """
+
+    index_type: str = "flat"
+    nlist: int = 1024
+    pq_m: int = 16
+    pq_bits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 40
+    nprobe: int = 16
+    ef_search: int = 64
+    train_size: int = 100_000
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {self.index_type} (expected one of {', '.join(INDEX_TYPES)})")
+
+    @property
+    def spec(self) -> str:
+        """Parameters fixed when the index is built, an index is reused only if they match."""
+        if self.index_type == "ivf_flat":
+            return f"ivf_flat:nlist={self.nlist}"
+        if self.index_type == "ivf_pq":
+            return f"ivf_pq:nlist={self.nlist},m={self.pq_m},bits={self.pq_bits}"
+        if self.index_type == "hnsw":
+            return f"hnsw:m={self.hnsw_m},ef_construction={self.ef_construction}"
+        return "flat"
+
+    @property
+    def supports_remove(self) -> bool:
+        return self.index_type != "hnsw"
+
+    def build(self, dim: int, embeddings: np.ndarray) -> faiss.Index:
+        """
+        Create an empty index with ids, trained on a sample of `embeddings` if needed.
+
+        Args:
+            dim: Dimension of the embeddings
+            embeddings: Normalized embeddings of the docstrings
+        """
+        if self.index_type == "flat":
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        if self.index_type == "hnsw":
+            index = faiss.index_factory(dim, f"IDMap2,HNSW{self.hnsw_m},Flat", faiss.METRIC_INNER_PRODUCT)
+            faiss.downcast_index(index.index).hnsw.efConstruction = self.ef_construction
+            return index
+
+        if self.index_type == "ivf_pq" and dim % self.pq_m != 0:
+            raise ValueError(f"pq_m={self.pq_m} does not divide the dimension {dim}")
+        # k-means needs about 39 points per cluster
+        nlist = max(1, min(self.nlist, len(embeddings) // 39))
+        if self.index_type == "ivf_flat":
+            factory = f"IVF{nlist},Flat"
+        else:
+            factory = f"IVF{nlist},PQ{self.pq_m}x{self.pq_bits}"
+        index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+        if len(embeddings) > self.train_size:
+            rows = np.sort(np.random.default_rng(0).choice(len(embeddings), self.train_size, replace=False))
+            sample = np.asarray(embeddings[rows])
+        else:
+            sample = np.asarray(embeddings)
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        return index
+
+    def configure(self, index: faiss.Index) -> None:
+        """Set the search parameters of an index (not saved with it)."""
+        if self.index_type in ("ivf_flat", "ivf_pq"):
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        elif self.index_type == "hnsw":
+            faiss.downcast_index(index.index).hnsw.efSearch = self.ef_search
+
+    def search_parameters(self, selector: faiss.IDSelector) -> faiss.SearchParameters:
+        """Search parameters restricting the search to the ids of `selector`."""
+        if self.index_type in ("ivf_flat", "ivf_pq"):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query for cache lookups.
+
+    Leading/trailing whitespace is dropped and inner runs of whitespace are collapsed.
+    The case is kept, since embedding models are case sensitive.
+    """
+    return " ".join(query.split())
+
+
+class QueryEmbeddingStore:
+    """
+    On-disk store of query embeddings, kept across runs.
+
+    Embeddings are stored as float32 blobs in a SQLite database keyed by the
+    normalized query. The store is thread-safe.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the store.
+
+        Args:
+            path: Path of the database
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        """Return the embedding of a normalized query, of shape (1, d), or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT embedding FROM queries WHERE query = ?", (query,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return np.frombuffer(row[0], dtype=np.float32).reshape(1, -1).copy()
+
+    def put(self, query: str, embedding: np.ndarray) -> None:
+        """Store the embedding of a normalized query."""
+        blob = np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO queries (query, embedding) VALUES (?, ?)", (query, blob)
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class QueryCache:
+    """
+    Two-level cache of search queries.
+
+    The first level is a bounded in-memory LRU of (normalized query, top_k) to search
+    results, the second level is an optional `QueryEmbeddingStore`, so that a query
+    seen in a previous run is searched again without encoding it.
+    """
+
+    def __init__(self, maxsize: int = 1024, store: Optional[QueryEmbeddingStore] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of results kept in memory (0 disables the LRU)
+            store: On-disk store of query embeddings (default: none)
+        """
+        self.maxsize = maxsize
+        self.store = store
+        self.entries: "OrderedDict[Tuple[str, Hashable], List[Tuple[float, Dict, str]]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query: str, top_k: Hashable) -> Optional[List[Tuple[float, Dict, str]]]:
+        """Return a copy of the cached results of a normalized query, or None."""
+        key = (query, top_k)
+        with self.lock:
+            results = self.entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return [(score, dict(element), fqn) for score, element, fqn in results]
+
+    def put(self, query: str, top_k: Hashable, results: List[Tuple[float, Dict, str]]) -> None:
+        """Cache the results of a normalized query."""
+        if self.maxsize <= 0:
+            return
+        key = (query, top_k)
+        results = [(score, dict(element), fqn) for score, element, fqn in results]
+        with self.lock:
+            self.entries[key] = results
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all in-memory entries (statistics and the on-disk store are kept)."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate statistics of both levels."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "size": len(self.entries),
+                "lookups": lookups,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+        if self.store is not None:
+            store_lookups = self.store.hits + self.store.misses
+            stats["embedding_hits"] = self.store.hits
+            stats["embedding_misses"] = self.store.misses
+            stats["embedding_hit_rate"] = self.store.hits / store_lookups if store_lookups else 0.0
+        return stats
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+
+class EntryMetadata:
+    """
+    File, start line and kind of the entries of an index, as arrays aligned with
+    their positions, so that filters are evaluated on all the entries at once.
+
+    The file is the `parent` of a docstring (or its `file`), entries without
+    metadata never match a file or a kind.
+    """
+
+    def __init__(self, fqns: List[str], elements: List[Dict[str, Any]]):
+        self.positions = {fqn: position for position, fqn in enumerate(fqns)}
+        self.files: Dict[str, int] = {}
+        self.kinds: Dict[str, int] = {}
+        self.file_codes = np.array(
+            [self._code(self.files, element.get("parent", element.get("file"))) for element in elements],
+            dtype=np.int32,
+        )
+        self.kind_codes = np.array(
+            [self._code(self.kinds, element.get("kind")) for element in elements], dtype=np.int32
+        )
+        self.start_lines = np.array(
+            [-1 if element.get("start_line") is None else element["start_line"] for element in elements],
+            dtype=np.int64,
+        )
+
+    @staticmethod
+    def _code(codes: Dict[str, int], value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        return codes.setdefault(value, len(codes))
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Predicates on the entries of an index, applied during the search.
+
+    An entry is kept if it satisfies all the predicates that are set:
+
+    - before: (file, line), hides the entries of `file` starting at or after `line`,
+      i.e. the lemmas not yet defined when proving a theorem at this line
+    - kinds: kinds of entries kept
+    - include: names of the only entries kept
+    - exclude: names of entries hidden
+
+    Filters are hashable, so they are part of the cache keys of the results.
+    """
+
+    before: Optional[Tuple[str, int]] = None
+    kinds: Optional[FrozenSet[str]] = None
+    include: Optional[FrozenSet[str]] = None
+    exclude: FrozenSet[str] = frozenset()
+
+    def __post_init__(self):
+        for name in ("kinds", "include", "exclude"):
+            value = getattr(self, name)
+            if value is not None and not isinstance(value, frozenset):
+                object.__setattr__(self, name, frozenset(value))
+        if self.before is not None:
+            object.__setattr__(self, "before", tuple(self.before))
+
+    @classmethod
+    def defined_before(cls, element: Dict[str, Any], **kwargs) -> "SearchFilter":
+        """Filter hiding the entries defined after `element` (an entry of the docstrings) in its file."""
+        file = element.get("parent", element.get("file"))
+        if file is None or element.get("start_line") is None:
+            return cls(**kwargs)
+        return cls(before=(file, element["start_line"]), **kwargs)
+
+    def mask(self, metadata: EntryMetadata) -> np.ndarray:
+        """Boolean array of the entries kept, by position."""
+        if self.include is not None:
+            mask = np.zeros(len(metadata), dtype=bool)
+            mask[[metadata.positions[fqn] for fqn in self.include if fqn in metadata.positions]] = True
+        else:
+            mask = np.ones(len(metadata), dtype=bool)
+        if self.before is not None:
+            file, line = self.before
+            code = metadata.files.get(file)
+            if code is not None:
+                mask &= ~((metadata.file_codes == code) & (metadata.start_lines >= line))
+        if self.kinds is not None:
+            codes = [metadata.kinds[kind] for kind in self.kinds if kind in metadata.kinds]
+            mask &= np.isin(metadata.kind_codes, codes)
+        hidden = [metadata.positions[fqn] for fqn in self.exclude if fqn in metadata.positions]
+        mask[hidden] = False
+        return mask
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, List, Union
 from abc import ABC, abstractmethod
 
 import torch
@@ -24,10 +24,19 @@ class BaseEmbedding(ABC):
     """Abstract base class for embedding model."""
 
     @abstractmethod
-    def generate(self, sentence:str, query=False) -> Tensor:
-        """Generate an embedding"""
+    def generate(self, sentence:Union[str, List[str]], query=False) -> Tensor:
+        """Generate an embedding, or a batch of embeddings for a list of sentences"""
         pass
 
     @abstractmethod
     def name(self) -> str:
         pass
+
+    def token_lengths(self, sentences: List[str]) -> List[int]:
+        """Number of tokens of each sentence (estimated from its length without tokenizer)."""
+        tokenizer = getattr(self, "tokenizer", None)
+        if tokenizer is None:
+            return [len(sentence) // 4 + 1 for sentence in sentences]
+        max_length = getattr(self, "max_length", None)
+        encoded = tokenizer(sentences, truncation=max_length is not None, max_length=max_length)
+        return [len(ids) for ids in encoded["input_ids"]]
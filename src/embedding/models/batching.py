@@ -0,0 +1,87 @@
+from typing import Iterator, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+from .base import BaseEmbedding
+
+
+def length_buckets(
+    lengths: List[int], max_tokens: Optional[int] = None, max_batch_size: Optional[int] = None
+) -> List[List[int]]:
+    """
+    Group inputs into batches of similar lengths.
+
+    Inputs are sorted by decreasing length, so that each batch is padded to a length
+    close to the length of its inputs, and the largest batch comes first (an out of
+    memory error happens right away). A batch is closed when its padded size
+    (number of inputs times the longest length) would exceed `max_tokens`, or when
+    it has `max_batch_size` inputs. An input longer than `max_tokens` is alone in
+    its batch.
+
+    Args:
+        lengths: Number of tokens of each input
+        max_tokens: Maximum number of tokens of a batch, padding included (default: no limit)
+        max_batch_size: Maximum number of inputs of a batch (default: no limit)
+
+    Returns:
+        Batches of indices of the inputs
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch: List[int] = []
+    for i in order:
+        # The first input of a batch is its longest
+        longest = lengths[batch[0]] if batch else lengths[i]
+        if batch and (
+            (max_tokens is not None and (len(batch) + 1) * longest > max_tokens)
+            or (max_batch_size is not None and len(batch) >= max_batch_size)
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def iter_generate_batched(
+    model: BaseEmbedding,
+    sentences: List[str],
+    max_tokens: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    query: bool = False,
+) -> Iterator[Tuple[List[int], Tensor]]:
+    """
+    Embed sentences in batches of similar lengths (see `length_buckets`).
+
+    Yields:
+        The indices of the sentences of each batch and their embeddings, in the
+        order of the batches
+    """
+    if not sentences:
+        return
+    lengths = model.token_lengths(sentences)
+    for batch in length_buckets(lengths, max_tokens, max_batch_size):
+        yield batch, model.generate([sentences[i] for i in batch], query=query)
+
+
+def generate_batched(
+    model: BaseEmbedding,
+    sentences: List[str],
+    max_tokens: Optional[int] = None,
+    max_batch_size: Optional[int] = None,
+    query: bool = False,
+) -> Tensor:
+    """Embed sentences in batches of similar lengths, returned in the order of `sentences`."""
+    indices, embeddings = [], []
+    for batch, batch_embeddings in iter_generate_batched(model, sentences, max_tokens, max_batch_size, query):
+        indices.extend(batch)
+        embeddings.append(batch_embeddings.detach())
+    if not embeddings:
+        return torch.empty(0)
+    embeddings = torch.cat(embeddings, dim=0)
+    # Inverse permutation of the batches
+    positions = torch.empty(len(indices), dtype=torch.long)
+    positions[torch.tensor(indices, dtype=torch.long)] = torch.arange(len(indices))
+    return embeddings[positions]
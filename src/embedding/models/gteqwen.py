@@ -1,3 +1,5 @@
+from typing import List, Union
+
 import torch
 from torch import Tensor
 import torch.nn.functional as F
@@ -22,21 +24,24 @@ def get_detailed_instruct(task_description: str, query: str) -> str:
 
 class GteQwenEmbedding(BaseEmbedding):
     """Wrapper around the gte-Qwen embedding model."""
-    def __init__(self, device:str):
+    def __init__(self, device:str, max_length: int=8192):
         super().__init__()
         model_id = 'Alibaba-NLP/gte-Qwen2-7B-instruct'
         self.device = device
+        self.max_length = max_length
         self.tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
         self.model = AutoModel.from_pretrained(model_id, trust_remote_code=True).to(device, dtype=torch.bfloat16)
         self.prompt_query = 'Given a natural language query, retrieve formal Coq statements whose docstrings best match the intent of the query.'
     
-    def generate(self, sentence:str, query=False) -> Tensor:
-        if query:
+    def generate(self, sentence:Union[str, List[str]], query=False) -> Tensor:
+        if query and isinstance(sentence, list):
+            input_text = [get_detailed_instruct(self.prompt_query, s) for s in sentence]
+        elif query:
             input_text = get_detailed_instruct(self.prompt_query, sentence)
         else:
             input_text = sentence
         
-        batch_dict = self.tokenizer(input_text, padding=True, truncation=True, return_tensors='pt').to(self.device)
+        batch_dict = self.tokenizer(input_text, padding=True, truncation=True, max_length=self.max_length, return_tensors='pt').to(self.device)
         outputs = self.model(**batch_dict)
         embeddings = last_token_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
         embeddings = F.normalize(embeddings, p=2, dim=1) 
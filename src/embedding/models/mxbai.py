@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, List, Union
 
 import torch
 from torch import Tensor
@@ -25,17 +25,20 @@ def pooling(outputs: torch.Tensor, inputs: Dict,  strategy: str = 'cls') -> np.n
 
 class MxbaiEmbedding(BaseEmbedding):
     """Wrapper around the MXBai embedding model."""
-    def __init__(self, device):
+    def __init__(self, device, max_length=512):
         super().__init__()
         self.device = device
+        self.max_length = max_length
         model_id = 'mixedbread-ai/mxbai-embed-large-v1'
         self.tokenizer = AutoTokenizer.from_pretrained(model_id)
         self.model = AutoModel.from_pretrained(model_id).to(device, dtype=torch.bfloat16)
 
-    def generate(self, sentence:str, query=False) -> Tensor:
-        if query:
+    def generate(self, sentence:Union[str, List[str]], query=False) -> Tensor:
+        if query and isinstance(sentence, list):
+            sentence = [transform_query(s) for s in sentence]
+        elif query:
             sentence = transform_query(sentence)
-        inputs = self.tokenizer(sentence, padding=True, return_tensors='pt', truncation=True).to(self.device)
+        inputs = self.tokenizer(sentence, padding=True, return_tensors='pt', truncation=True, max_length=self.max_length).to(self.device)
         outputs = self.model(**inputs).last_hidden_state
         embeddings = pooling(outputs, inputs, 'cls')
         return F.normalize(embeddings, p=2, dim=1) 
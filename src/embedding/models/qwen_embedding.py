@@ -1,3 +1,5 @@
+from typing import List, Union
+
 import torch
 from torch import Tensor
 import torch.nn.functional as F
@@ -24,22 +26,25 @@ def get_detailed_instruct(task_description: str, query: str) -> str:
 
 class Qwen3Embedding(BaseEmbedding):
     """Wrapper around Qwen embedding models."""
-    def __init__(self, device:str, size: str="0.6B"):
+    def __init__(self, device:str, size: str="0.6B", max_length: int=8192):
         super().__init__()
         assert size in ['0.6B', '4B', '8B']
         model_id = 'Qwen/Qwen3-Embedding-' + size
         self.device = device
+        self.max_length = max_length
         self.tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
         self.model = AutoModel.from_pretrained(model_id, trust_remote_code=True).to(device, dtype=torch.float32)
         self.prompt_query = 'Given a natural language query, retrieve formal Coq statements whose docstrings best match the intent of the query.'
     
-    def generate(self, sentence:str, query=False) -> Tensor:
-        if query:
+    def generate(self, sentence:Union[str, List[str]], query=False) -> Tensor:
+        if query and isinstance(sentence, list):
+            input_text = [get_detailed_instruct(self.prompt_query, s) for s in sentence]
+        elif query:
             input_text = get_detailed_instruct(self.prompt_query, sentence)
         else:
             input_text = sentence
         
-        batch_dict = self.tokenizer(input_text, padding=True, truncation=True, return_tensors='pt').to(self.device)
+        batch_dict = self.tokenizer(input_text, padding=True, truncation=True, max_length=self.max_length, return_tensors='pt').to(self.device)
         outputs = self.model(**batch_dict)
         embeddings = last_token_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
         embeddings = F.normalize(embeddings, p=2, dim=1) 
@@ -49,22 +54,22 @@ class Qwen3Embedding(BaseEmbedding):
         return "qwen_embedding_base"
 
 class Qwen3Embedding600m(Qwen3Embedding):
-    def __init__(self, device):
-        super().__init__(device, "0.6B")
+    def __init__(self, device, max_length=8192):
+        super().__init__(device, "0.6B", max_length)
     
     def name(self) -> str:
         return "qwen_embedding_600m"
 
 class Qwen3Embedding4b(Qwen3Embedding):
-    def __init__(self, device):
-        super().__init__(device, "4B")
+    def __init__(self, device, max_length=8192):
+        super().__init__(device, "4B", max_length)
     
     def name(self) -> str:
         return "qwen_embedding_4b"
 
 class Qwen3Embedding8b(Qwen3Embedding):
-    def __init__(self, device):
-        super().__init__(device, "8B")
+    def __init__(self, device, max_length=8192):
+        super().__init__(device, "8B", max_length)
     
     def name(self) -> str:
         return "qwen_embedding_8b"
\ No newline at end of file
@@ -1,10 +1,17 @@
 from typing import List, Dict, Any, Optional, Union, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import re
 import json
+import asyncio
+import threading
 from dataclasses import dataclass
 
 from .tools import Tool
 from .llm import LLM
+from .transposition import TranspositionTable
+from .deadline import Deadline, current_deadline, propagate
+from .llm_logger import log_context
 
 
 @dataclass
@@ -22,8 +29,10 @@ class Parser:
     """Parse LLM outputs to identify tool calls."""
 
     def __init__(self):
-        # We'll dynamically create patterns based on registered tools
-        self.tool_patterns = {}
+        # Tool name of each registered tag
+        self.tags: Dict[str, str] = {}
+        # Opening tag of any registered tool, rebuilt when a tool is registered
+        self.open_pattern: Optional[re.Pattern] = None
 
     def register_tool(self, tool_name: str, tag: str):
         """
@@ -33,36 +42,131 @@ class Parser:
             tool_name: The name of the tool
             tag: The XML tag to use for this tool (without angle brackets)
         """
-        # Create a regex pattern for this tag - using non-greedy matching
-        pattern = re.compile(f"<{tag}>(.*?)</{tag}>", re.DOTALL)
-        self.tool_patterns[tool_name] = pattern
+        self.tags[tag] = tool_name
+        # Longest tags first, so that a tag is not matched by one of its prefixes
+        alternatives = sorted(self.tags, key=len, reverse=True)
+        self.open_pattern = re.compile(
+            "<(" + "|".join(re.escape(t) for t in alternatives) + ")>"
+        )
 
-    def extract_next_tool_call(self, text: str) -> Optional[Tuple[str, str, int, int]]:
+    def extract_next_tool_call(
+        self, text: str, start: int = 0
+    ) -> Optional[Tuple[str, str, int, int]]:
         """
         Extract the next tool call from text.
 
+        The text is scanned once for the opening tags of all tools, and the first
+        opening tag that is closed gives the tool call.
+
+        Args:
+            text: The text to parse
+            start: Position to start from
+
         Returns:
             Tuple of (tool_name, tool_input, start_position, end_position) or None if no tool call is found
         """
-        # Find all matches for each registered pattern
-        all_matches = []
+        if self.open_pattern is None:
+            return None
+        # Tags that are not closed after some position are not closed after later ones
+        unclosed = set()
+        pos = start
+        while (match := self.open_pattern.search(text, pos)) is not None:
+            tag = match.group(1)
+            if tag not in unclosed:
+                close = text.find(f"</{tag}>", match.end())
+                if close != -1:
+                    return (
+                        self.tags[tag],
+                        text[match.end() : close].strip(),
+                        match.start(),
+                        close + len(tag) + 3,
+                    )
+                unclosed.add(tag)
+            pos = match.start() + 1
+        return None
 
-        for tool_name, pattern in self.tool_patterns.items():
-            matches = [
-                (m.start(), m.end(), tool_name, m.group(1).strip())
-                for m in pattern.finditer(text)
-            ]
-            all_matches.extend(matches)
+    def stream(self) -> "ToolCallStream":
+        """Return a parser for a text received in chunks (see `ToolCallStream`)."""
+        return ToolCallStream(self)
 
-        # Sort by position to get the first occurrence
-        all_matches.sort()
 
-        # Return the first match if any
-        if all_matches:
-            start_pos, end_pos, tool_name, tool_input = all_matches[0]
-            return (tool_name, tool_input, start_pos, end_pos)
+class ToolCallStream:
+    """
+    Incremental parser of the first tool call of a streamed text.
 
-        return None
+    Each chunk is scanned once, together with the last few characters before it
+    in case a tag is split between chunks, so the parsing cost is linear in the
+    length of the text. The tool call is known as soon as its closing tag arrives.
+    """
+
+    def __init__(self, parser: Parser):
+        self.parser = parser
+        self.chunks: List[str] = []
+        self.length = 0
+        # End of the text already scanned, kept to find tags split between chunks
+        self.tail = ""
+        # First opening tag, waiting for its closing tag: (tag, start position)
+        self.pending: Optional[Tuple[str, int]] = None
+        # Content of the pending tool call received so far
+        self.content: List[str] = []
+        self.tool_call: Optional[Tuple[str, str, int, int]] = None
+
+    def feed(self, chunk: str) -> Optional[Tuple[str, str, int, int]]:
+        """
+        Add a chunk of text.
+
+        Returns:
+            The first tool call once it is complete, with its positions in the whole
+            text (see `Parser.extract_next_tool_call`)
+        """
+        if self.tool_call is not None or self.parser.open_pattern is None:
+            return self.tool_call
+        self.chunks.append(chunk)
+        chunk_start = self.length
+        self.length += len(chunk)
+
+        if self.pending is None:
+            window = self.tail + chunk
+            match = self.parser.open_pattern.search(window)
+            if match is None:
+                max_open_len = max(len(tag) for tag in self.parser.tags) + 2
+                self.tail = window[max(0, len(window) - max_open_len + 1) :]
+                return None
+            tag = match.group(1)
+            self.pending = (tag, chunk_start - len(self.tail) + match.start())
+            self.tail = ""
+            chunk = window[match.end() :]
+
+        tag, start = self.pending
+        closing = f"</{tag}>"
+        window = self.tail + chunk
+        close = window.find(closing)
+        self.content.append(chunk)
+        if close == -1:
+            self.tail = window[max(0, len(window) - len(closing) + 1) :]
+            return None
+
+        content = "".join(self.content)
+        close_in_content = len(content) - len(window) + close
+        content_start = start + len(tag) + 2
+        self.tool_call = (
+            self.parser.tags[tag],
+            content[:close_in_content].strip(),
+            start,
+            content_start + close_in_content + len(closing),
+        )
+        return self.tool_call
+
+    def finish(self) -> Optional[Tuple[str, str, int, int]]:
+        """
+        End of the text: if the first opening tag was never closed, look for a tool
+        call after it (as `Parser.extract_next_tool_call` on the whole text).
+        """
+        if self.tool_call is None and self.pending is not None:
+            self.tool_call = self.parser.extract_next_tool_call(
+                "".join(self.chunks), self.pending[1] + 1
+            )
+        return self.tool_call
 
 
 # ===============================================
@@ -80,10 +184,19 @@ class ToolHandler:
     3. Updating the LLM context with tool results
     """
 
-    def __init__(self, parser: Parser, tools: Dict[str, Tool]):
+    def __init__(
+        self,
+        parser: Parser,
+        tools: Dict[str, Tool],
+        merge_transpositions: bool = False,
+    ):
         self.parser = parser
         self.tools = tools
 
+        # Stop exploring beams that reach a proof state already explored by another beam
+        self.merge_transpositions = merge_transpositions
+        self.transpositions = TranspositionTable()
+
         # Register all tools with the parser
         for tool_name, tool in tools.items():
             self.parser.register_tool(tool_name, tool.tag)
@@ -91,7 +204,34 @@ class ToolHandler:
         # Define a constant for the result tag
         self.RESULT_TAG = "RESULT"
 
-    def process_with_tools(self, llm: LLM, prompt: str, beam_size: int = 1) -> Status:
+    def _format_result(
+        self, tool_name: str, tool_result: Any, current_tool: Tool
+    ) -> Tuple[Optional[Status], Optional[str]]:
+        """
+        Turn the result of a tool call into the next step of a beam.
+
+        Returns:
+            Tuple of (status, text). `status` is set when the proof is complete,
+            `text` is the result block to append to the prompt of the beam, or
+            None if the beam should be discarded.
+        """
+        if tool_name == "search":
+            # Keep this beam active
+            return None, f"<{self.RESULT_TAG}>\n{tool_result['content']}\n</{self.RESULT_TAG}>"
+        if tool_name == "coq-prover" and tool_result["status"] == "success":
+            if tool_result["is_complete"]:
+                # Proof is complete
+                return Status(success=True, proof=current_tool.env.proof), None
+            # Proof is progressing, keep this beam active
+            goal = tool_result.get("goal") or current_tool.env.new_goal_pp
+            result_text = f"Goals: {goal}"
+            return None, f"<{self.RESULT_TAG}>\n{result_text}\n</{self.RESULT_TAG}>"
+        # Proof failed, discard this beam
+        return None, None
+
+    def process_with_tools(
+        self, llm: LLM, prompt: str, beam_size: int = 1, concurrent: bool = False
+    ) -> Status:
         """
         Process LLM generation with tool support using beam search.
 
@@ -102,23 +242,29 @@ class ToolHandler:
             llm: The language model to use
             prompt: The initial prompt
             beam_size: Number of parallel paths to explore (default: 1)
+            concurrent: Run each beam as its own asyncio task instead of in lock-step
+                        (see `aprocess_with_tools`)
 
         Returns:
             Status object with success flag and proof steps
         """
+        if concurrent:
+            return asyncio.run(self.aprocess_with_tools(llm, prompt, beam_size))
+
         # Initialize fixed-size arrays for all beams
         all_prompts = [prompt] * beam_size
 
-        # Create deep copies of the Coq prover tool for each beam
+        # Fork the Coq prover tool for each beam
         if "coq-prover" in self.tools:
             all_coq_tools = [
-                self.tools["coq-prover"].deepcopy() for _ in range(beam_size)
+                self.tools["coq-prover"].fork() for _ in range(beam_size)
             ]
         else:
             all_coq_tools = [None] * beam_size
 
         # Track which beams are active
         active_indices = list(range(beam_size))
+        self.transpositions = TranspositionTable()
 
         # Create a list of stop sequences from tool tags
         stop_sequences = [f"</{tool.tag}>" for tool in self.tools.values()]
@@ -128,66 +274,266 @@ class ToolHandler:
             # Collect only the active prompts for the LLM
             active_prompts = [all_prompts[i] for i in active_indices]
 
-            # Generate responses only for active beams
-            responses = llm.generate_batch(active_prompts, stop_sequences)
+            # Beams that are still being explored
+            alive = set(active_indices)
 
             # New set of active indices for the next iteration
             new_active_indices = []
 
-            # Process each response for active beams
-            for idx_pos, idx in enumerate(active_indices):
-                response = responses[idx_pos]
-
-                # Update the full prompt for this beam
-                all_prompts[idx] += response
-
-                # Check if there's a tool call in the new response only
-                tool_call = self.parser.extract_next_tool_call(response)
-
-                if not tool_call:
-                    # No tool call found, this beam is done
-                    continue
-
-                tool_name, tool_input, start_pos, end_pos = tool_call
+            # Searches of this iteration, run together once all responses are in
+            pending_searches = []
+
+            # Generate responses only for active beams and process each of them
+            # as soon as it is available, the tool calls being parsed as the
+            # responses are streamed
+            parsers = [self.parser.stream() for _ in active_prompts]
+            # The stream is closed (and its batch logged) in the context of the beams
+            with log_context(beams=active_indices), closing(
+                llm.generate_batch_stream(active_prompts, stop_sequences, parsers)
+            ) as responses:
+                for idx_pos, response in responses:
+                    idx = active_indices[idx_pos]
+
+                    # Update the full prompt for this beam
+                    all_prompts[idx] += response
+
+                    # Tool call of the new response only
+                    tool_call = parsers[idx_pos].finish()
+
+                    if not tool_call:
+                        # No tool call found, this beam is done
+                        alive.discard(idx)
+                        continue
 
-                # Use the corresponding tool instance for this beam
-                if tool_name == "coq-prover":
-                    current_tool = all_coq_tools[idx]
-                else:
-                    current_tool = self.tools[tool_name]
+                    tool_name, tool_input, start_pos, end_pos = tool_call
 
-                # Execute the tool
-                tool_result = current_tool.run(tool_input)
+                    if tool_name == "search":
+                        pending_searches.append((idx, tool_input))
+                        continue
 
-                # Format the tool result
-                if tool_name == "search":
-                    # Keep this beam active
-                    all_prompts[
-                        idx
-                    ] += f"<{self.RESULT_TAG}>\n{tool_result['content']}\n</{self.RESULT_TAG}>"
-                    new_active_indices.append(idx)
-                elif tool_name == "coq-prover":
-                    if tool_result["status"] == "success":
-                        if tool_result["is_complete"]:
-                            # Proof is complete, return success immediately
-                            return Status(success=True, proof=current_tool.env.proof)
-                        else:
-                            # Proof is progressing, keep this beam active
-                            result_text = f"Goals: {tool_result['goal']}"
-                            all_prompts[
-                                idx
-                            ] += f"<{self.RESULT_TAG}>\n{result_text}\n</{self.RESULT_TAG}>"
-                            new_active_indices.append(idx)
+                    # Use the corresponding tool instance for this beam
+                    if tool_name == "coq-prover":
+                        current_tool = all_coq_tools[idx]
                     else:
-                        # Proof failed, discard this beam (don't add to new_active_indices)
-                        continue
+                        current_tool = self.tools[tool_name]
+
+                    # Execute the tool
+                    tool_result = current_tool.run(tool_input)
+
+                    status, result_text = self._format_result(
+                        tool_name, tool_result, current_tool
+                    )
+                    if status:
+                        # Proof is complete, return success immediately
+                        return status
+                    if result_text is not None and not (
+                        tool_name == "coq-prover"
+                        and self._is_transposition(idx, current_tool, alive)
+                    ):
+                        all_prompts[idx] += result_text
+                        new_active_indices.append(idx)
+                    else:
+                        alive.discard(idx)
+
+            if pending_searches:
+                search_tool = self.tools["search"]
+                tool_results = search_tool.run_batch(
+                    [tool_input for _, tool_input in pending_searches]
+                )
+                for (idx, _), tool_result in zip(pending_searches, tool_results):
+                    _, result_text = self._format_result("search", tool_result, search_tool)
+                    all_prompts[idx] += result_text
+                    new_active_indices.append(idx)
 
             # Update active indices for next iteration
-            active_indices = new_active_indices
+            active_indices = sorted(new_active_indices)
 
         # If we've reached here, no beam succeeded
         return Status(success=False, proof=[])
 
+    def _is_transposition(self, beam: int, coq_tool: Tool, alive: set) -> bool:
+        """
+        Check whether a beam reached a proof state already explored by another live beam.
+
+        The beam is then merged into the other one, i.e. it should be discarded.
+        """
+        if not self.merge_transpositions:
+            return False
+        return self.transpositions.claim(coq_tool.env.state_key, beam, alive) is not None
+
+    async def _run_beam(
+        self,
+        beam: int,
+        llm: LLM,
+        prompt: str,
+        tools: Dict[str, Tool],
+        locks: Dict[str, threading.Lock],
+        stop_sequences: List[str],
+        executor: ThreadPoolExecutor,
+        alive: set,
+    ) -> Optional[Status]:
+        """
+        Run a single beam until it finds a proof, fails or stops calling tools.
+
+        Blocking calls (LLM generation, Coq checks, searches) are run in `executor`
+        so that the other beams keep progressing in the meantime.
+
+        Args:
+            tools: Tools of this beam, by name
+            locks: Locks of the tools shared with the other beams, by name
+        """
+        try:
+            return await self._explore_beam(
+                beam, llm, prompt, tools, locks, stop_sequences, executor, alive
+            )
+        finally:
+            alive.discard(beam)
+
+    @staticmethod
+    def _run_tool(tool: Tool, lock: Optional[threading.Lock], tool_input: str) -> Any:
+        """Run a tool, holding its lock if it is shared by several beams."""
+        if lock is None:
+            return tool.run(tool_input)
+        with lock:
+            return tool.run(tool_input)
+
+    async def _explore_beam(
+        self,
+        beam: int,
+        llm: LLM,
+        prompt: str,
+        tools: Dict[str, Tool],
+        locks: Dict[str, threading.Lock],
+        stop_sequences: List[str],
+        executor: ThreadPoolExecutor,
+        alive: set,
+    ) -> Optional[Status]:
+        loop = asyncio.get_running_loop()
+        coq_tool = tools.get("coq-prover")
+        while True:
+            # The executor threads must see the deadline of the beams
+            response = await loop.run_in_executor(
+                executor, propagate(llm.generate), prompt, stop_sequences
+            )
+            prompt += response
+
+            tool_call = self.parser.extract_next_tool_call(response)
+            if not tool_call:
+                return None
+
+            tool_name, tool_input, _, _ = tool_call
+            current_tool = tools[tool_name]
+
+            tool_result = await loop.run_in_executor(
+                executor, propagate(self._run_tool), current_tool, locks.get(tool_name), tool_input
+            )
+
+            status, result_text = self._format_result(
+                tool_name, tool_result, current_tool
+            )
+            if status:
+                return status
+            if result_text is None:
+                return None
+            if tool_name == "coq-prover" and self.merge_transpositions:
+                # The state key needs a Coq round-trip, the table is only
+                # accessed from the event loop
+                key = await loop.run_in_executor(
+                    executor, propagate(lambda: coq_tool.env.state_key)
+                )
+                if self.transpositions.claim(key, beam, alive) is not None:
+                    return None
+            prompt += result_text
+
+    async def aprocess_with_tools(
+        self, llm: LLM, prompt: str, beam_size: int = 1
+    ) -> Status:
+        """
+        Asynchronous version of `process_with_tools`.
+
+        Each beam runs as its own task going through generate -> parse -> tool -> generate,
+        so that LLM generations, Coq checks and searches of different beams overlap.
+        Each beam forks the tools (see `Tool.fork`): the Coq tools get their own Pytanque
+        connection, and the tools shared by the beams are called by one beam at a time.
+        The first successful beam wins and the remaining ones are cancelled through their
+        deadline (see `Deadline`): streamed generations are closed and no new tactic is
+        sent. The calls still running are not waited for, the connections of the beams
+        are closed in the background once they are done.
+
+        Args:
+            llm: The language model to use
+            prompt: The initial prompt
+            beam_size: Number of parallel paths to explore (default: 1)
+
+        Returns:
+            Status object with success flag and proof steps
+        """
+        stop_sequences = [f"</{tool.tag}>" for tool in self.tools.values()]
+
+        self.transpositions = TranspositionTable()
+        alive = set(range(beam_size))
+
+        # Deadline of the beams, within the deadline of the caller if any
+        outer = current_deadline()
+        deadline = Deadline(outer.remaining() if outer is not None else None)
+
+        # One generation and one tool call in flight per beam at most
+        executor = ThreadPoolExecutor(max_workers=beam_size)
+        all_tools: List[Dict[str, Tool]] = []
+        tasks = []
+        try:
+            for _ in range(beam_size):
+                tools = {}
+                all_tools.append(tools)
+                for tool_name, tool in self.tools.items():
+                    tools[tool_name] = tool.fork(new_connection=True)
+            locks = {
+                tool_name: threading.Lock()
+                for tool_name, tool in self.tools.items()
+                if any(tools[tool_name] is tool for tools in all_tools)
+            }
+
+            # The tasks copy the current context, and so the deadline of the beams
+            # and the beam id of their logged prompts
+            tasks = []
+            with deadline.activate():
+                for beam, tools in enumerate(all_tools):
+                    with log_context(beam=beam):
+                        tasks.append(
+                            asyncio.create_task(
+                                self._run_beam(
+                                    beam, llm, prompt, tools, locks, stop_sequences, executor, alive
+                                )
+                            )
+                        )
+            for next_done in asyncio.as_completed(tasks):
+                status = await next_done
+                if status and status.success:
+                    return status
+            return Status(success=False, proof=[])
+        finally:
+            deadline.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+            forks = [
+                tool
+                for tools in all_tools
+                for tool_name, tool in tools.items()
+                if tool is not self.tools[tool_name]
+            ]
+            threading.Thread(
+                target=self._close_tools, args=(executor, forks), daemon=True
+            ).start()
+
+    @staticmethod
+    def _close_tools(executor: ThreadPoolExecutor, tools: List[Tool]) -> None:
+        """Close forked tools once the calls still running in `executor` are done."""
+        executor.shutdown(wait=True)
+        for tool in tools:
+            tool.close()
+
 
 # ===============================================
 # Main Agent Class
@@ -197,10 +543,19 @@ class ToolHandler:
 class MathProofAgent:
     """Main agent for formal mathematics proving."""
 
-    def __init__(self, llm: LLM, search_tool: Tool, script_tool: Tool, have_tool: Tool):
+    def __init__(
+        self,
+        llm: LLM,
+        search_tool: Tool,
+        script_tool: Tool,
+        have_tool: Tool,
+        merge_transpositions: bool = False,
+    ):
         self.llm = llm
         self.tools = {search_tool.name: search_tool, script_tool.name: script_tool, have_tool.name: have_tool}
-        self.tool_handler = ToolHandler(parser=Parser(), tools=self.tools)
+        self.tool_handler = ToolHandler(
+            parser=Parser(), tools=self.tools, merge_transpositions=merge_transpositions
+        )
         self.current_proof = script_tool.env.thm_code
 
     def build_prompt(self) -> str:
@@ -528,13 +883,16 @@ Are you ready? Here is the initial goal.
 """
         return prompt
 
-    def run_proof(self, beam_size: int = 1, verbose: bool = False) -> Status:
+    def run_proof(
+        self, beam_size: int = 1, verbose: bool = False, concurrent: bool = False
+    ) -> Status:
         """
         Run the proof using beam search.
 
         Args:
             beam_size: Number of parallel paths to explore (default: 1)
             verbose: Whether to print verbose output (default: False)
+            concurrent: Whether to run the beams asynchronously (default: False)
 
         Returns:
             Status object with success flag and proof steps
@@ -543,6 +901,8 @@ Are you ready? Here is the initial goal.
         prompt = self.build_prompt()
 
         # Generate response with tool support using beam search
-        response = self.tool_handler.process_with_tools(self.llm, prompt, beam_size)
+        response = self.tool_handler.process_with_tools(
+            self.llm, prompt, beam_size, concurrent=concurrent
+        )
 
         return response
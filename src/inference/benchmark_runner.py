@@ -2,12 +2,18 @@ import os
 import json
 import time
 import argparse
-from typing import List, Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Tuple, Optional
 from datetime import datetime
 
 from .pass_at_k_prover import PassAtKProver
 from .tools import ScriptTool
 from .llm import VLLM
+from .pet_pool import PetServerPool
+from .results_log import ResultsLog
+from .deadline import Deadline
+from .tracing import Tracer
+from .llm_logger import log_context
 from pytanque import Pytanque
 
 
@@ -37,6 +43,14 @@ class BenchmarkRunner:
         verbose: bool = False,
         context: bool = False,
         llm_log_dir: str = "llm_logs",
+        stream: bool = False,
+        n_sampling: bool = False,
+        merge_transpositions: bool = False,
+        num_servers: int = 1,
+        spawn_servers: bool = False,
+        results_log: Optional[str] = None,
+        trace_dir: Optional[str] = None,
+        prompt_budget: Optional[int] = None,
     ):
         """
         Initialize the benchmark runner.
@@ -54,8 +68,17 @@ class BenchmarkRunner:
             host: Pytanque server host
             port: Pytanque server port
             timeout: Maximum time in seconds per theorem
-            parallel: Whether to run theorems in parallel
+            parallel: Whether to run theorems in parallel, one per pet-server
             verbose: Whether to print verbose output
+            stream: Whether to stream completions from the LLM
+            n_sampling: Whether to sample identical prompts with `n` instead of duplicating them
+            merge_transpositions: Whether to stop paths reaching a proof state already explored by another path
+            num_servers: Number of pet-servers in parallel mode, on ports port, port + 1, ...
+            spawn_servers: Whether to start the pet-servers in parallel mode
+            results_log: Path of a JSONL file where each result is appended as soon as it is
+                         known. If it exists, the theorems it contains are not proved again.
+            trace_dir: Directory where a Chrome trace (Perfetto) timeline of each theorem is written
+            prompt_budget: Maximum number of tokens of a prompt, older turns are compacted beyond it
         """
         self.benchmark_dir = os.path.abspath(benchmark_dir)
         self.workspace_dir = (
@@ -74,22 +97,28 @@ class BenchmarkRunner:
         self.parallel = parallel
         self.verbose = verbose
         self.context = context
+        self.merge_transpositions = merge_transpositions
+        self.trace_dir = trace_dir
+        self.prompt_budget = prompt_budget
 
         # Connect to Pytanque
-        self.pet = Pytanque(host, port)
-        self.pet.connect()
-        self.pet.set_workspace(False, str(self.workspace_dir))
-
-        # Setup LLM
-        self.llm = VLLM(
-            api_url=llm_url,
-            model=model,
-            temperature=temperature,
-            verbose=verbose,
-        )
+        if parallel:
+            # One connection per server, borrowed by the worker proving a theorem
+            self.pool = PetServerPool(
+                self.workspace_dir,
+                host=host,
+                port=port,
+                num_servers=num_servers,
+                spawn=spawn_servers,
+            )
+        else:
+            self.pet = Pytanque(host, port)
+            self.pet.connect()
+            self.pet.set_workspace(False, str(self.workspace_dir))
 
         # Results storage
-        self.results = {}
+        self.log = ResultsLog(results_log)
+        self.results = self.log.results
 
         # Setup LLM
         self.llm = VLLM(
@@ -99,6 +128,8 @@ class BenchmarkRunner:
             verbose=verbose,
             log_dir=llm_log_dir,
             log_to_console=verbose,
+            stream=stream,
+            n_sampling=n_sampling,
         )
 
     def discover_theorems(self) -> List[Tuple[str, str]]:
@@ -118,55 +149,63 @@ class BenchmarkRunner:
 
         return theorems
 
-    def prove_theorem(self, filename: str, theorem_name: str) -> Dict[str, Any]:
+    def prove_theorem(
+        self, filename: str, theorem_name: str, pet: Optional[Pytanque] = None
+    ) -> Dict[str, Any]:
         """
         Try to prove a single theorem.
 
         Args:
             filename: Coq file name
             theorem_name: Name of the theorem to prove
+            pet: Pytanque connection to use (default: the runner's connection)
 
         Returns:
-            Dictionary with results
+            Dictionary with results, including the time spent in each phase of the search
         """
+        # Time spent generating, checking tactics, printing goals and searching
+        tracer = Tracer(record_events=self.trace_dir is not None)
+        with tracer.activate(), log_context(theorem=theorem_name, file=filename):
+            result = self._prove_theorem(filename, theorem_name, pet)
+        result["timings"] = tracer.summary()
+        if self.trace_dir:
+            tracer.export(os.path.join(self.trace_dir, f"{theorem_name}.json"))
+        return result
+
+    def _prove_theorem(
+        self, filename: str, theorem_name: str, pet: Optional[Pytanque] = None
+    ) -> Dict[str, Any]:
         start_time = time.time()
-
-        # Create ScriptTool for this theorem
-        coq_tool = ScriptTool(
-            pet=self.pet,
-            workspace=self.workspace_dir,
-            file=filename,
-            theorem=theorem_name,
-            context=self.context,
-        )
-
-        # Create prover
-        prover = PassAtKProver(
-            llm=self.llm,
-            coq_tool=coq_tool,
-            k=self.k,
-            max_iterations=self.max_iterations,
-            verbose=self.verbose,
-            goals_tag=self.goals_tag,
-            result_tag=self.result_tag,
-        )
+        # Unlike SIGALRM, works in any thread and for several theorems at once
+        deadline = Deadline(self.timeout)
 
         try:
-            # Set timeout using signal
-            import signal
-
-            def timeout_handler(signum, frame):
-                raise TimeoutError(f"Timeout after {self.timeout} seconds")
-
-            # Set timeout
-            signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(self.timeout)
+            # Create ScriptTool for this theorem (starts the proof on the server)
+            with deadline.activate():
+                coq_tool = ScriptTool(
+                    pet=pet or self.pet,
+                    workspace=self.workspace_dir,
+                    file=filename,
+                    theorem=theorem_name,
+                    context=self.context,
+                )
+            deadline.check()
+
+            # Create prover
+            prover = PassAtKProver(
+                llm=self.llm,
+                coq_tool=coq_tool,
+                k=self.k,
+                max_iterations=self.max_iterations,
+                verbose=self.verbose,
+                goals_tag=self.goals_tag,
+                result_tag=self.result_tag,
+                merge_transpositions=self.merge_transpositions,
+                prompt_budget=self.prompt_budget,
+            )
 
             # Run the prover
-            success, proof = prover.run_pass_at_k()
-
-            # Cancel timeout
-            signal.alarm(0)
+            success, proof = prover.run_pass_at_k(deadline=deadline)
 
             end_time = time.time()
             duration = end_time - start_time
@@ -179,6 +218,9 @@ class BenchmarkRunner:
                 "duration": duration,
                 "proof": proof if success else None,
                 "proof_length": len(proof) if success else 0,
+                "transpositions": prover.transpositions.stats(),
+                "tactic_cache": coq_tool.env.tactic_cache.stats(),
+                "prompts": prover.prompt_manager.stats(),
                 "timestamp": datetime.now().isoformat(),
             }
 
@@ -214,38 +256,69 @@ class BenchmarkRunner:
                 "timestamp": datetime.now().isoformat(),
             }
 
+    def _prove_with_pool(self, filename: str, theorem_name: str) -> Dict[str, Any]:
+        """Prove a theorem with a connection borrowed from the pet-server pool."""
+        pet = self.pool.acquire()
+        try:
+            result = self.prove_theorem(filename, theorem_name, pet)
+            if result.get("error") is not None:
+                # The server may be left in the middle of a request, timeouts included
+                pet = self.pool.reconnect(pet)
+            return result
+        finally:
+            self.pool.release(pet)
+
     def run_benchmark(self) -> Dict[str, Any]:
         """
         Run the benchmark on all theorems.
 
+        In parallel mode, the theorems are scheduled on a pool of workers, one per
+        pet-server, and all workers share the same LLM client so that the server
+        receives requests from several theorems at once.
+
         Returns:
             Dictionary with benchmark results
         """
-        # Discover theorems
+        # Discover theorems, skipping those already in the results log
         theorems = self.discover_theorems()
+        done = [t for t in theorems if self.log.is_done(t[1])]
+        theorems = [t for t in theorems if not self.log.is_done(t[1])]
 
         if self.verbose:
-            print(f"Found {len(theorems)} theorems to benchmark")
-
-        # Run benchmarks in sequence
-        for filename, theorem_name in theorems:
-            if self.verbose:
-                print(f"Proving theorem {theorem_name} from {filename}...")
-
-            result = self.prove_theorem(filename, theorem_name)
-
-            if self.verbose:
-                success_str = "SUCCESS" if result["success"] else "FAILED"
-                duration_str = f"{result['duration']:.2f}s"
-                print(f"  {success_str} in {duration_str}")
-
-            self.results[theorem_name] = result
+            print(f"Found {len(theorems) + len(done)} theorems to benchmark")
+            if done:
+                print(f"Skipping {len(done)} theorems already in the results log")
+
+        if self.parallel:
+            with ThreadPoolExecutor(max_workers=len(self.pool)) as executor:
+                futures = {
+                    executor.submit(self._prove_with_pool, filename, theorem_name): theorem_name
+                    for filename, theorem_name in theorems
+                }
+                for future in as_completed(futures):
+                    self._record(futures[future], future.result())
+        else:
+            # Run benchmarks in sequence
+            for filename, theorem_name in theorems:
+                if self.verbose:
+                    print(f"Proving theorem {theorem_name} from {filename}...")
+
+                self._record(theorem_name, self.prove_theorem(filename, theorem_name))
 
         # Generate summary
         benchmark_summary = self.generate_summary()
 
         return benchmark_summary
 
+    def _record(self, theorem_name: str, result: Dict[str, Any]) -> None:
+        """Store the result of a theorem."""
+        if self.verbose:
+            success_str = "SUCCESS" if result["success"] else "FAILED"
+            duration_str = f"{result['duration']:.2f}s"
+            print(f"  {theorem_name}: {success_str} in {duration_str}")
+
+        self.log.add(result)
+
     def generate_summary(self) -> Dict[str, Any]:
         """
         Generate a summary of benchmark results.
@@ -253,59 +326,22 @@ class BenchmarkRunner:
         Returns:
             Dictionary with benchmark summary
         """
-        total_theorems = len(self.results)
-        successful_theorems = sum(
-            1 for result in self.results.values() if result["success"]
-        )
-        success_rate = successful_theorems / total_theorems if total_theorems > 0 else 0
-
-        total_duration = sum(result["duration"] for result in self.results.values())
-        avg_duration = total_duration / total_theorems if total_theorems > 0 else 0
-
-        successful_proofs = [
-            result for result in self.results.values() if result["success"]
-        ]
-        avg_proof_length = (
-            sum(proof["proof_length"] for proof in successful_proofs)
-            / len(successful_proofs)
-            if successful_proofs
-            else 0
-        )
-
-        # Find fastest and slowest theorems
-        fastest_theorem = (
-            min(self.results.values(), key=lambda x: x["duration"])
-            if self.results
-            else None
-        )
-        slowest_theorem = (
-            max(self.results.values(), key=lambda x: x["duration"])
-            if self.results
-            else None
+        # Statistics are kept up to date by the results log
+        summary = self.log.summary()
+        summary.update(
+            {
+                "parameters": {
+                    "k": self.k,
+                    "max_iterations": self.max_iterations,
+                    "temperature": self.temperature,
+                    "model": self.model,
+                    "prompt_budget": self.prompt_budget,
+                },
+                "timestamp": datetime.now().isoformat(),
+                "results": self.results,
+            }
         )
 
-        # Create summary
-        summary = {
-            "total_theorems": total_theorems,
-            "successful_theorems": successful_theorems,
-            "success_rate": success_rate,
-            "total_duration": total_duration,
-            "avg_duration": avg_duration,
-            "avg_proof_length": avg_proof_length,
-            "fastest_theorem": fastest_theorem["theorem"] if fastest_theorem else None,
-            "fastest_time": fastest_theorem["duration"] if fastest_theorem else None,
-            "slowest_theorem": slowest_theorem["theorem"] if slowest_theorem else None,
-            "slowest_time": slowest_theorem["duration"] if slowest_theorem else None,
-            "parameters": {
-                "k": self.k,
-                "max_iterations": self.max_iterations,
-                "temperature": self.temperature,
-                "model": self.model,
-            },
-            "timestamp": datetime.now().isoformat(),
-            "results": self.results,
-        }
-
         return summary
 
     def save_results(self, output_dir: str, filename: str = None) -> str:
@@ -432,6 +468,22 @@ def main():
         default=8765,
         help="Pytanque server port",
     )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Prove several theorems at once, one per pet-server",
+    )
+    parser.add_argument(
+        "--num-servers",
+        type=int,
+        default=1,
+        help="Number of pet-servers in parallel mode, on consecutive ports from --port",
+    )
+    parser.add_argument(
+        "--spawn-servers",
+        action="store_true",
+        help="Start the pet-servers in parallel mode instead of connecting to running ones",
+    )
 
     # Misc configuration
     parser.add_argument(
@@ -442,6 +494,40 @@ def main():
     parser.add_argument(
         "--context", action="store_true", help="Include context in prompts"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream completions and check each path as soon as it stops",
+    )
+    parser.add_argument(
+        "--n-sampling",
+        action="store_true",
+        help="Send identical prompts once and sample them n times",
+    )
+    parser.add_argument(
+        "--merge-transpositions",
+        action="store_true",
+        help="Stop paths reaching a proof state already explored by another path",
+    )
+
+    parser.add_argument(
+        "--results-log",
+        type=str,
+        default=None,
+        help="JSONL file where results are appended as they come, to resume an interrupted run",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        type=str,
+        default=None,
+        help="Directory where a Chrome trace (Perfetto) timeline of each theorem is written",
+    )
+    parser.add_argument(
+        "--prompt-budget",
+        type=int,
+        default=None,
+        help="Maximum number of tokens of a prompt, older turns are compacted beyond it",
+    )
 
     # Add logging argument
     parser.add_argument(
@@ -470,11 +556,25 @@ def main():
         verbose=args.verbose,
         context=args.context,
         llm_log_dir=args.llm_log_dir,
+        stream=args.stream,
+        n_sampling=args.n_sampling,
+        merge_transpositions=args.merge_transpositions,
+        parallel=args.parallel,
+        num_servers=args.num_servers,
+        spawn_servers=args.spawn_servers,
+        results_log=args.results_log,
+        trace_dir=args.trace_dir,
+        prompt_budget=args.prompt_budget,
     )
 
     # Run benchmark
     start_time = time.time()
-    summary = benchmark.run_benchmark()
+    try:
+        summary = benchmark.run_benchmark()
+    finally:
+        benchmark.llm.close()
+        if args.parallel:
+            benchmark.pool.close()
     end_time = time.time()
 
     # Save results
@@ -491,6 +591,8 @@ def main():
     print(f"Average duration per theorem: {summary['avg_duration']:.2f}s")
     if summary["successful_theorems"] > 0:
         print(f"Average proof length: {summary['avg_proof_length']:.1f} tactics")
+    for phase, timing in summary["timings"].items():
+        print(f"Time in {phase}: {timing['total']:.2f}s ({timing['count']} calls)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Iterator, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the time budget of a task is spent or the task is cancelled."""
+
+
+class Deadline:
+    """
+    Time budget and cancellation flag of a task, safe to share between threads.
+
+    Unlike SIGALRM, which only works in the main thread and allows one alarm per
+    process, each task (e.g. each theorem of a benchmark) can have its own deadline.
+    Long operations check it cooperatively, bound their own timeouts with
+    `clamp`, and register `on_cancel` callbacks to abort blocking I/O.
+
+    A deadline is made the current one of a thread with `activate`, and is then
+    found by the LLM client and the Coq environment with `current_deadline`.
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        """
+        Initialize the deadline.
+
+        Args:
+            seconds: Time budget in seconds from now (default: no time limit, only cancellation)
+        """
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self._cancelled = threading.Event()
+        self._callbacks = set()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def remaining(self) -> Optional[float]:
+        """Time left in seconds, or None if there is no time limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self) -> bool:
+        """Whether the task must stop (deadline reached or cancelled)."""
+        return self.cancelled or self.remaining() == 0.0
+
+    def check(self) -> None:
+        """
+        Raises:
+            DeadlineExceeded: If the task must stop
+        """
+        if self.cancelled:
+            raise DeadlineExceeded("Cancelled")
+        if self.remaining() == 0.0:
+            raise DeadlineExceeded("Deadline reached")
+
+    def clamp(self, timeout: Optional[float]) -> Optional[float]:
+        """
+        Bound the timeout of an operation by the time left.
+
+        Raises:
+            DeadlineExceeded: If the task must stop
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def cancel(self) -> None:
+        """Cancel the task and abort its registered blocking operations."""
+        self._cancelled.set()
+        self._fire()
+
+    def _fire(self) -> None:
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """
+        Call `callback` if the task is cancelled or the deadline is reached during the block.
+
+        Used to abort a blocking operation from another thread, e.g. closing a
+        streamed HTTP response.
+        """
+        with self._lock:
+            self._callbacks.add(callback)
+            if self._timer is None and self.expires_at is not None:
+                self._timer = threading.Timer(self.remaining(), self._fire)
+                self._timer.daemon = True
+                self._timer.start()
+        try:
+            if self.expired:
+                callback()
+            yield
+        finally:
+            with self._lock:
+                self._callbacks.discard(callback)
+                if not self._callbacks and self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+    @contextmanager
+    def activate(self) -> Iterator["Deadline"]:
+        """Make this deadline the current one in the block."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the current task, if any."""
+    return _current.get()
+
+
+def check_deadline() -> None:
+    """
+    Check the deadline of the current task, if any.
+
+    Raises:
+        DeadlineExceeded: If the task must stop
+    """
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def clamp_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Bound a timeout by the time left to the current task, if any (see `Deadline.clamp`)."""
+    deadline = _current.get()
+    return timeout if deadline is None else deadline.clamp(timeout)
+
+
+def propagate(func: Callable) -> Callable:
+    """
+    Wrap `func` so that it runs in the context of the caller (deadline, tracer).
+
+    Context variables are not inherited by the threads of an executor, so functions
+    submitted to one must be wrapped to see the deadline of the task.
+    """
+    context = copy_context()
+
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
@@ -2,11 +2,18 @@
 
 import re
 import os
+import math
 import copy
+import json
+import hashlib
 from abc import ABC, abstractmethod
 
 from pytanque import Pytanque, State, Goal, PetanqueError
 
+from .tactic_cache import TacticCache, state_fingerprint
+from .deadline import check_deadline, clamp_timeout
+from .tracing import span
+
 
 def pp_goal(g: Goal) -> str:
     """
@@ -28,6 +35,21 @@ def pp_goals(gs: list[Goal]) -> str:
     return "\n".join(pp_goal(g) for g in gs)
 
 
+def goals_key(gs: list[Goal]) -> str:
+    """
+    Canonical hash of a list of goals.
+
+    Built from the same fields as `pp_goals`, so two states with the same
+    pretty-printed goals get the same key.
+    """
+    canonical = [
+        [[[list(h.names), h.def_ or "", h.ty] for h in g.hyps], g.ty] for g in gs
+    ]
+    return hashlib.sha256(
+        json.dumps(canonical, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
 # def get_context(doc: str, thm: str) -> str:
 #    """
 #    Remove all proof to get context
@@ -114,14 +136,30 @@ class Env(ABC):
         except PetanqueError:
             return False
 
-    def deepcopy(self):
-        new = self.__class__(self.pet, self.workspace, self.file, self.thm)
-        new.proof = copy.deepcopy(self.proof)
-        new.n_interactions = copy.deepcopy(self.n_interactions)
+    def fork(self, pet=None):
+        """
+        Clone the environment without starting the theorem again.
+
+        The initial state, theorem code and context are immutable and shared with
+        the clone, only the per-beam mutable fields are copied.
+
+        Args:
+            pet: Optional Pytanque connection for the clone (default: the same connection)
+        """
+        new = copy.copy(self)
+        if pet is not None:
+            new.pet = pet
+        new.proof = list(self.proof)
         return new
 
+    def deepcopy(self):
+        return self.fork()
+
 
 class ScriptEnv(Env):
+    # Petanque timeout of a tactic, in seconds
+    TACTIC_TIMEOUT = 10
+
     def __init__(
         self,
         pet: Pytanque,
@@ -130,48 +168,93 @@ class ScriptEnv(Env):
         thm: str,
         context=False,
         verbose=False,
+        tactic_cache: TacticCache = None,
     ):
         super().__init__(pet, workspace, file, thm, context, verbose)
+        # Shared with the forks of this environment
+        self.tactic_cache = tactic_cache if tactic_cache is not None else TacticCache()
         self.state: State = self.initial_state
-        self.thm_code = pp_goals(self.pet.goals(self.state))
+        # Goals of the last state they were requested for, fetched once per state
+        self._goals_key = None
+        self._goals: list[Goal] = []
+        self._goals_pp = None
+        self.thm_code = self.new_goal_pp
         self.added_tac = False
         self.previous_unsuccessful = []
 
     def exec(self, tactics):
+        with span("coq.exec", tactics=len(tactics)):
+            self._exec(tactics)
+
+    def _exec(self, tactics):
         self.added_tac = False
         self.n_interactions += 1
         for tac in tactics:
             if self.verbose:
                 print("tactic:", tac)
+            # Do not let a tactic run past the deadline of the current task
+            # (Petanque timeouts are whole seconds)
+            timeout = max(1, math.ceil(clamp_timeout(self.TACTIC_TIMEOUT)))
             try:
-                self.state = self.pet.run(self.state, tac, timeout=10)
+                self.state = self.tactic_cache.run(
+                    self.pet,
+                    self.state,
+                    tac,
+                    timeout=timeout,
+                    cache_errors=timeout == self.TACTIC_TIMEOUT,
+                )
                 self.proof.append(tac)
                 self.added_tac = True
                 self.previous_unsuccessful = []
                 if self.verbose:
                     print("success")
             except PetanqueError as err:
+                # The tactic may have been cut by the deadline rather than failed
+                check_deadline()
                 self.failed = True
                 self.previous_unsuccessful.append(str(tac) + str(err.message))
                 if self.verbose:
                     print("error:", err.message)
                 break
 
+    @property
+    def goals(self) -> list[Goal]:
+        key = state_fingerprint(self.state)
+        if key != self._goals_key:
+            with span("coq.goals"):
+                self._goals = self.pet.goals(self.state)
+            self._goals_pp = None
+            self._goals_key = key
+        return self._goals
+
     @property
     def new_goal_pp(self):
-        return pp_goals(self.pet.goals(self.state))
+        goals = self.goals
+        if self._goals_pp is None:
+            with span("coq.pp_goals"):
+                self._goals_pp = pp_goals(goals)
+        return self._goals_pp
+
+    @property
+    def state_key(self) -> str:
+        """Canonical key of the current proof state (see `goals_key`)."""
+        return goals_key(self.goals)
 
     @property
     def proof_finished(self) -> bool:
-        # Hack to bypass Petanque proof_finished flag
+        # Petanque proof_finished flag is not reliable: count the goals, and only
+        # confirm with Qed when there are none left
+        if self.goals:
+            return False
         try:
-            self.pet.run(self.state, "Qed.")
+            with span("coq.qed"):
+                self.tactic_cache.run(self.pet, self.state, "Qed.")
             return True
         except PetanqueError:
             return False
 
-    def deepcopy(self):
-        new = super().deepcopy()
-        new.state = copy.deepcopy(self.state)
-        new.previous_unsuccessful = copy.deepcopy(self.previous_unsuccessful)
+    def fork(self, pet=None):
+        new = super().fork(pet)
+        # Petanque states are never mutated, the current state can be shared too
+        new.previous_unsuccessful = list(self.previous_unsuccessful)
         return new
@@ -0,0 +1,141 @@
+import json
+from typing import Any, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize `obj` to JSON bytes."""
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Deserialize JSON."""
+    return json.loads(data)
+
+
+class ResetRetry(Retry):
+    """
+    Retry policy retrying connection resets but not read timeouts.
+
+    urllib3 counts a kept-alive connection closed by the server ("Connection
+    aborted") as a read error, like a timeout. A reset happens before any response,
+    so the request is sent again as for a connection error.
+    """
+
+    def _is_read_error(self, err: Exception) -> bool:
+        if isinstance(err, ProtocolError):
+            return False
+        return super()._is_read_error(err)
+
+
+class LLMAPIError(Exception):
+    """Raised when a request to the LLM API fails after all retries."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        # HTTP status of the error response, None if no response was received
+        self.status_code = status_code
+
+
+class PooledSession:
+    """
+    Keep-alive HTTP session for an OpenAI-compatible API.
+
+    Connections are pooled and reused between requests, transient failures
+    (5xx responses, connection resets) are retried with exponential backoff,
+    and every request has a deadline.
+    """
+
+    RETRY_STATUS = (500, 502, 503, 504)
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_maxsize: int = 32,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: Union[float, Tuple[float, float]] = (10.0, 600.0),
+    ):
+        """
+        Initialize the session.
+
+        Args:
+            base_url: Base URL of the API (e.g. http://localhost:8000)
+            pool_maxsize: Maximum number of connections kept alive to the server
+            max_retries: Number of retries for transient failures
+            backoff_factor: Backoff factor between retries (0.5 -> 0.5s, 1s, 2s, ...)
+            timeout: Default deadline in seconds, or (connect, read) deadlines
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        # Read timeouts are not retried: a generation that timed out (e.g. cut by the
+        # deadline of its task) would be generated again from scratch
+        retry = ResetRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        stream: bool = False,
+        timeout: Optional[Union[float, Tuple[float, float]]] = None,
+    ) -> requests.Response:
+        """
+        Send a JSON POST request.
+
+        Args:
+            path: Path of the endpoint (e.g. /v1/completions)
+            payload: JSON payload
+            stream: Whether to stream the response body
+            timeout: Deadline for this request (default: the session deadline)
+
+        Returns:
+            The response, with a 200 status code
+
+        Raises:
+            LLMAPIError: If the request fails or returns an error status
+        """
+        try:
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                data=dumps(payload),
+                stream=stream,
+                timeout=timeout if timeout is not None else self.timeout,
+            )
+        except requests.RequestException as e:
+            raise LLMAPIError(f"Request to {path} failed: {e}") from e
+
+        if response.status_code != 200:
+            text = response.text
+            response.close()
+            raise LLMAPIError(
+                f"LLM API returned error: {response.status_code} - {text}",
+                status_code=response.status_code,
+            )
+
+        return response
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
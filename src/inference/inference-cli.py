@@ -6,6 +6,7 @@ from .agent import MathProofAgent
 
 from src.embedding.models.qwen_embedding import Qwen3Embedding4b
 from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.index.index_config import IndexConfig, INDEX_TYPES
 
 def main():
     """Main entry point for the inference CLI."""
@@ -40,6 +41,11 @@ def main():
         default=1,
         help="Number of parallel paths to explore (beam search width)",
     )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Run the beams asynchronously, each on its own Pytanque connection",
+    )
     parser.add_argument(
         "--temperature",
         type=float,
@@ -55,6 +61,16 @@ def main():
 
     parser.add_argument('--docstrings-path', default='/lustre/fsn1/projects/rech/tdm/commun/dataset/docstrings.json', help='Docstrings path')
     parser.add_argument('--embedding-cache-path', default='/lustre/fsn1/projects/rech/tdm/commun/cache/', help='Embedding cache path')
+    parser.add_argument('--index-type', default='flat', choices=INDEX_TYPES, help='Type of the search index')
+    parser.add_argument('--nprobe', default=16, type=int, help='Number of clusters searched (IVF indexes)')
+    parser.add_argument('--ef-search', default=64, type=int, help='Size of the candidate list (HNSW index)')
+    parser.add_argument('--max-tokens', default=None, type=int,
+                        help='Maximum number of tokens of a batch of embedded docstrings (default: no limit)')
+    parser.add_argument('--hybrid', default=False, action=argparse.BooleanOptionalAction, help='Fuse the search with BM25')
+    parser.add_argument('--dense-weight', default=1.0, type=float, help='Weight of the dense ranking in the hybrid search')
+    parser.add_argument('--lexical-weight', default=1.0, type=float, help='Weight of the BM25 ranking in the hybrid search')
+    parser.add_argument('--hide-later-lemmas', default=False, action=argparse.BooleanOptionalAction,
+                        help='Hide the lemmas defined after the theorem in its file from the search')
 
     args = parser.parse_args()
 
@@ -70,8 +86,15 @@ def main():
     search_tool = SearchTool(
         embedding_model=embedding_model,
         docstrings_path=args.docstrings_path,
-        cache_path=args.embedding_cache_path
+        cache_path=args.embedding_cache_path,
+        index_config=IndexConfig(args.index_type, nprobe=args.nprobe, ef_search=args.ef_search),
+        hybrid=args.hybrid,
+        dense_weight=args.dense_weight,
+        lexical_weight=args.lexical_weight,
+        max_tokens=args.max_tokens,
     )
+    if args.hide_later_lemmas:
+        search_tool.hide_after(args.theorem)
     script_tool = ScriptTool(
         pet=pet,
         workspace=args.workspace,
@@ -95,7 +118,9 @@ def main():
 
     # Create agent and run proof with specified beam size
     agent = MathProofAgent(llm, search_tool, script_tool, have_tool)
-    status = agent.run_proof(beam_size=args.beam_size, verbose=args.verbose)
+    status = agent.run_proof(
+        beam_size=args.beam_size, verbose=args.verbose, concurrent=args.concurrent
+    )
 
     # Print results
     if status.success:
@@ -107,6 +132,9 @@ def main():
     for tactic in status.proof:
         print(f"  {tactic}")
 
+    if args.verbose:
+        print(f"\nSearch cache: {search_tool.cache_stats()}")
+
 
 if __name__ == "__main__":
     main()
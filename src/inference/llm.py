@@ -1,9 +1,16 @@
-import json
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional, Union, Tuple
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional, Union, Tuple, Iterator
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+import threading
 import requests
 from dataclasses import dataclass
 
+from .http_client import PooledSession, LLMAPIError, loads
+from .deadline import current_deadline, check_deadline, clamp_timeout, propagate
+from .tracing import span
 from .llm_logger import LLMLogger
 from .prompts import tactic_prompts
 
@@ -12,6 +19,21 @@ from .prompts import tactic_prompts
 # ===============================================
 
 
+@dataclass
+class Completion:
+    """A completion with its score."""
+
+    text: str
+    # Sum of the log-probabilities of the generated tokens
+    logprob: float = 0.0
+    num_tokens: int = 0
+
+    @property
+    def mean_logprob(self) -> float:
+        """Average log-probability per generated token."""
+        return self.logprob / self.num_tokens if self.num_tokens else 0.0
+
+
 class LLM(ABC):
     """Abstract base class for LLM providers."""
 
@@ -27,6 +49,96 @@ class LLM(ABC):
         """Generate completions for multiple prompts."""
         pass
 
+    def generate_batch_stream(
+        self,
+        prompts: List[str],
+        stop_sequences: Optional[List[str]] = None,
+        parsers: Optional[List[Any]] = None,
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Generate completions for multiple prompts, yielding each one as soon as it is finished.
+
+        The default implementation waits for the whole batch.
+
+        Args:
+            prompts: List of prompts to generate completions for
+            stop_sequences: Optional list of stop sequences
+            parsers: Optional incremental parser of each completion (e.g. `ToolCallStream`),
+                     fed with the text as it arrives
+
+        Yields:
+            Tuples of (prompt index, completion) in order of completion
+        """
+        for i, text in enumerate(self.generate_batch(prompts, stop_sequences)):
+            if parsers is not None:
+                parsers[i].feed(text)
+            yield i, text
+
+    def generate_batch_scored(
+        self, prompts: List[str], stop_sequences: Optional[List[str]] = None
+    ) -> List[Completion]:
+        """
+        Generate completions for multiple prompts, with their log-probabilities.
+
+        The default implementation has no log-probabilities and estimates the number
+        of tokens from the length of the text (~4 characters per token).
+        """
+        return [
+            Completion(text=text, num_tokens=len(text) // 4)
+            for text in self.generate_batch(prompts, stop_sequences)
+        ]
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """
+        Count the tokens of each text.
+
+        The default implementation estimates them from the length of the text
+        (~4 characters per token).
+        """
+        return [len(text) // 4 for text in texts]
+
+
+def find_stop(text: str, stop_sequences: List[str], start: int = 0) -> Optional[int]:
+    """
+    Find the end position of the first stop sequence in `text[start:]`.
+
+    Returns:
+        The position right after the earliest stop sequence, or None if there is none
+    """
+    positions = [
+        (pos, pos + len(seq))
+        for seq in stop_sequences
+        if (pos := text.find(seq, start)) != -1
+    ]
+    return min(positions)[1] if positions else None
+
+
+class ResponseGroup:
+    """
+    Streamed HTTP responses closed together, possibly from another thread.
+
+    A response added after the group is closed is closed right away.
+    """
+
+    def __init__(self):
+        self._responses = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def add(self, response) -> None:
+        with self._lock:
+            if not self._closed:
+                self._responses.append(response)
+                return
+        response.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            responses, self._responses = self._responses, []
+        for response in responses:
+            response.close()
+
 
 class VLLM(LLM):
     """Implementation of LLM using VLLM's OpenAI-compatible API."""
@@ -42,6 +154,11 @@ class VLLM(LLM):
         verbose: bool = False,
         log_dir: str = "llm_logs",
         log_to_console: bool = False,
+        stream: bool = False,
+        timeout: float = 600.0,
+        max_retries: int = 3,
+        pool_maxsize: int = 32,
+        n_sampling: bool = False,
     ):
         self.api_url = api_url
         self.model = model
@@ -50,6 +167,25 @@ class VLLM(LLM):
         self.top_k = top_k
         self.max_tokens = max_tokens
         self.verbose = verbose
+        self.timeout = timeout
+        # Consume the SSE token stream and return each completion as soon as it stops
+        self.stream = stream
+        # Send identical prompts once with `n` samples instead of once per beam
+        self.n_sampling = n_sampling
+        # Whether the server can count tokens (see `count_tokens`)
+        self.tokenize_endpoint = True
+        # Token counts of recent texts, the turns of a prompt are counted once
+        self.token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self.token_counts_maxsize = 4096
+        self.token_counts_lock = threading.Lock()
+
+        # Keep-alive connections to the server, shared by all requests
+        self.client = PooledSession(
+            api_url,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+            timeout=(10.0, timeout),
+        )
 
         # Initialize the LLM logger
         self.logger = LLMLogger(
@@ -124,6 +260,226 @@ class VLLM(LLM):
         responses = self.generate_batch([prompt], stop_sequences)
         return responses[0] if responses else ""
 
+    def _build_payload(
+        self,
+        prompts: List[str],
+        stop_sequences: Optional[List[str]] = None,
+        n: int = 1,
+    ) -> Dict[str, Any]:
+        """Build the payload of a `/v1/completions` request."""
+        payload = {
+            "model": self.model,
+            "prompt": prompts,
+            "temperature": self.temperature,
+            # "top_p": self.top_p,
+            # "top_k": self.top_k,
+            "max_tokens": self.max_tokens,
+            "include_stop_str_in_output": True,
+            "stream": self.stream,
+        }
+
+        # Add optional parameters if specified
+        if stop_sequences:
+            payload["stop"] = stop_sequences
+        if n > 1:
+            payload["n"] = n
+
+        return payload
+
+    def _plan_requests(self, prompts: List[str]) -> List[Tuple[List[str], int, List[int]]]:
+        """
+        Split a batch of prompts into `/v1/completions` requests.
+
+        With `n_sampling`, byte-identical prompts are sent once and sampled `n` times.
+        Since `n` applies to every prompt of a request, prompts are grouped by number
+        of copies, and there is one request per distinct number of copies.
+
+        Returns:
+            List of (unique prompts, n, prompt index of each choice). The server returns
+            the choices of the u-th prompt at indices u * n to (u + 1) * n - 1.
+        """
+        if not self.n_sampling:
+            return [(prompts, 1, list(range(len(prompts))))]
+
+        copies: Dict[str, List[int]] = {}
+        for i, prompt in enumerate(prompts):
+            copies.setdefault(prompt, []).append(i)
+
+        by_count: Dict[int, List[Tuple[str, List[int]]]] = {}
+        for prompt, indices in copies.items():
+            by_count.setdefault(len(indices), []).append((prompt, indices))
+
+        return [
+            (
+                [prompt for prompt, _ in group],
+                n,
+                [i for _, indices in group for i in indices],
+            )
+            for n, group in by_count.items()
+        ]
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """
+        Count the tokens of each text with the tokenizer of the served model.
+
+        Uses the `/tokenize` endpoint of the vLLM server, which takes one text per
+        request: the texts not counted recently are sent concurrently. If the server
+        does not provide the endpoint (404), the number of tokens is estimated from
+        the length of the texts from then on. Other errors only fall back to the
+        estimate for this call.
+        """
+        if not self.tokenize_endpoint:
+            return super().count_tokens(texts)
+        with self.token_counts_lock:
+            missing = list(dict.fromkeys(t for t in texts if t not in self.token_counts))
+        counts = {}
+        if missing:
+            def count(text: str) -> int:
+                response = self.client.post(
+                    "/tokenize",
+                    {"model": self.model, "prompt": text, "add_special_tokens": False},
+                    timeout=(10.0, clamp_timeout(self.timeout)),
+                )
+                return loads(response.content)["count"]
+
+            try:
+                with ThreadPoolExecutor(max_workers=min(len(missing), 8)) as executor:
+                    counted = list(executor.map(propagate(count), missing))
+            except (LLMAPIError, KeyError) as e:
+                check_deadline()
+                if getattr(e, "status_code", None) == 404:
+                    print(f"Token counting unavailable, using estimates: {e}")
+                    self.tokenize_endpoint = False
+                return super().count_tokens(texts)
+
+            with self.token_counts_lock:
+                for text, num_tokens in zip(missing, counted):
+                    self.token_counts[text] = num_tokens
+                while len(self.token_counts) > self.token_counts_maxsize:
+                    self.token_counts.popitem(last=False)
+            counts.update(zip(missing, counted))
+        with self.token_counts_lock:
+            for text in texts:
+                if text not in counts:
+                    counts[text] = self.token_counts[text]
+                    self.token_counts.move_to_end(text)
+        return [counts[text] for text in texts]
+
+    def close(self) -> None:
+        """Write the pending logs and close the connections to the server."""
+        self.logger.close()
+        self.client.close()
+
+    def _log_batch(
+        self,
+        prompts: List[str],
+        responses: List[str],
+        stop_sequences: Optional[List[str]] = None,
+    ) -> None:
+        """Log a batch of interactions with the model."""
+        metadata = {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stop_sequences": stop_sequences,
+        }
+
+        self.logger.log_batch_interaction(
+            prompts=prompts,
+            responses=responses,
+            metadata=metadata,
+            prefix=self.model.split("/")[-1],  # Use model name as prefix
+        )
+
+    def _post(self, payload: Dict[str, Any], stream: bool = False):
+        """
+        Send a `/v1/completions` request, bounded by the deadline of the current task.
+
+        Raises:
+            DeadlineExceeded: If the deadline is reached before or during the request
+            LLMAPIError: If the request fails after all retries
+        """
+        try:
+            return self.client.post(
+                "/v1/completions",
+                payload,
+                stream=stream,
+                timeout=(10.0, clamp_timeout(self.timeout)),
+            )
+        except LLMAPIError:
+            # A read timeout may just be the deadline
+            check_deadline()
+            raise
+
+    def _request_choices(
+        self,
+        prompts: List[str],
+        n: int,
+        stop_sequences: Optional[List[str]] = None,
+        logprobs: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Send one non-streaming request and return the choices in index order."""
+        payload = self._build_payload(prompts, stop_sequences, n)
+        payload["stream"] = False
+        if logprobs:
+            # Only the log-probabilities of the sampled tokens
+            payload["logprobs"] = 0
+
+        response = self._post(payload)
+        data = loads(response.content)
+
+        # if self.verbose:
+        #    print(f"LLM API response: {data}")
+
+        return sorted(data["choices"], key=lambda choice: choice.get("index", 0))
+
+    def _complete(
+        self, prompts: List[str], n: int, stop_sequences: Optional[List[str]] = None
+    ) -> List[str]:
+        """Send one non-streaming request and return the completions in index order."""
+        return [choice["text"] for choice in self._request_choices(prompts, n, stop_sequences)]
+
+    def _complete_scored(
+        self, prompts: List[str], n: int, stop_sequences: Optional[List[str]] = None
+    ) -> List[Completion]:
+        """Send one non-streaming request and return the scored completions in index order."""
+        completions = []
+        for choice in self._request_choices(prompts, n, stop_sequences, logprobs=True):
+            token_logprobs = (choice.get("logprobs") or {}).get("token_logprobs") or []
+            completions.append(
+                Completion(
+                    text=choice["text"],
+                    logprob=sum(lp for lp in token_logprobs if lp is not None),
+                    num_tokens=len(token_logprobs),
+                )
+            )
+        return completions
+
+    def _map_plans(self, plans: List[Tuple[List[str], int, List[int]]], complete) -> List[Any]:
+        """
+        Run `complete(unique prompts, n)` for each planned request.
+
+        Returns:
+            The results of all requests, spread back in the order of the caller's batch
+        """
+        # The requests run in the threads of an executor
+        complete = propagate(complete)
+        if len(plans) == 1:
+            unique_prompts, n, _ = plans[0]
+            all_results = [complete(unique_prompts, n)]
+        else:
+            # Send the requests of the different groups concurrently
+            with ThreadPoolExecutor(max_workers=len(plans)) as executor:
+                all_results = list(
+                    executor.map(lambda plan: complete(plan[0], plan[1]), plans)
+                )
+
+        results = [None] * sum(len(indices) for _, _, indices in plans)
+        for (_, _, indices), request_results in zip(plans, all_results):
+            for i, result in zip(indices, request_results):
+                results[i] = result
+        return results
+
     def generate_batch(
         self, prompts: List[str], stop_sequences: Optional[List[str]] = None
     ) -> List[str]:
@@ -136,64 +492,262 @@ class VLLM(LLM):
 
         Returns:
             List of generated completions corresponding to each prompt
+
+        Raises:
+            LLMAPIError: If the request fails after all retries
         """
         if not prompts:
             return []
 
-        payload = {
-            "model": self.model,
-            "prompt": prompts,
-            "temperature": self.temperature,
-            # "top_p": self.top_p,
-            # "top_k": self.top_k,
-            "max_tokens": self.max_tokens,
-            "include_stop_str_in_output": True,
-            "stream": False,
-        }
-
-        # Add optional parameters if specified
-        if stop_sequences:
-            payload["stop"] = stop_sequences
+        if self.stream:
+            llm_responses = [""] * len(prompts)
+            for i, text in self.generate_batch_stream(prompts, stop_sequences):
+                llm_responses[i] = text
+            return llm_responses
 
-        try:
-            response = requests.post(
-                f"{self.api_url}/v1/completions",
-                headers={"Content-Type": "application/json"},
-                data=json.dumps(payload),
+        with span("llm.generate_batch", batch_size=len(prompts)):
+            llm_responses = self._map_plans(
+                self._plan_requests(prompts),
+                lambda unique_prompts, n: self._complete(unique_prompts, n, stop_sequences),
             )
 
-            if response.status_code != 200:
-                raise Exception(
-                    f"LLM API returned error: {response.status_code} - {response.text}"
-                )
+        # Log the batch interaction
+        self._log_batch(prompts, llm_responses, stop_sequences)
 
-            data = response.json()
+        return llm_responses
 
-            # if self.verbose:
-            #    print(f"LLM API response: {data}")
+    def generate_batch_scored(
+        self, prompts: List[str], stop_sequences: Optional[List[str]] = None
+    ) -> List[Completion]:
+        """
+        Generate completions for multiple prompts, with their log-probabilities.
 
-            # Extract the completions from the response
-            llm_responses = [choice["text"] for choice in data["choices"]]
+        The requests are never streamed, since the log-probabilities are needed anyway.
+
+        Args:
+            prompts: List of prompts to generate completions for
+            stop_sequences: Optional list of stop sequences
+
+        Returns:
+            List of scored completions corresponding to each prompt
 
-            # Log the interaction
-            metadata = {
-                "model": self.model,
-                "temperature": self.temperature,
-                "max_tokens": self.max_tokens,
-                "stop_sequences": stop_sequences,
-            }
+        Raises:
+            LLMAPIError: If the request fails after all retries
+        """
+        if not prompts:
+            return []
 
-            # Log the batch interaction
-            self.logger.log_batch_interaction(
-                prompts=prompts,
-                responses=llm_responses,
-                metadata=metadata,
-                prefix=self.model.split("/")[-1],  # Use model name as prefix
+        with span("llm.generate_batch", batch_size=len(prompts)):
+            completions = self._map_plans(
+                self._plan_requests(prompts),
+                lambda unique_prompts, n: self._complete_scored(unique_prompts, n, stop_sequences),
             )
 
-            return llm_responses
+        self._log_batch(prompts, [c.text for c in completions], stop_sequences)
+
+        return completions
 
+    def _stream_completions(
+        self,
+        prompts: List[str],
+        n: int,
+        indices: List[int],
+        stop_sequences: List[str],
+        parsers: Optional[List[Any]] = None,
+        responses: Optional["ResponseGroup"] = None,
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Send one streaming request and yield (prompt index, completion) as each choice stops.
+
+        Args:
+            prompts: Prompts of the request
+            n: Number of samples per prompt
+            indices: Prompt index in the caller's batch of each choice
+            stop_sequences: Stop sequences to detect on the client side
+            parsers: Optional incremental parser of each prompt in the caller's batch
+            responses: Optional group the response is added to, to close it from another thread
+        """
+        payload = self._build_payload(prompts, stop_sequences, n)
+
+        texts = [""] * len(indices)
+        done = [False] * len(indices)
+
+        response = self._post(payload, stream=True)
+        if responses is not None:
+            responses.add(response)
+        deadline = current_deadline()
+        try:
+            with deadline.on_cancel(response.close) if deadline else nullcontext():
+                yield from self._read_stream(
+                    response, indices, stop_sequences, texts, done, parsers
+                )
         except Exception as e:
-            print(f"Error in generate_batch: {e}")
-            # Return empty strings in case of error
-            return [""] * len(prompts)
+            # The response may have been closed because of the deadline
+            check_deadline()
+            if isinstance(e, requests.RequestException):
+                raise LLMAPIError(f"Completion stream interrupted: {e}") from e
+            raise
+        finally:
+            # Closing the connection aborts the remaining generations
+            response.close()
+
+        # A response closed because of the deadline may also end quietly
+        check_deadline()
+
+        # Flush the sequences that never finished (truncated stream)
+        for k, is_done in enumerate(done):
+            if not is_done:
+                yield indices[k], texts[k]
+
+    @staticmethod
+    def _read_stream(
+        response,
+        indices: List[int],
+        stop_sequences: List[str],
+        texts: List[str],
+        done: List[bool],
+        parsers: Optional[List[Any]] = None,
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Parse the SSE chunks of a response, updating `texts` and `done` in place.
+
+        Without parsers, a choice stops at its first stop sequence. With parsers, each
+        chunk is fed to the parser of the choice, and the choice stops once the parser
+        has found a tool call (the end of the call is its fourth element), so the text
+        is scanned once whatever the number of chunks.
+        """
+        max_stop_len = max((len(seq) for seq in stop_sequences), default=0)
+        for line in response.iter_lines():
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:") :].strip()
+            if data == b"[DONE]":
+                break
+
+            for choice in loads(data)["choices"]:
+                k = choice["index"]
+                if done[k]:
+                    continue
+                if parsers is not None:
+                    tool_call = parsers[indices[k]].feed(choice["text"])
+                    texts[k] += choice["text"]
+                    stop = tool_call[3] if tool_call is not None else None
+                else:
+                    # Only look for a stop sequence in the newly received text
+                    start = max(0, len(texts[k]) - max_stop_len + 1)
+                    texts[k] += choice["text"]
+                    stop = find_stop(texts[k], stop_sequences, start)
+                if stop is not None:
+                    texts[k] = texts[k][:stop]
+                if stop is not None or choice.get("finish_reason"):
+                    done[k] = True
+                    yield indices[k], texts[k]
+
+            if all(done):
+                break
+
+    @staticmethod
+    def _merge_streams(
+        streams: List[Iterator[Tuple[int, str]]], responses: "ResponseGroup"
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Interleave several completion streams in order of arrival.
+
+        Each stream is read by its own thread. When the caller stops iterating, the
+        HTTP responses of the streams (in `responses`) are closed, which aborts the
+        generations and unblocks the threads waiting for the next chunk.
+        """
+        queue: Queue = Queue()
+        stopped = threading.Event()
+
+        def consume(stream):
+            try:
+                for item in stream:
+                    if stopped.is_set():
+                        break
+                    queue.put(item)
+            except Exception as e:
+                queue.put(e)
+            finally:
+                stream.close()
+                queue.put(None)
+
+        for stream in streams:
+            # The streams must see the deadline of the caller
+            threading.Thread(
+                target=propagate(consume), args=(stream,), daemon=True
+            ).start()
+
+        remaining = len(streams)
+        try:
+            while remaining:
+                item = queue.get()
+                if item is None:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stopped.set()
+            responses.close()
+
+    def generate_batch_stream(
+        self,
+        prompts: List[str],
+        stop_sequences: Optional[List[str]] = None,
+        parsers: Optional[List[Any]] = None,
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        Generate completions for multiple prompts, yielding each one as soon as it is finished.
+
+        In streaming mode, the SSE token stream is consumed and a completion is yielded
+        as soon as one of its stop sequences is received, without waiting for the other
+        sequences of the batch. The request is closed once every completion is done
+        or when the caller stops iterating.
+
+        Args:
+            prompts: List of prompts to generate completions for
+            stop_sequences: Optional list of stop sequences
+            parsers: Optional incremental parser of each completion (e.g. `ToolCallStream`):
+                     the chunks are fed to it as they arrive, and a completion is yielded
+                     as soon as its parser has found a tool call
+
+        Yields:
+            Tuples of (prompt index, completion) in order of completion
+
+        Raises:
+            LLMAPIError: If the request fails after all retries or the stream is cut
+        """
+        if not self.stream:
+            yield from super().generate_batch_stream(prompts, stop_sequences, parsers)
+            return
+
+        if not prompts:
+            return
+
+        responses = ResponseGroup()
+        streams = [
+            self._stream_completions(
+                unique_prompts, n, indices, stop_sequences or [], parsers, responses
+            )
+            for unique_prompts, n, indices in self._plan_requests(prompts)
+        ]
+        source = streams[0] if len(streams) == 1 else self._merge_streams(streams, responses)
+
+        llm_responses = [""] * len(prompts)
+        try:
+            while True:
+                # Only the time waiting for the next completion, not the time the
+                # caller spends on the previous one
+                with span("llm.stream_wait"):
+                    item = next(source, None)
+                if item is None:
+                    break
+                i, text = item
+                llm_responses[i] = text
+                yield i, text
+        finally:
+            source.close()
+            # Also log the batches that the caller stopped consuming early
+            self._log_batch(prompts, llm_responses, stop_sequences)
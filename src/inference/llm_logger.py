@@ -1,22 +1,99 @@
 import os
+import glob
+import gzip
 import json
+import queue
+import atexit
+import shutil
 import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_context: ContextVar[Dict[str, Any]] = ContextVar("llm_log_context", default={})
+
+
+@contextmanager
+def log_context(**fields) -> Iterator[None]:
+    """
+    Add fields (e.g. the theorem being proved) to the metadata of the interactions
+    logged in the block, by any logger.
+
+    The beams of the interactions are given by `beam` (id of the beam of a single
+    prompt) or `beams` (id of the beam of each prompt of a batch), so that the
+    prompt deltas follow the beams whatever their position in the batch.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _beam_key(record: Dict[str, Any], position: int) -> tuple:
+    """
+    Key of the beam of an interaction, whose previous prompt is the base of its delta.
+
+    The beam is given by the `beams` or `beam` fields of the log context, or is the
+    position of the interaction in the batch without them. Keys only need to be the
+    same when writing and reading, a wrong beam just gives a longer delta.
+    """
+    metadata = record.get("metadata", {})
+    if "beams" in metadata:
+        beam = metadata["beams"][position]
+    elif "beam" in metadata and position == 0:
+        beam = metadata["beam"]
+    else:
+        beam = position
+    return (record.get("prefix", ""), metadata.get("theorem"), beam)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """Length of the longest common prefix of two strings."""
+    if a.startswith(b):
+        return len(b)
+    if b.startswith(a):
+        return len(a)
+    # Binary search on slice comparisons, much faster than comparing characters in Python
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
 
 
 class LLMLogger:
     """
     Simple logger specifically for LLM prompts and responses.
 
-    This logger saves each interaction in a separate JSON file for easy analysis.
+    Interactions are handed to a background thread, which appends them as compact
+    JSON lines to segment files. A segment is gzipped once it reaches
+    `max_segment_bytes`, and a new one is started.
+
+    The prompt of a beam grows with each iteration, so it is stored as the length
+    of the prefix it shares with the previous prompt of the same beam (same prefix,
+    theorem and beam id from `log_context`, or position in the batch) and the text
+    after it. Each segment starts without
+    previous prompts, so it can be decoded alone (see `read_logs`).
     """
 
+    SEGMENT_PATTERN = "llm_log_*.jsonl*"
+
     def __init__(
         self,
         log_dir: str = "llm_logs",
         enabled: bool = True,
         log_to_console: bool = False,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        compress: bool = True,
+        max_pending: int = 1024,
     ):
         """
         Initialize the LLM logger.
@@ -25,14 +102,36 @@ class LLMLogger:
             log_dir: Directory to store log files
             enabled: Whether logging is enabled
             log_to_console: Whether to also print logs to console
+            max_segment_bytes: Size of a segment before it is rotated
+            compress: Whether to gzip the rotated segments
+            max_pending: Number of records waiting to be written before logging blocks
         """
         self.log_dir = log_dir
         self.enabled = enabled
         self.log_to_console = log_to_console
+        self.max_segment_bytes = max_segment_bytes
+        self.compress = compress
+
+        # Segments of this logger, unique among the processes sharing the directory
+        self._segment_name = (
+            f"llm_log_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}"
+        )
+        self._segment_index = 0
+        self._segment = None
+        self._segment_path = None
+        self._segment_bytes = 0
+        # Beam key -> last prompt written in the segment
+        self._previous_prompts: Dict[Any, str] = {}
+
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(max_pending)
+        self._writer: Optional[threading.Thread] = None
 
         # Create log directory if it doesn't exist
         if enabled:
             os.makedirs(log_dir, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
 
     def log_interaction(
         self,
@@ -48,29 +147,12 @@ class LLMLogger:
             prompt: The prompt sent to the LLM
             response: The response from the LLM
             metadata: Optional metadata to include in the log
-            prefix: Optional prefix for the log filename
+            prefix: Optional prefix identifying the source of the interaction
         """
         if not self.enabled:
             return
 
-        # Create a timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-
-        # Create log data
-        log_data = {"timestamp": timestamp, "prompt": prompt, "response": response}
-
-        # Add metadata if provided
-        if metadata:
-            log_data["metadata"] = metadata
-
-        # Create log filename with optional prefix
-        filename = f"{prefix}_" if prefix else ""
-        filename += f"llm_interaction_{timestamp}.json"
-
-        # Write to log file
-        log_path = os.path.join(self.log_dir, filename)
-        with open(log_path, "w") as f:
-            json.dump(log_data, f, indent=2)
+        timestamp = self._submit([prompt], [response], metadata, prefix)
 
         # Print to console if enabled
         if self.log_to_console:
@@ -93,37 +175,152 @@ class LLMLogger:
             prompts: The prompts sent to the LLM
             responses: The responses from the LLM
             metadata: Optional metadata to include in the log
-            prefix: Optional prefix for the log filename
+            prefix: Optional prefix identifying the source of the interactions
         """
         if not self.enabled:
             return
 
-        # Create a timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        timestamp = self._submit(prompts, responses, metadata, prefix)
+
+        # Print to console if enabled
+        if self.log_to_console:
+            print(f"\n=== LLM Batch Interaction at {timestamp} ===")
+            print(f"Number of interactions: {len(prompts)}")
+            print("=" * 50)
 
-        # Create log data
-        log_data = {
+    def _submit(
+        self,
+        prompts: List[str],
+        responses: List[str],
+        metadata: Optional[dict],
+        prefix: str,
+    ) -> str:
+        """Queue a record for the writer thread, the encoding is done there."""
+        timestamp = datetime.now().isoformat()
+        if self._writer is None:
+            # Closed
+            return timestamp
+        record = {
             "timestamp": timestamp,
-            "interactions": [
-                {"prompt": p, "response": r} for p, r in zip(prompts, responses)
-            ],
+            "prefix": prefix,
+            "prompts": list(prompts),
+            "responses": list(responses),
         }
-
-        # Add metadata if provided
+        metadata = {**_context.get(), **(metadata or {})}
         if metadata:
-            log_data["metadata"] = metadata
+            record["metadata"] = metadata
+        self._queue.put(record)
+        return timestamp
 
-        # Create log filename with optional prefix
-        filename = f"{prefix}_" if prefix else ""
-        filename += f"llm_batch_interaction_{timestamp}.json"
+    def flush(self) -> None:
+        """Wait until the queued interactions are written."""
+        if self._writer is not None:
+            self._queue.join()
 
-        # Write to log file
-        log_path = os.path.join(self.log_dir, filename)
-        with open(log_path, "w") as f:
-            json.dump(log_data, f, indent=2)
+    def close(self) -> None:
+        """Write the queued interactions, stop the writer and compress the last segment."""
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        self._queue.put(None)
+        writer.join()
+        atexit.unregister(self.close)
 
-        # Print to console if enabled
-        if self.log_to_console:
-            print(f"\n=== LLM Batch Interaction at {timestamp} ===")
-            print(f"Number of interactions: {len(prompts)}")
-            print("=" * 50)
+    def _write_loop(self) -> None:
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    break
+                self._write(record)
+                # Hand the data to the OS when there is nothing else to write
+                if self._queue.empty() and self._segment is not None:
+                    self._segment.flush()
+            except Exception as e:
+                # Losing log records must not stop the search
+                logger.warning(f"Could not write LLM log record: {e}")
+            finally:
+                self._queue.task_done()
+
+        try:
+            self._close_segment()
+        except Exception as e:
+            logger.warning(f"Could not close LLM log segment: {e}")
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._segment is None:
+            self._open_segment()
+
+        interactions = []
+        for position, (prompt, response) in enumerate(
+            zip(record.pop("prompts"), record.pop("responses"))
+        ):
+            key = _beam_key(record, position)
+            shared = common_prefix_length(prompt, self._previous_prompts.get(key, ""))
+            self._previous_prompts[key] = prompt
+            interactions.append(
+                {"shared": shared, "prompt": prompt[shared:], "response": response}
+            )
+        record["interactions"] = interactions
+
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self._segment.write(line)
+        self._segment_bytes += len(line)
+        if self._segment_bytes >= self.max_segment_bytes:
+            self._close_segment()
+
+    def _open_segment(self) -> None:
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._segment_path = os.path.join(
+            self.log_dir, f"{self._segment_name}_{self._segment_index:05d}.jsonl"
+        )
+        self._segment_index += 1
+        self._segment = open(self._segment_path, "w")
+        self._segment_bytes = 0
+        self._previous_prompts = {}
+
+    def _close_segment(self) -> None:
+        if self._segment is None:
+            return
+        self._segment.close()
+        self._segment = None
+        if self.compress:
+            with open(self._segment_path, "rb") as src:
+                with gzip.open(self._segment_path + ".gz", "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+            os.remove(self._segment_path)
+
+
+def read_segment(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read the records of a log segment, with their full prompts.
+
+    Args:
+        path: Path of a `.jsonl` or `.jsonl.gz` segment
+
+    Yields:
+        Records with a `prompt` and a `response` for each of their `interactions`
+    """
+    previous_prompts: Dict[Any, str] = {}
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line cut by a crash
+                continue
+            for position, interaction in enumerate(record["interactions"]):
+                key = _beam_key(record, position)
+                shared = interaction.pop("shared", 0)
+                interaction["prompt"] = (
+                    previous_prompts.get(key, "")[:shared] + interaction["prompt"]
+                )
+                previous_prompts[key] = interaction["prompt"]
+            yield record
+
+
+def read_logs(log_dir: str) -> Iterator[Dict[str, Any]]:
+    """Read the records of all the log segments of a directory (see `read_segment`)."""
+    for path in sorted(glob.glob(os.path.join(log_dir, LLMLogger.SEGMENT_PATTERN))):
+        yield from read_segment(path)
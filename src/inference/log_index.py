@@ -0,0 +1,261 @@
+import os
+import glob
+import json
+import zlib
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from .llm_logger import LLMLogger, read_segment
+
+
+class LogIndex:
+    """
+    SQLite index of the LLM logs of a directory.
+
+    Each interaction is a row with its timestamp, model and theorem, and its prompt
+    and response compressed. A full-text index (FTS5 trigram) finds the interactions
+    containing a substring without reading the others. Queries return an iterator,
+    so the interactions are decompressed one at a time.
+
+    The index is a cache of the log files: `update` only reads the files added or
+    changed since the last update, and the database can be deleted at any time.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS interactions (
+            id INTEGER PRIMARY KEY,
+            file_id INTEGER NOT NULL,
+            record INTEGER NOT NULL,
+            idx INTEGER NOT NULL,
+            timestamp TEXT,
+            model TEXT,
+            theorem TEXT,
+            metadata TEXT,
+            prompt BLOB,
+            response BLOB
+        );
+        CREATE INDEX IF NOT EXISTS interactions_file ON interactions (file_id);
+        CREATE INDEX IF NOT EXISTS interactions_time ON interactions (timestamp);
+        CREATE INDEX IF NOT EXISTS interactions_model ON interactions (model, timestamp);
+        CREATE INDEX IF NOT EXISTS interactions_theorem ON interactions (theorem, timestamp);
+        CREATE VIRTUAL TABLE IF NOT EXISTS interactions_text
+            USING fts5(prompt, response, content='', tokenize='trigram');
+    """
+
+    def __init__(self, log_dir: str, path: Optional[str] = None):
+        """
+        Open (or create) the index of a log directory.
+
+        Args:
+            log_dir: Directory containing log files
+            path: Path of the database (default: `llm_logs.sqlite` in the log directory)
+        """
+        self.log_dir = log_dir
+        self.path = path or os.path.join(log_dir, "llm_logs.sqlite")
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _log_files(self) -> List[str]:
+        """Log segments and JSON files of older runs."""
+        return sorted(
+            glob.glob(os.path.join(self.log_dir, LLMLogger.SEGMENT_PATTERN))
+        ) + sorted(glob.glob(os.path.join(self.log_dir, "*.json")))
+
+    def update(self) -> int:
+        """
+        Index the log files added or changed since the last update, and forget the
+        removed ones (e.g. a segment replaced by its compressed version).
+
+        Returns:
+            Number of interactions added
+        """
+        known = {
+            path: (file_id, size, mtime)
+            for file_id, path, size, mtime in self.connection.execute(
+                "SELECT id, path, size, mtime FROM files"
+            )
+        }
+        added = 0
+        with self.connection:
+            for path in self._log_files():
+                stat = os.stat(path)
+                file = known.pop(os.path.basename(path), None)
+                if file is not None:
+                    if file[1:] == (stat.st_size, stat.st_mtime):
+                        continue
+                    # Segment still being written
+                    self._remove_file(file[0])
+                added += self._add_file(path, stat)
+            for file_id, _, _ in known.values():
+                self._remove_file(file_id)
+        return added
+
+    def _add_file(self, path: str, stat: os.stat_result) -> int:
+        """
+        Index a log file. A file that cannot be read (corrupt, or a compressed segment
+        cut off mid-write) is skipped, and tried again at the next update.
+        """
+        try:
+            if path.endswith(".json"):
+                with open(path, "r") as f:
+                    records = [json.load(f)]
+            else:
+                records = list(read_segment(path))
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return 0
+
+        file_id = self.connection.execute(
+            "INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)",
+            (os.path.basename(path), stat.st_size, stat.st_mtime),
+        ).lastrowid
+
+        count = 0
+        for record_idx, record in enumerate(records):
+            # Older logs have a single interaction per file
+            interactions = record.get("interactions") or [
+                {"prompt": record.get("prompt", ""), "response": record.get("response", "")}
+            ]
+            metadata = record.get("metadata") or {}
+            timestamp = _normalize_timestamp(record.get("timestamp"))
+            for idx, interaction in enumerate(interactions):
+                prompt, response = interaction["prompt"], interaction["response"]
+                rowid = self.connection.execute(
+                    "INSERT INTO interactions (file_id, record, idx, timestamp, model, "
+                    "theorem, metadata, prompt, response) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        file_id,
+                        record_idx,
+                        idx,
+                        timestamp,
+                        metadata.get("model"),
+                        metadata.get("theorem"),
+                        json.dumps(metadata),
+                        zlib.compress(prompt.encode()),
+                        zlib.compress(response.encode()),
+                    ),
+                ).lastrowid
+                self.connection.execute(
+                    "INSERT INTO interactions_text (rowid, prompt, response) VALUES (?, ?, ?)",
+                    (rowid, prompt, response),
+                )
+                count += 1
+        return count
+
+    def _remove_file(self, file_id: int) -> None:
+        rows = self.connection.execute(
+            "SELECT id, prompt, response FROM interactions WHERE file_id = ?", (file_id,)
+        ).fetchall()
+        # A contentless full-text index needs the indexed values to delete a row
+        self.connection.executemany(
+            "INSERT INTO interactions_text (interactions_text, rowid, prompt, response) "
+            "VALUES ('delete', ?, ?, ?)",
+            [(rowid, _decompress(p), _decompress(r)) for rowid, p, r in rows],
+        )
+        self.connection.execute("DELETE FROM interactions WHERE file_id = ?", (file_id,))
+        self.connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def query(
+        self,
+        model: Optional[str] = None,
+        theorem: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        contains: Optional[str] = None,
+        latest: bool = False,
+        limit: Optional[int] = None,
+        sort_by_time: bool = True,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the interactions matching all the given filters.
+
+        Args:
+            model: Name of the model
+            theorem: Name of the theorem
+            since: First timestamp (ISO format, e.g. "2024-05-01" or "2024-05-01T12:00")
+            until: Last timestamp (ISO format, a date includes the whole day)
+            contains: Substring of the prompt or the response (case insensitive)
+            latest: Whether to start from the most recent interactions
+            limit: Maximum number of interactions
+            sort_by_time: Whether to sort by timestamp (otherwise in the order of the files)
+
+        Yields:
+            Interactions, in the format of `view_llm_logs.load_log_files`
+        """
+        conditions, params = [], []
+        for column, value in (("model", model), ("theorem", theorem)):
+            if value is not None:
+                conditions.append(f"i.{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("i.timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            # Timestamps are ISO strings: "2024-05-01T..." < "2024-05-01~"
+            conditions.append("i.timestamp <= ?")
+            params.append(until + "~")
+        # The trigram index only finds substrings of at least 3 characters,
+        # shorter ones are checked on the decompressed text
+        use_text_index = contains is not None and len(contains) >= 3
+        if use_text_index:
+            conditions.append(
+                "i.id IN (SELECT rowid FROM interactions_text WHERE interactions_text MATCH ?)"
+            )
+            params.append('"' + contains.replace('"', '""') + '"')
+
+        sql = (
+            "SELECT i.timestamp, i.metadata, i.prompt, i.response, i.idx, f.path "
+            "FROM interactions i JOIN files f ON f.id = i.file_id"
+        )
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        order = "DESC" if latest else "ASC"
+        if sort_by_time:
+            sql += f" ORDER BY i.timestamp {order}, i.id {order}"
+        else:
+            sql += f" ORDER BY i.id {order}"
+        if limit is not None and contains is None:
+            # Otherwise rows can still be dropped by the substring check
+            sql += f" LIMIT {int(limit)}"
+
+        needle = contains.lower() if contains is not None else None
+        count = 0
+        for timestamp, metadata, prompt, response, idx, path in self.connection.execute(sql, params):
+            if limit is not None and count >= limit:
+                return
+            prompt, response = _decompress(prompt), _decompress(response)
+            if needle is not None and needle not in prompt.lower() and needle not in response.lower():
+                continue
+            count += 1
+            yield {
+                "timestamp": timestamp,
+                "metadata": json.loads(metadata),
+                "prompt": prompt,
+                "response": response,
+                "_filename": path,
+                "_interaction_idx": idx,
+            }
+
+
+def _decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode()
+
+
+def _normalize_timestamp(timestamp: Optional[str]) -> Optional[str]:
+    """Timestamps in ISO format, older logs used "%Y%m%d_%H%M%S_%f"."""
+    if timestamp is None:
+        return None
+    try:
+        return datetime.strptime(timestamp, "%Y%m%d_%H%M%S_%f").isoformat()
+    except ValueError:
+        return timestamp
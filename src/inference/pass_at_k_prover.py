@@ -1,6 +1,7 @@
 import os
 import sys
 import argparse
+from contextlib import closing
 from typing import List, Optional, Tuple, Dict, Any
 
 from pytanque import Pytanque
@@ -8,6 +9,11 @@ from pytanque import Pytanque
 from .prover_agent import CoqProofManager, ProverResult
 from .tools import ScriptTool
 from .llm import VLLM
+from .transposition import TranspositionTable
+from .deadline import Deadline, check_deadline
+from .tracing import set_iteration
+from .llm_logger import log_context
+from .prompt_manager import PromptManager
 
 class PassAtKProver:
     """
@@ -23,6 +29,8 @@ class PassAtKProver:
         verbose: bool = False,
         goals_tag: str = "GOALS",
         result_tag: str = "r",
+        merge_transpositions: bool = False,
+        prompt_budget: Optional[int] = None,
     ):
         """
         Initialize the pass@k prover.
@@ -35,6 +43,10 @@ class PassAtKProver:
             verbose: Whether to print verbose output
             goals_tag: The XML tag to use for goals (default: "GOALS")
             result_tag: The tag to use for result output (default: "r")
+            merge_transpositions: Whether to stop exploring paths that reach a proof state
+                                  already explored by another path
+            prompt_budget: Maximum number of tokens of a prompt, older turns are compacted
+                           beyond it (default: prompts grow with each iteration)
         """
         self.llm = llm
         self.proof_manager = CoqProofManager(coq_tool)
@@ -44,14 +56,32 @@ class PassAtKProver:
         self.goals_tag = goals_tag
         self.result_tag = result_tag
         self.context = coq_tool.env.context
+        self.merge_transpositions = merge_transpositions
+        self.transpositions = TranspositionTable()
+        self.prompt_budget = prompt_budget
+        self.prompt_manager = PromptManager(llm, prompt_budget, goals_tag=goals_tag)
 
-    def run_pass_at_k(self) -> Tuple[bool, List[str]]:
+    def run_pass_at_k(self, deadline: Optional[Deadline] = None) -> Tuple[bool, List[str]]:
         """
         Run pass@k algorithm to find a proof.
 
+        Args:
+            deadline: Optional time budget / cancellation of the search. It is made the
+                      current deadline, so that the LLM requests and Coq calls of the
+                      search are cut when it is reached.
+
         Returns:
             Tuple of (success flag, proof steps)
+
+        Raises:
+            DeadlineExceeded: If the deadline is reached or the search is cancelled
         """
+        if deadline is None:
+            return self._run_pass_at_k()
+        with deadline.activate():
+            return self._run_pass_at_k()
+
+    def _run_pass_at_k(self) -> Tuple[bool, List[str]]:
         if self.verbose:
             print(f"Starting pass@k with k={self.k}")
 
@@ -69,34 +99,68 @@ class PassAtKProver:
             for tool in coq_tools
         ]
 
+        self.prompt_manager = PromptManager(
+            self.llm, self.prompt_budget, coq_tag=tool_tag, goals_tag=self.goals_tag
+        )
+        for i, prompt in enumerate(prompts):
+            self.prompt_manager.start(i, prompt)
+
+        # Paths still being explored
+        self.transpositions = TranspositionTable()
+        active = set(range(self.k))
+
         # Main pass@k loop
         for iteration in range(self.max_iterations):
+            check_deadline()
+            set_iteration(iteration)
             if self.verbose:
                 print(f"\nIteration {iteration+1}/{self.max_iterations}")
 
-            # Generate responses for all paths
-            responses = self.llm.generate_batch(prompts, stop_sequences)
+            # Generate responses for active paths and check each of them with Coq
+            # as soon as it is available
+            active_indices = sorted(active)
+            responses = [""] * len(prompts)
+            results = {}
+            # The stream is closed (and its batch logged) in the context of the paths
+            with log_context(beams=active_indices), closing(
+                self.llm.generate_batch_stream(
+                    [prompts[i] for i in active_indices], stop_sequences
+                )
+            ) as stream:
+                for pos, response in stream:
+                    i = active_indices[pos]
+                    responses[i] = response
+                    if self.verbose:
+                        print(f"Path {i} response: {response[:100]}...")
 
-            if self.verbose:
-                for i, response in enumerate(responses):
-                    print(f"Path {i} response: {response[:100]}...")
+                    result = self.proof_manager.process_response(
+                        response=response, coq_tool=coq_tools[i], verbose=self.verbose
+                    )
 
-            # Process the batch of responses
-            results, successful_result = self.proof_manager.process_batch_responses(
-                responses=responses, coq_tools=coq_tools, verbose=self.verbose
-            )
+                    # If any path completed the proof
+                    if result.success and result.is_complete:
+                        if self.verbose:
+                            print(f"Found successful proof!")
+                        return True, result.proof
+
+                    # Merge paths reaching a state already explored by another path
+                    if self.merge_transpositions and result.success:
+                        owner = self.transpositions.claim(
+                            coq_tools[i].env.state_key, i, active
+                        )
+                        if owner is not None:
+                            if self.verbose:
+                                print(f"Path {i} reached the same state as path {owner}, merging.")
+                            active.discard(i)
+                            continue
 
-            # If any path completed the proof
-            if successful_result:
-                if self.verbose:
-                    print(f"Found successful proof!")
-                return True, successful_result.proof
+                    results[i] = result
 
             # Update prompts for paths that made progress
-            for i, result in enumerate(results):
+            for i, result in results.items():
                 if not result.is_complete:  # and result.success:
                     # Add the response and new goals to the conversation
-                    prompts[i] += self.llm.build_prompt_with_feedback(
+                    feedback = self.llm.build_prompt_with_feedback(
                         goals=result.new_goals,
                         coq_tag=tool_tag,
                         response=responses[i],
@@ -107,6 +171,10 @@ class PassAtKProver:
                         context=self.context,
                         goals_tag=self.goals_tag,
                     )
+                    self.prompt_manager.add_turn(
+                        i, feedback, responses[i], result.success, result.new_goals
+                    )
+                    prompts[i] = self.prompt_manager.prompt(i)
                     # += (
                     #    f"\n<{self.result_tag}>\n{result.proof}\n</{self.result_tag}>\n"
                     #    + responses[i]
@@ -182,6 +250,27 @@ def main():
     parser.add_argument(
         "--context", action="store_true", help="Include context in prompts"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream completions and check each path as soon as it stops",
+    )
+    parser.add_argument(
+        "--n-sampling",
+        action="store_true",
+        help="Send identical prompts once and sample them n times",
+    )
+    parser.add_argument(
+        "--merge-transpositions",
+        action="store_true",
+        help="Merge paths that reach a proof state already explored by another path",
+    )
+    parser.add_argument(
+        "--prompt-budget",
+        type=int,
+        default=None,
+        help="Maximum number of tokens of a prompt, older turns are compacted beyond it",
+    )
 
     # Add logging argument
     parser.add_argument(
@@ -215,6 +304,8 @@ def main():
         verbose=args.verbose,
         log_dir=args.llm_log_dir,
         log_to_console=args.verbose,
+        stream=args.stream,
+        n_sampling=args.n_sampling,
     )
 
     # Create and run the pass@k prover
@@ -226,9 +317,12 @@ def main():
         verbose=args.verbose,
         goals_tag=args.goals_tag,
         result_tag=args.result_tag,
+        merge_transpositions=args.merge_transpositions,
+        prompt_budget=args.prompt_budget,
     )
 
-    success, proof = prover.run_pass_at_k()
+    with log_context(theorem=args.theorem, file=args.file):
+        success, proof = prover.run_pass_at_k()
 
     # Print results
     if success:
@@ -240,6 +334,10 @@ def main():
         print("\nProof incomplete.")
         print("Hint: Try increasing k, max iterations, or temperature.")
 
+    if args.verbose:
+        print(f"\nTactic cache: {script_tool.env.tactic_cache.stats()}")
+        print(f"Prompts: {prover.prompt_manager.stats()}")
+
 
 if __name__ == "__main__":
     main()
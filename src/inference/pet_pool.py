@@ -0,0 +1,85 @@
+from queue import Queue
+
+from pytanque import Pytanque
+
+from src.training.eval import start_pet_server, stop_pet_server
+
+
+class PetServerPool:
+    """
+    Pool of pet-server processes and Pytanque connections.
+
+    A pet-server checks one request at a time, so proving several theorems in
+    parallel needs several servers. The pool owns one connection per server (on
+    consecutive ports), and hands each of them to one worker at a time.
+    """
+
+    def __init__(
+        self,
+        workspace: str,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        num_servers: int = 1,
+        spawn: bool = False,
+        startup_wait: int = 5,
+    ):
+        """
+        Initialize the pool and connect to the servers.
+
+        Args:
+            workspace: Workspace directory of the connections
+            host: Host of the servers
+            port: Port of the first server, the others use the next ports
+            num_servers: Number of servers
+            spawn: Whether to start the pet-server processes (otherwise they must be running)
+            startup_wait: Average time in seconds to wait for a spawned server to be ready
+        """
+        self.workspace = workspace
+        self.host = host
+        self.ports = [port + i for i in range(num_servers)]
+        self.processes = []
+
+        if spawn:
+            self.processes = [
+                start_pet_server(p, mean_wait=startup_wait) for p in self.ports
+            ]
+
+        self.connections: "Queue[Pytanque]" = Queue()
+        for p in self.ports:
+            self.connections.put(self._connect(p))
+
+    def __len__(self) -> int:
+        return len(self.ports)
+
+    def _connect(self, port: int) -> Pytanque:
+        pet = Pytanque(self.host, port)
+        pet.connect()
+        pet.set_workspace(False, str(self.workspace))
+        return pet
+
+    def acquire(self) -> Pytanque:
+        """Borrow a connection, waiting for one to be free."""
+        return self.connections.get()
+
+    def release(self, pet: Pytanque) -> None:
+        """Give a borrowed connection back to the pool."""
+        self.connections.put(pet)
+
+    def reconnect(self, pet: Pytanque) -> Pytanque:
+        """Replace a connection by a new one to the same server."""
+        try:
+            pet.close()
+        except Exception:
+            pass
+        return self._connect(pet.port)
+
+    def close(self) -> None:
+        """Close all connections and stop the spawned servers."""
+        while not self.connections.empty():
+            try:
+                self.connections.get_nowait().close()
+            except Exception:
+                pass
+        for process in self.processes:
+            stop_pet_server(process)
+        self.processes = []
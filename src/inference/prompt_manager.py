@@ -0,0 +1,189 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from .llm import LLM
+from .prompts import tactic_prompts
+
+
+@dataclass
+class Turn:
+    """Feedback appended to a prompt after one iteration, in full and compacted form."""
+
+    text: str
+    compact_text: str
+    num_tokens: Optional[int] = None
+    compact_num_tokens: Optional[int] = None
+    compacted: bool = False
+
+    @property
+    def current_num_tokens(self) -> int:
+        return self.compact_num_tokens if self.compacted else self.num_tokens
+
+
+class PromptManager:
+    """
+    Prompts of the beams of a pass@k search, kept within a token budget.
+
+    Each prompt is the initial prompt followed by one turn per iteration (the
+    response of the model and the feedback of Coq). When a prompt exceeds the
+    budget, its oldest turns are compacted to the tactics they tried, their outcome
+    and the resulting goals, and if that is not enough the oldest compacted turns
+    are dropped. The most recent turns are always kept in full.
+
+    Turns are compacted from the oldest to the newest and never expanded back, so
+    the beginning of a prompt stays the same across iterations and can be reused by
+    the prefix cache of the server.
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        budget: Optional[int] = None,
+        keep_recent: int = 1,
+        coq_tag: str = "script",
+        goals_tag: str = "GOALS",
+    ):
+        """
+        Initialize the prompt manager.
+
+        Args:
+            llm: The LLM, whose tokenizer is used to count tokens
+            budget: Maximum number of tokens of a prompt (default: no limit, the turns
+                    are never compacted)
+            keep_recent: Number of most recent turns never compacted
+            coq_tag: The XML tag used for Coq code
+            goals_tag: The XML tag used for goals
+        """
+        self.llm = llm
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.coq_tag = coq_tag
+        self.goals_tag = goals_tag
+        self.script_pattern = re.compile(
+            f"<{coq_tag}>(.*?)(?:</{coq_tag}>|$)", re.DOTALL
+        )
+
+        self.heads: Dict[int, str] = {}
+        self.head_tokens: Dict[int, Optional[int]] = {}
+        self.turns: Dict[int, List[Turn]] = {}
+        # Number of turns dropped at the beginning of each prompt
+        self.dropped: Dict[int, int] = {}
+        self.omitted_tokens: Dict[int, int] = {}
+
+        self.compactions = 0
+        self.max_prompt_tokens = 0
+
+    def start(self, beam: int, prompt: str) -> None:
+        """Set the initial prompt of a beam."""
+        self.heads[beam] = prompt
+        self.head_tokens[beam] = None
+        self.turns[beam] = []
+        self.dropped[beam] = 0
+
+    def add_turn(
+        self,
+        beam: int,
+        feedback: str,
+        response: str,
+        success: bool,
+        goals: str,
+    ) -> None:
+        """
+        Append the feedback of an iteration to the prompt of a beam.
+
+        Args:
+            beam: Index of the beam
+            feedback: Full text of the turn (see `LLM.build_prompt_with_feedback`)
+            response: Response of the model, whose last Coq script is kept when compacted
+            success: Whether the script was valid
+            goals: Goals after the script
+        """
+        scripts = self.script_pattern.findall(response)
+        script = scripts[-1].strip() if scripts else ""
+        if success:
+            compact_text = tactic_prompts.prompt_compact_progress.format(
+                coq_tag=self.coq_tag, script=script, goals_tag=self.goals_tag, goals=goals
+            )
+        else:
+            compact_text = tactic_prompts.prompt_compact_failed.format(
+                coq_tag=self.coq_tag, script=script
+            )
+        if len(compact_text) >= len(feedback):
+            compact_text = feedback
+        self.turns[beam].append(Turn(feedback, compact_text))
+
+    def prompt(self, beam: int) -> str:
+        """Return the prompt of a beam, compacted to fit in the budget."""
+        if self.budget is not None:
+            self._fit(beam)
+        turns = self.turns[beam]
+        parts = [self.heads[beam]]
+        if self.dropped[beam]:
+            parts.append(tactic_prompts.prompt_omitted.format(count=self.dropped[beam]))
+        parts.extend(t.compact_text if t.compacted else t.text for t in turns)
+        return "".join(parts)
+
+    def num_tokens(self, beam: int) -> int:
+        """Number of tokens of the prompt of a beam (sum of the counts of its parts)."""
+        self._count(beam)
+        return (
+            self.head_tokens[beam]
+            + self._omitted_tokens(self.dropped[beam])
+            + sum(t.current_num_tokens for t in self.turns[beam])
+        )
+
+    def _omitted_tokens(self, count: int) -> int:
+        """Number of tokens of the mention of `count` dropped turns."""
+        if not count:
+            return 0
+        if count not in self.omitted_tokens:
+            (self.omitted_tokens[count],) = self.llm.count_tokens(
+                [tactic_prompts.prompt_omitted.format(count=count)]
+            )
+        return self.omitted_tokens[count]
+
+    def _count(self, beam: int) -> None:
+        """Count the tokens of the parts of a prompt not counted yet, in one batch."""
+        texts = []
+        if self.head_tokens[beam] is None:
+            texts.append(self.heads[beam])
+        for turn in self.turns[beam]:
+            if turn.num_tokens is None:
+                texts.extend([turn.text, turn.compact_text])
+        if not texts:
+            return
+
+        counts = iter(self.llm.count_tokens(texts))
+        if self.head_tokens[beam] is None:
+            self.head_tokens[beam] = next(counts)
+        for turn in self.turns[beam]:
+            if turn.num_tokens is None:
+                turn.num_tokens = next(counts)
+                turn.compact_num_tokens = next(counts)
+
+    def _fit(self, beam: int) -> None:
+        turns = self.turns[beam]
+        total = self.num_tokens(beam)
+        # Compact the oldest turns first
+        for turn in turns[: max(0, len(turns) - self.keep_recent)]:
+            if total <= self.budget:
+                break
+            if not turn.compacted:
+                turn.compacted = True
+                total -= turn.num_tokens - turn.compact_num_tokens
+                self.compactions += 1
+        # Then drop them
+        while total > self.budget and len(turns) > self.keep_recent:
+            total -= turns.pop(0).current_num_tokens
+            total -= self._omitted_tokens(self.dropped[beam])
+            self.dropped[beam] += 1
+            total += self._omitted_tokens(self.dropped[beam])
+        self.max_prompt_tokens = max(self.max_prompt_tokens, total)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "compactions": self.compactions,
+            "dropped_turns": sum(self.dropped.values()),
+            "max_prompt_tokens": self.max_prompt_tokens,
+        }
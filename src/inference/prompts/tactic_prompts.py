@@ -95,3 +95,24 @@ The steps of the proof I proposed so far are valid and the current goals are now
 {goals}
 </{goals_tag}>
 """
+
+prompt_compact_progress = """
+<{coq_tag}>
+{script}
+</{coq_tag}>
+This step is valid, the goals were then:
+<{goals_tag}>
+{goals}
+</{goals_tag}>
+"""
+
+prompt_compact_failed = """
+<{coq_tag}>
+{script}
+</{coq_tag}>
+This step is not valid.
+"""
+
+prompt_omitted = """
+({count} earlier steps omitted)
+"""
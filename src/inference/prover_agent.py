@@ -5,6 +5,7 @@ import copy
 
 from .tools import ScriptTool
 from .llm import LLM
+from .deadline import check_deadline
 
 
 @dataclass
@@ -67,7 +68,12 @@ class CoqProofManager:
 
         Returns:
             ProverResult indicating success/failure and next steps
+
+        Raises:
+            DeadlineExceeded: If the deadline of the current task is reached
         """
+        check_deadline()
+
         # Extract script from the response
         script_info = self.extract_script(response)
 
@@ -177,8 +183,8 @@ class CoqProofManager:
         Returns:
             Tuple of (Coq tools, active indices)
         """
-        # Create deep copies of the Coq tool for each beam
-        coq_tools = [self.coq_tool.deepcopy() for _ in range(beam_size)]
+        # Fork the Coq tool for each beam, without starting the theorem again
+        coq_tools = [self.coq_tool.fork() for _ in range(beam_size)]
 
         # Track which beams are active
         active_indices = list(range(beam_size))
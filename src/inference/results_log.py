@@ -0,0 +1,126 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class ResultsLog:
+    """
+    Append-only JSONL log of benchmark results.
+
+    Each result is written and flushed as soon as its theorem is done, so that a crash
+    or a job time limit only loses the theorems in progress. Opening an existing log
+    loads its results, so that a restarted run can skip them. Summary statistics are
+    updated with each result instead of being recomputed from all the results.
+    """
+
+    # Errors that are final results, the other errors are retried when the run is restarted
+    FINAL_ERRORS = ("timeout",)
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the log.
+
+        Args:
+            path: Path of the JSONL file (default: results are only kept in memory)
+        """
+        self.path = path
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self._reset_stats()
+
+        if path and os.path.exists(path):
+            self._load()
+
+    def _reset_stats(self) -> None:
+        self.total = 0
+        self.successes = 0
+        self.total_duration = 0.0
+        self.total_proof_length = 0
+        self.fastest: Optional[Dict[str, Any]] = None
+        self.slowest: Optional[Dict[str, Any]] = None
+        # phase -> [count, total seconds] over all theorems
+        self.timings: Dict[str, List[float]] = {}
+
+    def _load(self) -> None:
+        with open(self.path, "r") as f:
+            lines = f.read().split("\n")
+        for line in lines:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Empty line, or last line cut by a crash
+                continue
+            self.results[result["theorem"]] = result
+        if lines[-1]:
+            # Do not append the next result to a cut line
+            with open(self.path, "a") as f:
+                f.write("\n")
+        for result in self.results.values():
+            self._update_stats(result)
+
+    def _update_stats(self, result: Dict[str, Any]) -> None:
+        self.total += 1
+        self.total_duration += result["duration"]
+        if result["success"]:
+            self.successes += 1
+            self.total_proof_length += result["proof_length"]
+        if self.fastest is None or result["duration"] < self.fastest["duration"]:
+            self.fastest = result
+        if self.slowest is None or result["duration"] > self.slowest["duration"]:
+            self.slowest = result
+        for phase, timing in result.get("timings", {}).get("phases", {}).items():
+            totals = self.timings.setdefault(phase, [0, 0.0])
+            totals[0] += timing["count"]
+            totals[1] += timing["total"]
+
+    def is_done(self, theorem: str) -> bool:
+        """Whether a theorem has a final result (errors other than timeouts are retried)."""
+        result = self.results.get(theorem)
+        return result is not None and result.get("error") in (None, *self.FINAL_ERRORS)
+
+    def add(self, result: Dict[str, Any]) -> None:
+        """Record the result of a theorem and append it to the log."""
+        with self.lock:
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            replaced = result["theorem"] in self.results
+            self.results[result["theorem"]] = result
+            if replaced:
+                # A retried theorem: its previous result no longer counts
+                self._reset_stats()
+                for r in self.results.values():
+                    self._update_stats(r)
+            else:
+                self._update_stats(result)
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the summary statistics of the results so far."""
+        with self.lock:
+            return {
+                "total_theorems": self.total,
+                "successful_theorems": self.successes,
+                "success_rate": self.successes / self.total if self.total else 0,
+                "total_duration": self.total_duration,
+                "avg_duration": self.total_duration / self.total if self.total else 0,
+                "avg_proof_length": (
+                    self.total_proof_length / self.successes if self.successes else 0
+                ),
+                "fastest_theorem": self.fastest["theorem"] if self.fastest else None,
+                "fastest_time": self.fastest["duration"] if self.fastest else None,
+                "slowest_theorem": self.slowest["theorem"] if self.slowest else None,
+                "slowest_time": self.slowest["duration"] if self.slowest else None,
+                # Time spent in each phase, over all theorems and per theorem
+                "timings": {
+                    phase: {
+                        "count": count,
+                        "total": total,
+                        "per_theorem": total / self.total,
+                    }
+                    for phase, (count, total) in self.timings.items()
+                },
+            }
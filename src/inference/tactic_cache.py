@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from pytanque import State, PetanqueError
+
+
+def normalize_tactic(tac: str) -> str:
+    """
+    Normalize a tactic for cache lookups.
+
+    Leading/trailing whitespace is dropped and inner runs of whitespace are collapsed,
+    so `intros  n .` and `intros n .` share an entry.
+    """
+    return " ".join(tac.split())
+
+
+# Code of the Petanque error of an interrupted request (e.g. by its timeout)
+PETANQUE_INTERRUPTED = -32001
+
+
+def is_timeout(err: PetanqueError) -> bool:
+    """Whether a Petanque error comes from a timeout rather than from the tactic itself."""
+    return getattr(err, "code", None) == PETANQUE_INTERRUPTED or "timeout" in str(err.message).lower()
+
+
+def state_fingerprint(state: State) -> Hashable:
+    """
+    Fingerprint of a Petanque state.
+
+    Petanque identifies states by `st`. Cache hits return the cached state object,
+    so beams replaying the same tactics from a shared state keep the same
+    fingerprints and keep hitting the cache.
+    """
+    return state.st
+
+
+class TacticCache:
+    """
+    Bounded LRU cache of tactic results keyed by (state fingerprint, normalized tactic).
+
+    Both outcomes are cached: the resulting state on success, and the Petanque error on
+    failure, since models often retry the exact same failing step. Timeouts are not
+    cached, the tactic may succeed on a less loaded server. The cache is
+    thread-safe so it can be shared by beams running concurrently.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries, the least recently used entry is evicted first
+        """
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Tuple[Hashable, str], Any]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.error_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def run(
+        self,
+        pet,
+        state: State,
+        tac: str,
+        timeout: Optional[float] = None,
+        cache_errors: bool = True,
+    ) -> State:
+        """
+        Run `tac` on `state`, or replay its cached result.
+
+        Args:
+            pet: Pytanque connection used on a cache miss
+            state: State to run the tactic on
+            tac: Tactic to run
+            timeout: Timeout in seconds for Petanque
+            cache_errors: Whether to cache a failure (not when the timeout was shortened),
+                          timeouts are never cached
+
+        Returns:
+            The resulting state
+
+        Raises:
+            PetanqueError: If the tactic fails (or failed before)
+        """
+        key = (state_fingerprint(state), normalize_tactic(tac))
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if isinstance(result, PetanqueError):
+                    self.error_hits += 1
+                    raise result.with_traceback(None)
+                return result
+            self.misses += 1
+
+        try:
+            result = pet.run(state, tac, timeout=timeout)
+        except PetanqueError as err:
+            if cache_errors and not is_timeout(err):
+                self._store(key, err)
+            raise
+        self._store(key, result)
+        return result
+
+    def _store(self, key: Tuple[Hashable, str], result: Any) -> None:
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries (statistics are kept)."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate statistics."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "lookups": lookups,
+                "hits": self.hits,
+                "error_hits": self.error_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
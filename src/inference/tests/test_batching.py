@@ -0,0 +1,69 @@
+import tempfile
+import unittest
+
+import torch
+
+from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.models.batching import generate_batched, length_buckets
+from .test_hybrid_index import FakeEmbedding
+
+
+class RecordingEmbedding(FakeEmbedding):
+    """Fake embeddings recording the size of each batch."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def generate(self, sentence, query=False):
+        self.batches.append(list(sentence))
+        return super().generate(sentence, query)
+
+
+class TestBatching(unittest.TestCase):
+    """Test cases for the batching of the inputs by token length."""
+
+    def test_length_buckets(self):
+        """Test that batches are sorted by length and stay under the budget."""
+        lengths = [3, 10, 1, 7, 10, 2, 30]
+        batches = length_buckets(lengths, max_tokens=20)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(lengths))))
+        # The input longer than the budget is alone
+        self.assertEqual(batches[0], [6])
+        for batch in batches[1:]:
+            self.assertLessEqual(len(batch) * max(lengths[i] for i in batch), 20)
+        order = [lengths[i] for batch in batches for i in batch]
+        self.assertEqual(order, sorted(lengths, reverse=True))
+
+        self.assertEqual([len(batch) for batch in length_buckets(lengths, max_batch_size=3)], [3, 3, 1])
+        self.assertEqual(length_buckets([]), [])
+
+    def test_order_is_restored(self):
+        """Test that the embeddings are returned in the order of the inputs."""
+        model = RecordingEmbedding()
+        sentences = ["a" * (4 * n) for n in (1, 8, 2, 16, 4)] + ["short"]
+        embeddings = generate_batched(model, sentences, max_tokens=20)
+        self.assertTrue(torch.allclose(embeddings, FakeEmbedding().generate(sentences)))
+        self.assertGreater(len(model.batches), 1)
+        self.assertEqual(model.batches[0], [sentences[3]])
+
+    def test_index_batches_docstrings(self):
+        """Test that the index embeds its docstrings under the token budget."""
+        model = RecordingEmbedding()
+        content = {
+            f"Lib.lemma{i}": {"fullname": f"Lib.lemma{i}", "docstring": "Statement. " * (1 + i % 7)}
+            for i in range(50)
+        }
+        with tempfile.TemporaryDirectory() as cache_path:
+            index = FaissIndex(model, content, cache_path=cache_path, batch_size=16, max_tokens=64)
+            lengths = [[model.token_lengths([s])[0] for s in batch] for batch in model.batches]
+            for batch in lengths:
+                self.assertTrue(len(batch) <= 16)
+                self.assertTrue(len(batch) == 1 or len(batch) * max(batch) <= 64)
+            # Embeddings are stored under their docstrings whatever the batch
+            expected = FakeEmbedding().generate([element["docstring"] for element in content.values()])
+            self.assertTrue(torch.allclose(torch.from_numpy(index.all_embeddings.copy()), expected, atol=1e-6))
+
+
+if __name__ == "__main__":
+    unittest.main()
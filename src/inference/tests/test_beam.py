@@ -1,6 +1,9 @@
 import unittest
 import os
 import sys
+import threading
+import time
+from types import SimpleNamespace
 from typing import List, Dict, Any, Optional
 
 from pytanque import Pytanque
@@ -9,6 +12,7 @@ from pytanque import Pytanque
 from ..agent import Parser, ToolHandler, MathProofAgent
 from ..tools import Tool, ScriptTool, HaveTool
 from ..llm import LLM
+from ..deadline import current_deadline
 
 
 
@@ -52,6 +56,26 @@ class BeamSearchTestLLM(LLM):
         return responses
 
 
+# Fake LLM shared by concurrent beams
+class SharedQueueLLM(LLM):
+    """A fake LLM that serves responses from a single queue, whatever the beam."""
+
+    def __init__(self, responses: List[str]):
+        self.responses = list(responses)
+        self.lock = threading.Lock()
+
+    def generate(self, prompt: str, stop_sequences: Optional[List[str]] = None) -> str:
+        """Pop the next response of the queue."""
+        with self.lock:
+            return self.responses.pop(0) if self.responses else ""
+
+    def generate_batch(
+        self, prompts: List[str], stop_sequences: Optional[List[str]] = None
+    ) -> List[str]:
+        """Pop one response per prompt."""
+        return [self.generate(prompt, stop_sequences) for prompt in prompts]
+
+
 # Simple search tool for testing
 class TestSearchTool(Tool):
     """A simple search tool for testing."""
@@ -77,6 +101,161 @@ class TestSearchTool(Tool):
         return [f"Search result for: {input_text}"]
 
 
+# Search tool recording its batches
+class BatchSearchTool(TestSearchTool):
+    """A search tool recording the queries of each batch."""
+
+    def __init__(self):
+        self.batches = []
+
+    def run(self, input_text: str) -> Any:
+        return self.run_batch([input_text])[0]
+
+    def run_batch(self, inputs: List[str]) -> List[Any]:
+        self.batches.append(list(inputs))
+        return [{"content": f"Search result for: {input_text}"} for input_text in inputs]
+
+
+# Search tool checking that the beams do not call it concurrently
+class SerialSearchTool(BatchSearchTool):
+    """A search tool recording the largest number of concurrent calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.max_active = 0
+
+    def run(self, input_text: str) -> Any:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        self.active -= 1
+        return super().run(input_text)
+
+
+# Tool with per-beam state
+class ForkingTool(Tool):
+    """A tool recording its forks and whether they are closed."""
+
+    def __init__(self):
+        self.forks = []
+        self.closed = False
+
+    @property
+    def name(self) -> str:
+        return "echo"
+
+    @property
+    def description(self) -> str:
+        return "Echo the input."
+
+    @property
+    def instruction(self) -> str:
+        return "Echo the input."
+
+    @property
+    def tag(self) -> str:
+        return "echo"
+
+    def run(self, input_text: str) -> Any:
+        return {"status": "error", "message": input_text}
+
+    def fork(self, new_connection: bool = False) -> "ForkingTool":
+        new = type(self)()
+        self.forks.append(new)
+        return new
+
+    def close(self) -> None:
+        self.closed = True
+
+
+# Prover tool completing the proof with any tactic
+class CompletingTool(ForkingTool):
+    """A Coq tool whose forks complete the proof on their first tactic."""
+
+    @property
+    def name(self) -> str:
+        return "coq-prover"
+
+    @property
+    def tag(self) -> str:
+        return "script"
+
+    def run(self, input_text: str) -> Any:
+        self.env = SimpleNamespace(proof=[input_text])
+        return {"status": "success", "is_complete": True}
+
+
+# Fake LLM where only the first generation is fast
+class CancellableLLM(SharedQueueLLM):
+    """The first generation proves the theorem, the others last until their beam is cancelled."""
+
+    def __init__(self):
+        super().__init__(["<script>lia.</script>"])
+        self.cancelled = 0
+
+    def generate(self, prompt: str, stop_sequences: Optional[List[str]] = None) -> str:
+        response = super().generate(prompt, stop_sequences)
+        if response:
+            return response
+        deadline = current_deadline()
+        start = time.monotonic()
+        while time.monotonic() - start < 5:
+            if deadline is not None and deadline.expired:
+                with self.lock:
+                    self.cancelled += 1
+                break
+            time.sleep(0.01)
+        return ""
+
+
+def wait_until(condition, timeout=5.0) -> bool:
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestConcurrentTools(unittest.TestCase):
+    """Test cases for the tools of concurrent beams (no Coq server needed)."""
+
+    def test_losing_beams_do_not_delay_the_result(self):
+        """Test that the first proof is returned without waiting for the other beams."""
+        prover = CompletingTool()
+        handler = ToolHandler(Parser(), {"coq-prover": prover})
+        llm = CancellableLLM()
+
+        start = time.monotonic()
+        result = handler.process_with_tools(llm, "prompt", beam_size=3, concurrent=True)
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertTrue(result.success)
+        self.assertEqual(result.proof, ["lia."])
+        # The other generations see the cancellation, then the forks are closed
+        self.assertTrue(wait_until(lambda: llm.cancelled == 2))
+        self.assertTrue(wait_until(lambda: all(fork.closed for fork in prover.forks)))
+
+    def test_tools_are_forked_and_closed(self):
+        """Test that stateful tools are forked per beam and closed, and shared ones serialized."""
+        search_tool = SerialSearchTool()
+        forking_tool = ForkingTool()
+        handler = ToolHandler(Parser(), {"search": search_tool, "echo": forking_tool})
+        llm = SharedQueueLLM(
+            ["<SEARCH>a</SEARCH>", "<SEARCH>b</SEARCH>", "<SEARCH>c</SEARCH>", "<echo>x</echo>"]
+        )
+
+        result = handler.process_with_tools(llm, "prompt", beam_size=3, concurrent=True)
+
+        self.assertFalse(result.success)
+        self.assertEqual(len(forking_tool.forks), 3)
+        self.assertTrue(wait_until(lambda: all(fork.closed for fork in forking_tool.forks)))
+        self.assertFalse(forking_tool.closed)
+        self.assertEqual(search_tool.max_active, 1)
+        self.assertEqual(sorted(query for batch in search_tool.batches for query in batch), ["a", "b", "c"])
+
+
 class TestBeamSearch(unittest.TestCase):
     """Test cases for beam search functionality."""
 
@@ -228,6 +407,50 @@ class TestBeamSearch(unittest.TestCase):
         self.assertEqual(len(result.proof), 1)
         self.assertEqual(result.proof[0], "lia.")
 
+    def test_searches_of_an_iteration_are_batched(self):
+        """Test that the searches of all beams in an iteration are run together."""
+        beam_responses = [
+            ["<SEARCH>add comm</SEARCH>", "<script>lia.</script>"],
+            ["<SEARCH>mul comm</SEARCH>", "<script>invalid_tactic.</script>"],
+            ["<script>invalid_tactic.</script>"],
+        ]
+        search_tool = BatchSearchTool()
+        agent = MathProofAgent(
+            BeamSearchTestLLM(beam_responses), search_tool, self.script_tool, self.have_tool
+        )
+        result = agent.run_proof(beam_size=3)
+
+        self.assertTrue(result.success)
+        self.assertEqual(search_tool.batches, [["add comm", "mul comm"]])
+
+    def test_concurrent_beam_search_succeeds(self):
+        """Test asynchronous beam search where one beam finds the proof."""
+        test_llm = SharedQueueLLM(
+            [
+                "Let me try this: <script>invalid_tactic.</script>",
+                "Let me solve it directly: <script>lia.</script>",
+                "Let me try this: <script>invalid_tactic.</script>",
+            ]
+        )
+
+        agent = MathProofAgent(test_llm, self.search_tool, self.script_tool, self.have_tool)
+        result = agent.run_proof(beam_size=3, concurrent=True)
+
+        self.assertTrue(result.success)
+        self.assertEqual(result.proof, ["lia."])
+
+    def test_concurrent_beam_search_all_paths_fail(self):
+        """Test asynchronous beam search where all beams fail."""
+        test_llm = SharedQueueLLM(
+            ["<script>invalid_tactic1.</script>", "<script>invalid_tactic2.</script>"]
+        )
+
+        agent = MathProofAgent(test_llm, self.search_tool, self.script_tool, self.have_tool)
+        result = agent.run_proof(beam_size=2, concurrent=True)
+
+        self.assertFalse(result.success)
+        self.assertEqual(result.proof, [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from ..deadline import (
+    Deadline,
+    DeadlineExceeded,
+    check_deadline,
+    clamp_timeout,
+    current_deadline,
+    propagate,
+)
+from ..llm import VLLM
+
+
+class StalledStreamResponse:
+    """A fake streamed HTTP response that sends one chunk and then stalls until closed."""
+
+    status_code = 200
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def iter_lines(self, decode_unicode=False):
+        yield b'data: {"choices": [{"index": 0, "text": "thinking", "finish_reason": null}]}'
+        self.closed.wait(10)
+        if self.closed.is_set():
+            raise ValueError("I/O operation on closed file")
+
+    def close(self):
+        self.closed.set()
+
+
+class TestDeadline(unittest.TestCase):
+    """Test cases for the Deadline class."""
+
+    def test_expiry(self):
+        """Test that a deadline expires after its budget."""
+        deadline = Deadline(0.05)
+        deadline.check()
+        self.assertLessEqual(deadline.clamp(10), 0.05)
+        time.sleep(0.06)
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.check()
+        # Still a TimeoutError for the existing handlers
+        self.assertRaises(TimeoutError, deadline.check)
+
+    def test_cancel(self):
+        """Test that cancelling fires the registered callbacks."""
+        deadline = Deadline()
+        aborted = threading.Event()
+        with deadline.on_cancel(aborted.set):
+            threading.Timer(0.01, deadline.cancel).start()
+            self.assertTrue(aborted.wait(1))
+        self.assertRaises(DeadlineExceeded, deadline.check)
+
+    def test_callbacks_fire_on_expiry(self):
+        """Test that the callbacks are also fired when the time is up."""
+        deadline = Deadline(0.02)
+        aborted = threading.Event()
+        with deadline.on_cancel(aborted.set):
+            self.assertTrue(aborted.wait(1))
+
+    def test_current_deadline_per_thread(self):
+        """Test that each thread sees the deadline it activated."""
+        self.assertIsNone(current_deadline())
+        self.assertEqual(clamp_timeout(10), 10)
+
+        def task(seconds):
+            with Deadline(seconds).activate():
+                time.sleep(0.05)
+                try:
+                    check_deadline()
+                    return "done"
+                except DeadlineExceeded:
+                    return "timeout"
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(task, [0.01, 10]))
+        self.assertEqual(results, ["timeout", "done"])
+
+    def test_propagate(self):
+        """Test that a wrapped function sees the deadline of the caller in another thread."""
+        deadline = Deadline(10)
+        with deadline.activate():
+            func = propagate(current_deadline)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertIs(executor.submit(func).result(), deadline)
+            self.assertIsNone(executor.submit(current_deadline).result())
+
+
+class TestVLLMDeadline(unittest.TestCase):
+    """Test cases for the deadline of VLLM requests."""
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.llm = VLLM(
+            api_url="http://localhost:8000",
+            model="test-model",
+            log_dir=self.log_dir.name,
+            stream=True,
+        )
+
+    def tearDown(self):
+        self.llm.close()
+        self.log_dir.cleanup()
+
+    def test_stream_is_cut_by_deadline(self):
+        """Test that a stalled generation is aborted when the deadline is reached."""
+        response = StalledStreamResponse()
+        with mock.patch.object(
+            self.llm.client.session, "post", return_value=response
+        ) as post:
+            start = time.monotonic()
+            with Deadline(0.1).activate():
+                with self.assertRaises(DeadlineExceeded):
+                    self.llm.generate_batch(["p0"], ["</script>"])
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(response.closed.is_set())
+        # The read timeout of the request is bounded by the deadline
+        self.assertLessEqual(post.call_args.kwargs["timeout"][1], 0.1)
+
+    def test_expired_deadline_sends_nothing(self):
+        """Test that no request is sent once the deadline is reached."""
+        with mock.patch.object(self.llm.client.session, "post") as post:
+            deadline = Deadline()
+            deadline.cancel()
+            with deadline.activate():
+                with self.assertRaises(DeadlineExceeded):
+                    self.llm.generate_batch(["p0"], ["</script>"])
+        post.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
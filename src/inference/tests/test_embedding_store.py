@@ -0,0 +1,87 @@
+import os
+import unittest
+import tempfile
+
+import numpy as np
+import torch
+
+from src.embedding.index.cosim_index import FaissIndex, string_to_filename
+from src.embedding.index.embedding_store import EmbeddingStore
+from .test_hybrid_index import FakeEmbedding
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    """Test cases for the memory-mapped embedding store."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.cache_dir.name, "model")
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_append_and_reopen(self):
+        """Test that saved rows are read back through the memory map."""
+        store = EmbeddingStore(self.path)
+        embeddings = np.arange(12, dtype=np.float32).reshape(3, 4)
+        store.append(["a", "b", "c"], embeddings)
+        store.append(["d"], np.ones(4))
+        store.save()
+
+        store = EmbeddingStore(self.path)
+        self.assertEqual((len(store), store.dim), (4, 4))
+        self.assertIn("b", store)
+        # All the rows in order are the memory map itself
+        self.assertIsInstance(store.get(["a", "b", "c", "d"]), np.memmap)
+        np.testing.assert_array_equal(store.get(["c", "a"]), embeddings[[2, 0]])
+        np.testing.assert_array_equal(store.get(["d"]), np.ones((1, 4)))
+
+    def test_unsaved_rows_are_dropped(self):
+        """Test that rows appended after the last save are dropped when reopened."""
+        store = EmbeddingStore(self.path)
+        store.append(["a"], np.zeros((1, 2)))
+        store.save()
+        store.append(["b"], np.ones((1, 2)))
+
+        store = EmbeddingStore(self.path)
+        self.assertNotIn("b", store)
+        store.append(["b"], np.full((1, 2), 2.0))
+        store.save()
+        np.testing.assert_array_equal(EmbeddingStore(self.path).get(["a", "b"]), [[0, 0], [2, 2]])
+
+    def test_replace_and_dimension(self):
+        """Test that a key appended again points to its new row."""
+        store = EmbeddingStore(self.path)
+        store.append(["a", "b"], np.zeros((2, 2)))
+        store.append(["a"], np.ones((1, 2)))
+        np.testing.assert_array_equal(store.get(["a", "b"]), [[1, 1], [0, 0]])
+        with self.assertRaises(ValueError):
+            store.append(["c"], np.ones((1, 3)))
+
+    def test_legacy_migration(self):
+        """Test that legacy embeddings are migrated by name, unless their docstring changed."""
+        model = FakeEmbedding()
+        content = {
+            name: {"fullname": name, "docstring": f"Docstring of {name}."} for name in ("a", "b", "c")
+        }
+        cache_path = os.path.join(self.cache_dir.name, model.name())
+        os.makedirs(cache_path)
+        marker = torch.full((16,), 1.0)
+
+        def save_legacy(name, **fields):
+            torch.save({"embedding": marker, **fields}, os.path.join(cache_path, string_to_filename(name) + ".pt"))
+
+        # Current docstring, docstring changed since, and the format of the older
+        # cache (only the embedding)
+        save_legacy("a", docstring="Docstring of a.")
+        save_legacy("b", docstring="Older docstring of b.")
+        save_legacy("c")
+
+        index = FaissIndex(model, content, cache_path=self.cache_dir.name, batch_size=2)
+        self.assertEqual(model.encoded, 1)
+        migrated = [np.allclose(row, marker.numpy() / 4) for row in index.all_embeddings]
+        self.assertEqual(migrated, [True, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import socket
+import threading
+import unittest
+
+from ..http_client import LLMAPIError, PooledSession
+
+
+class FlakyServer:
+    """
+    Local HTTP server closing the connection of the first requests without answering,
+    and answering the next ones (after `delay` seconds).
+    """
+
+    def __init__(self, resets: int, delay: float = 0.0):
+        self.resets = resets
+        self.delay = delay
+        self.requests = 0
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen()
+        self.url = f"http://127.0.0.1:{self.socket.getsockname()[1]}"
+        self.stopped = threading.Event()
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while not self.stopped.is_set():
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            with connection:
+                connection.recv(65536)
+                self.requests += 1
+                if self.requests <= self.resets:
+                    continue
+                if self.stopped.wait(self.delay):
+                    return
+                body = b'{"ok": true}'
+                connection.sendall(
+                    b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s"
+                    % (len(body), body)
+                )
+
+    def close(self):
+        self.stopped.set()
+        self.socket.close()
+
+
+class TestPooledSession(unittest.TestCase):
+    """Test cases for the retry policy of PooledSession."""
+
+    def test_connection_reset_is_retried(self):
+        """Test that a request whose connection is closed without answer is sent again."""
+        server = FlakyServer(resets=2)
+        self.addCleanup(server.close)
+        session = PooledSession(server.url, backoff_factor=0.0)
+        self.addCleanup(session.close)
+
+        response = session.post("/v1/completions", {"prompt": "a"})
+
+        self.assertEqual(response.json(), {"ok": True})
+        self.assertEqual(server.requests, 3)
+
+    def test_read_timeout_is_not_retried(self):
+        """Test that a request timing out while waiting for the answer is not sent again."""
+        server = FlakyServer(resets=0, delay=1.0)
+        self.addCleanup(server.close)
+        session = PooledSession(server.url, backoff_factor=0.0, timeout=(1.0, 0.2))
+        self.addCleanup(session.close)
+
+        with self.assertRaises(LLMAPIError):
+            session.post("/v1/completions", {"prompt": "a"})
+        self.assertEqual(server.requests, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
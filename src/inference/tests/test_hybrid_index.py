@@ -0,0 +1,110 @@
+import os
+import hashlib
+import unittest
+import tempfile
+
+import torch
+
+from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.index.hybrid_index import HybridIndex, tokenize
+from src.embedding.models.base import BaseEmbedding
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Deterministic random embeddings, counting the encoded sentences."""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def generate(self, sentence, query=False):
+        sentences = [sentence] if isinstance(sentence, str) else sentence
+        self.encoded += len(sentences)
+        embeddings = [
+            torch.randn(16, generator=torch.Generator().manual_seed(int(hashlib.md5(s.encode()).hexdigest()[:8], 16)))
+            for s in sentences
+        ]
+        return torch.nn.functional.normalize(torch.stack(embeddings), dim=1)
+
+    def name(self):
+        return "fake"
+
+
+class TestHybridIndex(unittest.TestCase):
+    """Test cases for the hybrid BM25 + dense search."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.content = {
+            f"Lib.lemma{i}": {"fullname": f"Lib.lemma{i}", "docstring": f"Statement number {i}."}
+            for i in range(200)
+        }
+        self.content["GRing.modpZr"] = {"fullname": "GRing.modpZr", "docstring": "Remainder of a scaled polynomial."}
+        self.content["Nat.add_comm"] = {"fullname": "Nat.add_comm", "docstring": "Addition is commutative."}
+        self.model = FakeEmbedding()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def index(self, **kwargs):
+        dense = FaissIndex(self.model, self.content, cache_path=self.cache_dir.name, batch_size=64)
+        return HybridIndex(dense, **kwargs)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Nat.add_comm is the Lemma"), ["nat", "add_comm", "add", "comm", "lemma"])
+
+    def test_exact_match_skips_embedding(self):
+        """Test that an exact name is found without encoding the query."""
+        index = self.index()
+        self.model.encoded = 0
+        result = index.query(" modpZr ", top_k=1)
+        self.assertEqual(result[0][2], "GRing.modpZr")
+        self.assertEqual(result[0][1]["fullname"], "GRing.modpZr")
+        self.assertEqual(result[0][0], index.exact_score)
+        self.assertEqual(self.model.encoded, 0)
+
+        # Not enough BM25 results, the other ones come from the dense search
+        result = index.query("Nat.add_comm", top_k=10)
+        self.assertEqual(len(result), 10)
+        self.assertEqual(result[0][2], "Nat.add_comm")
+        self.assertTrue(all(score < index.exact_score for score, _, _ in result[1:]))
+        self.assertEqual(self.model.encoded, 1)
+        self.assertEqual(index.cache_stats()["exact_hits"], 2)
+
+        # Without the fast path, the dense search is run
+        index.exact_match = False
+        index.query("modpZr", top_k=1)
+        self.assertEqual(self.model.encoded, 2)
+
+    def test_fusion(self):
+        """Test that lexical matches are fused with the dense results."""
+        index = self.index(depth=10)
+        results = index.query_batch(["scaled polynomial remainder", "commutative addition"], top_k=10)
+        self.assertIn("GRing.modpZr", [fqn for _, _, fqn in results[0]])
+        self.assertIn("Nat.add_comm", [fqn for _, _, fqn in results[1]])
+        self.assertTrue(all(len(result) == 10 for result in results))
+        scores = [score for score, _, _ in results[0]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # Only the dense ranking
+        index = self.index(lexical_weight=0.0)
+        dense = index.dense.query("scaled polynomial remainder", top_k=10)
+        fused = index.query("scaled polynomial remainder", top_k=10)
+        self.assertEqual([fqn for _, _, fqn in fused], [fqn for _, _, fqn in dense])
+
+    def test_saved_index(self):
+        """Test that the BM25 index is saved once and rebuilt when the docstrings change."""
+        self.index()
+        cache_path = os.path.join(self.cache_dir.name, "fake")
+        (saved,) = [name for name in os.listdir(cache_path) if name.startswith("bm25-")]
+        self.index()
+        self.assertEqual([name for name in os.listdir(cache_path) if name.startswith("bm25-")], [saved])
+
+        self.content["eqpxx"] = {"fullname": "eqpxx", "docstring": "Equivalence is reflexive."}
+        index = self.index()
+        (updated,) = [name for name in os.listdir(cache_path) if name.startswith("bm25-")]
+        self.assertNotEqual(updated, saved)
+        self.assertEqual(index.query("eqpxx")[0][2], "eqpxx")
+
+
+if __name__ == "__main__":
+    unittest.main()
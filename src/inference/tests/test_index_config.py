@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+import faiss
+
+from src.embedding.index.index_config import IndexConfig, INDEX_TYPES
+
+
+class TestIndexConfig(unittest.TestCase):
+    """Test cases for the index types of the search tool."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.standard_normal((2000, 32)).astype(np.float32)
+        faiss.normalize_L2(self.embeddings)
+
+    def test_spec(self):
+        self.assertEqual(IndexConfig().spec, "flat")
+        self.assertEqual(IndexConfig("ivf_flat", nlist=8, nprobe=2).spec, "ivf_flat:nlist=8")
+        # Search parameters do not change the saved index
+        self.assertEqual(IndexConfig("hnsw", ef_search=10).spec, IndexConfig("hnsw").spec)
+        with self.assertRaises(ValueError):
+            IndexConfig("ivf")
+
+    def test_build(self):
+        """Test that every index type finds the vectors themselves."""
+        ids = np.arange(100, 100 + len(self.embeddings), dtype=np.int64)
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type):
+                config = IndexConfig(index_type, nlist=16, pq_m=8, pq_bits=6, nprobe=16)
+                index = config.build(32, self.embeddings)
+                index.add_with_ids(self.embeddings, ids)
+                config.configure(index)
+                _, found = index.search(self.embeddings[:50], 1)
+                recall = np.mean(found[:, 0] == ids[:50])
+                self.assertGreater(recall, 0.5 if index_type == "ivf_pq" else 0.95)
+
+    def test_pq_dimension(self):
+        with self.assertRaises(ValueError):
+            IndexConfig("ivf_pq", pq_m=7).build(32, self.embeddings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,375 @@
+import unittest
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from unittest import mock
+
+from ..agent import Parser
+from ..llm import VLLM, find_stop
+from ..http_client import LLMAPIError
+
+
+class FakeStreamResponse:
+    """A fake streamed HTTP response replaying SSE chunks."""
+
+    def __init__(self, chunks: List[dict]):
+        self.status_code = 200
+        self.text = ""
+        self.lines = [f"data: {json.dumps(chunk)}".encode() for chunk in chunks] + [
+            b"data: [DONE]"
+        ]
+        self.closed = False
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self.lines:
+            yield line
+            yield b""
+
+    def close(self):
+        self.closed = True
+
+
+class BlockingStreamResponse(FakeStreamResponse):
+    """A fake streamed HTTP response waiting for more chunks until it is closed."""
+
+    def __init__(self, chunks: List[dict]):
+        super().__init__(chunks)
+        self.lines = self.lines[:-1]
+        self.closed_event = threading.Event()
+
+    def iter_lines(self, decode_unicode=False):
+        yield from super().iter_lines(decode_unicode)
+        self.closed_event.wait()
+
+    def close(self):
+        super().close()
+        self.closed_event.set()
+
+
+def chunk(index: int, text: str, finish_reason=None) -> dict:
+    """Build one SSE completion chunk."""
+    return {"choices": [{"index": index, "text": text, "finish_reason": finish_reason}]}
+
+
+class StubCompletionServer:
+    """
+    Local stub of the OpenAI-compatible `/v1/completions` endpoint.
+
+    The completion of sample j of a prompt p is `<p#j>`. Request payloads and
+    body sizes are recorded.
+    """
+
+    def __init__(self):
+        self.payloads = []
+        self.bytes_received = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.bytes_received += len(body)
+                payload = json.loads(body)
+                stub.payloads.append(payload)
+                n = payload.get("n", 1)
+                choices = [
+                    {"index": u * n + j, "text": f"<{prompt}#{j}>", "finish_reason": "stop"}
+                    for u, prompt in enumerate(payload["prompt"])
+                    for j in range(n)
+                ]
+                if payload.get("stream"):
+                    data = b"".join(
+                        f"data: {json.dumps({'choices': [choice]})}\n\n".encode()
+                        for choice in reversed(choices)
+                    ) + b"data: [DONE]\n\n"
+                else:
+                    data = json.dumps({"choices": choices}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestVLLMStreaming(unittest.TestCase):
+    """Test cases for the streaming mode of VLLM."""
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.llm = VLLM(
+            api_url="http://localhost:8000",
+            model="test-model",
+            log_dir=self.log_dir.name,
+            stream=True,
+        )
+
+    def tearDown(self):
+        self.llm.close()
+        self.log_dir.cleanup()
+
+    def test_find_stop(self):
+        """Test finding the earliest stop sequence."""
+        text = "a <search>x</search> <script>y</script>"
+        self.assertEqual(
+            find_stop(text, ["</script>", "</search>"]), text.index("</search>") + 9
+        )
+        self.assertIsNone(find_stop("no stop here", ["</script>"]))
+
+    def test_yields_in_order_of_completion(self):
+        """Test that each beam is returned as soon as its stop tag arrives."""
+        response = FakeStreamResponse(
+            [
+                chunk(0, "thinking "),
+                chunk(1, "<script>lia."),
+                chunk(1, "</scr"),
+                chunk(1, "ipt>"),
+                chunk(0, "more thinking <search>q</search>"),
+            ]
+        )
+        with mock.patch.object(self.llm.client.session, "post", return_value=response):
+            results = list(
+                self.llm.generate_batch_stream(
+                    ["p0", "p1"], ["</script>", "</search>"]
+                )
+            )
+
+        self.assertEqual(
+            results,
+            [
+                (1, "<script>lia.</script>"),
+                (0, "thinking more thinking <search>q</search>"),
+            ],
+        )
+        self.assertTrue(response.closed)
+
+    def test_text_after_stop_is_dropped(self):
+        """Test that text received after the stop tag is not returned."""
+        response = FakeStreamResponse(
+            [chunk(0, "<script>lia.</script> trailing"), chunk(0, " text", "length")]
+        )
+        with mock.patch.object(self.llm.client.session, "post", return_value=response):
+            responses = self.llm.generate_batch(["p0"], ["</script>"])
+
+        self.assertEqual(responses, ["<script>lia.</script>"])
+
+    def test_stream_parsers(self):
+        """Test that the tool calls are parsed as the chunks arrive."""
+        parser = Parser()
+        parser.register_tool("search", "search")
+        parser.register_tool("coq-prover", "script")
+        parsers = [parser.stream(), parser.stream()]
+        response = FakeStreamResponse(
+            [
+                chunk(0, "<script>intros. "),
+                chunk(1, "no tool call", "length"),
+                chunk(0, "lia.</scr"),
+                chunk(0, "ipt> trailing"),
+                chunk(0, " text"),
+            ]
+        )
+        with mock.patch.object(self.llm.client.session, "post", return_value=response):
+            results = list(
+                self.llm.generate_batch_stream(["p0", "p1"], ["</script>", "</search>"], parsers)
+            )
+
+        self.assertEqual(results, [(1, "no tool call"), (0, "<script>intros. lia.</script>")])
+        self.assertEqual(parsers[0].finish(), ("coq-prover", "intros. lia.", 0, 29))
+        self.assertIsNone(parsers[1].finish())
+
+    def test_early_stop_closes_merged_streams(self):
+        """Test that the responses of all the requests are closed when the caller stops."""
+        self.llm.n_sampling = True
+        # One request for the prompt sampled twice, one for the other prompt
+        fast = BlockingStreamResponse([chunk(0, "<script>lia.</script>")])
+        slow = BlockingStreamResponse([chunk(0, "thinking")])
+
+        def post(url, data, **kwargs):
+            return fast if json.loads(data).get("n", 1) == 2 else slow
+
+        with mock.patch.object(self.llm.client.session, "post", side_effect=post):
+            stream = self.llm.generate_batch_stream(["a", "b", "a"], ["</script>"])
+            self.assertEqual(next(stream), (0, "<script>lia.</script>"))
+            stream.close()
+
+        self.assertTrue(fast.closed_event.wait(1))
+        self.assertTrue(slow.closed_event.wait(1))
+
+    def test_finish_without_stop(self):
+        """Test that a sequence ending without a stop tag is returned as is."""
+        response = FakeStreamResponse([chunk(0, "no tool call", "length")])
+        with mock.patch.object(self.llm.client.session, "post", return_value=response):
+            responses = self.llm.generate_batch(["p0"], ["</script>"])
+
+        self.assertEqual(responses, ["no tool call"])
+
+
+class TestVLLMClient(unittest.TestCase):
+    """Test cases for the pooled HTTP client of VLLM."""
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.llm = VLLM(
+            api_url="http://localhost:8000",
+            model="test-model",
+            log_dir=self.log_dir.name,
+            max_retries=2,
+        )
+
+    def tearDown(self):
+        self.llm.close()
+        self.log_dir.cleanup()
+
+    def test_session_is_reused(self):
+        """Test that all requests go through the same pooled session."""
+        response = mock.Mock(status_code=200, content=b'{"choices": [{"text": "a"}]}')
+        with mock.patch.object(
+            self.llm.client.session, "post", return_value=response
+        ) as post:
+            self.assertEqual(self.llm.generate_batch(["p0"]), ["a"])
+            self.assertEqual(self.llm.generate("p1"), "a")
+
+        self.assertEqual(post.call_count, 2)
+        self.assertIsNotNone(post.call_args.kwargs["timeout"])
+
+    def test_retries_are_configured(self):
+        """Test that transient errors are retried on POST requests."""
+        adapter = self.llm.client.session.get_adapter("http://localhost:8000")
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertIn("POST", adapter.max_retries.allowed_methods)
+
+    def test_scored_completions(self):
+        """Test that the log-probabilities of the sampled tokens are summed."""
+        body = {
+            "choices": [
+                {"index": 1, "text": "b", "logprobs": {"token_logprobs": [-1.0]}},
+                {"index": 0, "text": "a", "logprobs": {"token_logprobs": [-0.5, -1.5]}},
+            ]
+        }
+        response = mock.Mock(status_code=200, content=json.dumps(body).encode())
+        with mock.patch.object(
+            self.llm.client.session, "post", return_value=response
+        ) as post:
+            completions = self.llm.generate_batch_scored(["p0", "p1"])
+
+        self.assertEqual(json.loads(post.call_args.kwargs["data"])["logprobs"], 0)
+        self.assertEqual([c.text for c in completions], ["a", "b"])
+        self.assertEqual(completions[0].logprob, -2.0)
+        self.assertEqual(completions[0].num_tokens, 2)
+        self.assertEqual(completions[0].mean_logprob, -1.0)
+
+    def test_count_tokens(self):
+        """Test that tokens are counted by the server, or estimated if it cannot."""
+        response = mock.Mock(status_code=200, content=b'{"count": 7, "tokens": []}')
+        with mock.patch.object(
+            self.llm.client.session, "post", return_value=response
+        ) as post:
+            self.assertEqual(self.llm.count_tokens(["a b c", "d", "d"]), [7, 7, 7])
+            # Counted texts are not sent again
+            self.assertEqual(self.llm.count_tokens(["d", "a b c"]), [7, 7])
+        self.assertTrue(post.call_args.args[0].endswith("/tokenize"))
+        self.assertEqual(post.call_count, 2)
+
+        # A transient error only affects this call
+        response = mock.Mock(status_code=500, text="boom")
+        with mock.patch.object(self.llm.client.session, "post", return_value=response):
+            self.assertEqual(self.llm.count_tokens(["y" * 40]), [10])
+        self.assertTrue(self.llm.tokenize_endpoint)
+
+        response = mock.Mock(status_code=404, text="Not Found")
+        with mock.patch.object(self.llm.client.session, "post", return_value=response) as post:
+            self.assertEqual(self.llm.count_tokens(["x" * 40]), [10])
+            # The endpoint is not tried again
+            self.assertEqual(self.llm.count_tokens(["x" * 8]), [2])
+        self.assertEqual(post.call_count, 1)
+
+    def test_error_reaches_caller(self):
+        """Test that API errors are raised instead of returning empty strings."""
+        response = mock.Mock(status_code=500, text="boom")
+        with mock.patch.object(self.llm.client.session, "post", return_value=response):
+            with self.assertRaises(LLMAPIError):
+                self.llm.generate_batch(["p0", "p1"])
+
+
+class TestVLLMNSampling(unittest.TestCase):
+    """Test cases for grouping identical prompts with `n` sampling."""
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.server = StubCompletionServer()
+        self.llms = []
+
+    def tearDown(self):
+        for llm in self.llms:
+            llm.close()
+        self.server.close()
+        self.log_dir.cleanup()
+
+    def make_llm(self, n_sampling: bool, stream: bool = False) -> VLLM:
+        llm = VLLM(
+            api_url=self.server.url,
+            model="test-model",
+            log_dir=self.log_dir.name,
+            stream=stream,
+            n_sampling=n_sampling,
+        )
+        self.llms.append(llm)
+        return llm
+
+    def test_identical_prompts_use_one_prompt(self):
+        """Test that k identical prompts are sent once with n=k."""
+        llm = self.make_llm(n_sampling=True)
+        responses = llm.generate_batch(["p"] * 4)
+
+        self.assertEqual(responses, [f"<p#{j}>" for j in range(4)])
+        self.assertEqual(len(self.server.payloads), 1)
+        self.assertEqual(self.server.payloads[0]["prompt"], ["p"])
+        self.assertEqual(self.server.payloads[0]["n"], 4)
+
+    def test_mixed_prompts_are_spread_back(self):
+        """Test that choices go back to the right beams when prompts diverged."""
+        llm = self.make_llm(n_sampling=True)
+        responses = llm.generate_batch(["a", "b", "a", "c", "a", "b"])
+
+        self.assertEqual(
+            responses, ["<a#0>", "<b#0>", "<a#1>", "<c#0>", "<a#2>", "<b#1>"]
+        )
+        requests_by_n = {p.get("n", 1): p["prompt"] for p in self.server.payloads}
+        self.assertEqual(requests_by_n, {3: ["a"], 2: ["b"], 1: ["c"]})
+
+    def test_mixed_prompts_streaming(self):
+        """Test grouping in streaming mode."""
+        llm = self.make_llm(n_sampling=True, stream=True)
+        results = dict(llm.generate_batch_stream(["a", "b", "a"]))
+
+        self.assertEqual(results, {0: "<a#0>", 1: "<b#0>", 2: "<a#1>"})
+        self.assertEqual(len(self.server.payloads), 2)
+
+    def test_request_size_is_reduced(self):
+        """Test that grouping divides the size of the request by the number of beams."""
+        prompt = "x" * 10000
+        self.make_llm(n_sampling=False).generate_batch([prompt] * 8)
+        duplicated = self.server.bytes_received
+
+        self.server.bytes_received = 0
+        self.make_llm(n_sampling=True).generate_batch([prompt] * 8)
+        grouped = self.server.bytes_received
+
+        self.assertLess(grouped * 6, duplicated)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import glob
+import json
+import unittest
+import tempfile
+
+from ..llm_logger import LLMLogger, common_prefix_length, log_context, read_logs
+from ..view_llm_logs import load_log_files
+
+
+class TestLLMLogger(unittest.TestCase):
+    """Test cases for the LLMLogger class."""
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.log_dir.cleanup()
+
+    def log_iterations(self, logger, num_iterations=5, k=3):
+        """Log the growing prompts of a pass@k search, returning them."""
+        prompts = [f"Prove theorem {i}.\n" + "x" * 1000 for i in range(k)]
+        batches = []
+        for iteration in range(num_iterations):
+            responses = [f"response {iteration} {i}" for i in range(k)]
+            logger.log_batch_interaction(prompts, responses, {"model": "m"}, prefix="m")
+            batches.append((list(prompts), responses))
+            prompts = [p + r + "\nGoals: ..." for p, r in zip(prompts, responses)]
+        return batches
+
+    def test_common_prefix_length(self):
+        """Test the length of the common prefix of two strings."""
+        self.assertEqual(common_prefix_length("abcdef", "abc"), 3)
+        self.assertEqual(common_prefix_length("abc", "abcdef"), 3)
+        self.assertEqual(common_prefix_length("abcxef", "abcyef"), 3)
+        self.assertEqual(common_prefix_length("abc", ""), 0)
+        self.assertEqual(common_prefix_length("xbc", "abc"), 0)
+
+    def test_roundtrip(self):
+        """Test that the prompts stored as deltas are read back in full."""
+        logger = LLMLogger(log_dir=self.log_dir.name)
+        batches = self.log_iterations(logger)
+        logger.log_interaction("single prompt", "single response")
+        logger.close()
+
+        records = list(read_logs(self.log_dir.name))
+        self.assertEqual(len(records), len(batches) + 1)
+        for record, (prompts, responses) in zip(records, batches):
+            self.assertEqual([i["prompt"] for i in record["interactions"]], prompts)
+            self.assertEqual([i["response"] for i in record["interactions"]], responses)
+            self.assertEqual(record["metadata"], {"model": "m"})
+        self.assertEqual(records[-1]["interactions"][0]["prompt"], "single prompt")
+
+    def test_deltas(self):
+        """Test that the prompts are not written again at each iteration."""
+        logger = LLMLogger(log_dir=self.log_dir.name, compress=False)
+        batches = self.log_iterations(logger, num_iterations=10)
+        logger.close()
+
+        full_size = sum(len(p) for prompts, _ in batches for p in prompts)
+        (segment,) = glob.glob(os.path.join(self.log_dir.name, "*.jsonl"))
+        self.assertLess(os.path.getsize(segment), full_size / 5)
+
+    def test_deltas_follow_beams(self):
+        """Test that the deltas are taken against the previous prompt of the same beam id."""
+        logger = LLMLogger(log_dir=self.log_dir.name, compress=False)
+        prompts = {beam: f"Prove theorem {beam}.\n" + "x" * 1000 for beam in range(3)}
+        logged = []
+        for beams in ([0, 1, 2], [0, 2], [2]):
+            # Beams finish, and the others move to lower positions in the batch
+            with log_context(beams=beams):
+                logger.log_batch_interaction([prompts[b] for b in beams], ["r"] * len(beams))
+            logged.append([prompts[b] for b in beams])
+            prompts = {b: p + "r\nGoals: ..." for b, p in prompts.items()}
+        for beam in (1, 0):
+            # Concurrent beams log one prompt at a time
+            with log_context(beam=beam):
+                logger.log_interaction(prompts[beam], "r")
+            logged.append([prompts[beam]])
+        logger.close()
+
+        records = list(read_logs(self.log_dir.name))
+        self.assertEqual([[i["prompt"] for i in r["interactions"]] for r in records], logged)
+        (segment,) = glob.glob(os.path.join(self.log_dir.name, "*.jsonl"))
+        with open(segment) as f:
+            written = [json.loads(line)["interactions"] for line in f]
+        # Only the first prompt of each beam is written in full
+        self.assertEqual(sum(len(i["prompt"]) > 100 for r in written for i in r), 3)
+
+    def test_rotation(self):
+        """Test that segments are rotated, compressed and decoded independently."""
+        logger = LLMLogger(log_dir=self.log_dir.name, max_segment_bytes=2000)
+        batches = self.log_iterations(logger, num_iterations=6)
+        logger.close()
+
+        segments = sorted(os.listdir(self.log_dir.name))
+        self.assertGreater(len(segments), 1)
+        self.assertTrue(all(s.endswith(".jsonl.gz") for s in segments))
+
+        records = list(read_logs(self.log_dir.name))
+        self.assertEqual(
+            [[i["prompt"] for i in r["interactions"]] for r in records],
+            [prompts for prompts, _ in batches],
+        )
+
+    def test_flush(self):
+        """Test that flushed interactions can be read before the logger is closed."""
+        logger = LLMLogger(log_dir=self.log_dir.name)
+        logger.log_batch_interaction(["p0", "p1"], ["r0", "r1"])
+        logger.flush()
+        (record,) = read_logs(self.log_dir.name)
+        self.assertEqual(len(record["interactions"]), 2)
+        logger.close()
+        # Logging after close is ignored
+        logger.log_interaction("p", "r")
+
+    def test_disabled(self):
+        """Test that a disabled logger writes nothing."""
+        logger = LLMLogger(log_dir=os.path.join(self.log_dir.name, "off"), enabled=False)
+        logger.log_interaction("p", "r")
+        logger.close()
+        self.assertFalse(os.path.exists(os.path.join(self.log_dir.name, "off")))
+
+    def test_viewer(self):
+        """Test that the viewer loads the interactions of the segments."""
+        logger = LLMLogger(log_dir=self.log_dir.name)
+        batches = self.log_iterations(logger, num_iterations=2, k=2)
+        logger.close()
+
+        logs = load_log_files(self.log_dir.name)
+        self.assertEqual(len(logs), 4)
+        self.assertEqual(logs[-1]["prompt"], batches[-1][0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import glob
+import gzip
+import json
+import shutil
+import unittest
+import tempfile
+
+from ..llm_logger import LLMLogger, log_context
+from ..log_index import LogIndex
+
+
+class TestLogIndex(unittest.TestCase):
+    """Test cases for the LogIndex class."""
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+        self.index = LogIndex(self.log_dir.name)
+
+    def tearDown(self):
+        self.index.close()
+        self.log_dir.cleanup()
+
+    def write_logs(self, theorems=("add_comm", "mul_comm"), model="m1", **kwargs):
+        logger = LLMLogger(log_dir=self.log_dir.name, **kwargs)
+        for theorem in theorems:
+            with log_context(theorem=theorem):
+                prompt = f"Prove {theorem}."
+                for iteration in range(3):
+                    logger.log_batch_interaction(
+                        [prompt, prompt],
+                        [f"intros. (* {theorem} {iteration} *)", "lia."],
+                        {"model": model},
+                    )
+                    prompt += f"\nGoals {iteration}"
+        logger.close()
+
+    def test_filters(self):
+        """Test filtering by model, theorem and substring."""
+        self.write_logs()
+        self.write_logs(theorems=("add_assoc",), model="m2")
+        self.assertEqual(self.index.update(), 18)
+
+        self.assertEqual(len(list(self.index.query())), 18)
+        self.assertEqual(len(list(self.index.query(model="m2"))), 6)
+
+        logs = list(self.index.query(theorem="mul_comm"))
+        self.assertEqual(len(logs), 6)
+        self.assertTrue(all(log["metadata"]["theorem"] == "mul_comm" for log in logs))
+        # Prompts are decoded in full
+        self.assertEqual(logs[-1]["prompt"], "Prove mul_comm.\nGoals 0\nGoals 1")
+
+        logs = list(self.index.query(contains="MUL_COMM 2"))
+        self.assertEqual([log["response"] for log in logs], ["intros. (* mul_comm 2 *)"])
+        # Substrings too short for the full-text index
+        self.assertEqual(len(list(self.index.query(contains="2 "))), 3)
+        self.assertEqual(len(list(self.index.query(contains="Goals 1", theorem="add_comm"))), 2)
+
+    def test_order_and_limit(self):
+        """Test the latest interactions and limits."""
+        self.write_logs()
+        self.index.update()
+        (latest,) = self.index.query(latest=True, limit=1)
+        self.assertEqual(latest["metadata"]["theorem"], "mul_comm")
+        self.assertEqual(latest["response"], "lia.")
+        self.assertEqual(len(list(self.index.query(limit=4))), 4)
+        self.assertEqual(len(list(self.index.query(contains="lia", limit=2))), 2)
+
+    def test_time_range(self):
+        """Test filtering by time, with the timestamps of older logs."""
+        with open(os.path.join(self.log_dir.name, "llm_interaction_old.json"), "w") as f:
+            json.dump(
+                {"timestamp": "20240501_120000_000000", "prompt": "p", "response": "r"}, f
+            )
+        self.write_logs(theorems=("add_comm",))
+        self.index.update()
+
+        (old,) = self.index.query(until="2024-05-01")
+        self.assertEqual(old["timestamp"], "2024-05-01T12:00:00")
+        self.assertEqual(len(list(self.index.query(since="2024-05-02"))), 6)
+
+    def test_incremental_update(self):
+        """Test that only new and changed files are indexed again."""
+        self.write_logs(compress=False)
+        self.assertEqual(self.index.update(), 12)
+        self.assertEqual(self.index.update(), 0)
+
+        # A segment compressed after rotation replaces its uncompressed version
+        (segment,) = glob.glob(os.path.join(self.log_dir.name, "*.jsonl"))
+        with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+
+        self.assertEqual(self.index.update(), 12)
+        self.assertEqual(len(list(self.index.query())), 12)
+        self.assertEqual(len(list(self.index.query(contains="add_comm 1"))), 1)
+
+        # Reopened index
+        self.index.close()
+        self.index = LogIndex(self.log_dir.name)
+        self.assertEqual(self.index.update(), 0)
+        self.assertEqual(len(list(self.index.query(theorem="add_comm"))), 6)
+
+    def test_unreadable_files_are_skipped(self):
+        """Test that corrupt or truncated files do not stop the update."""
+        self.write_logs(compress=False)
+        (segment,) = glob.glob(os.path.join(self.log_dir.name, "*.jsonl"))
+        with open(segment, "rb") as src:
+            data = gzip.compress(src.read())
+        # Compressed segment cut off mid-write
+        with open(segment[: -len(".jsonl")] + "-cut.jsonl.gz", "wb") as f:
+            f.write(data[: len(data) // 2])
+        with open(os.path.join(self.log_dir.name, "corrupt.json"), "w") as f:
+            f.write("{")
+
+        self.assertEqual(self.index.update(), 12)
+        self.assertEqual(len(list(self.index.query())), 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
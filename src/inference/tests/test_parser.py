@@ -54,6 +54,68 @@ class TestParser(unittest.TestCase):
         self.assertEqual(result[0], "search")
         self.assertEqual(result[1], "Use angle brackets like < and > in math")
 
+    def test_first_tool_call(self):
+        text = "<script>intros.</script> then <search>lemma</search>"
+        result = self.parser.extract_next_tool_call(text)
+
+        self.assertEqual(result, ("coq-prover", "intros.", 0, 24))
+        self.assertEqual(text[result[2] : result[3]], "<script>intros.</script>")
+
+    def test_unclosed_tag_before_tool_call(self):
+        text = "<script>unfinished <search>lemma</search>"
+        result = self.parser.extract_next_tool_call(text)
+
+        self.assertEqual(result[:2], ("search", "lemma"))
+
+    def test_start_position(self):
+        text = "<search>a</search><search>b</search>"
+        result = self.parser.extract_next_tool_call(text, start=1)
+
+        self.assertEqual(result[:3], ("search", "b", 18))
+
+
+class TestToolCallStream(unittest.TestCase):
+    def setUp(self):
+        self.parser = Parser()
+        self.parser.register_tool("search", "search")
+        self.parser.register_tool("coq-prover", "script")
+
+    def feed(self, text, size):
+        stream = self.parser.stream()
+        for i in range(0, len(text), size):
+            result = stream.feed(text[i : i + size])
+            if result is not None:
+                # Known as soon as the closing tag is received
+                self.assertGreaterEqual(i + size, result[3])
+                self.assertLess(i, result[3])
+                return result
+        return stream.finish()
+
+    def test_same_result_as_whole_text(self):
+        texts = [
+            "Let's think. <script>intros n. induction n; auto.</script>",
+            "<search>a < b and b > c</search> <script>lia.</script>",
+            "no tool call <scr ipt> </search>",
+            "<script>unfinished <search>lemma</search>",
+            "<script></script>",
+            "text < <script <script>x</script>",
+        ]
+        for text in texts:
+            for size in range(1, len(text) + 1):
+                with self.subTest(text=text, size=size):
+                    self.assertEqual(
+                        self.feed(text, size), self.parser.extract_next_tool_call(text)
+                    )
+
+    def test_stops_at_first_tool_call(self):
+        stream = self.parser.stream()
+        self.assertIsNone(stream.feed("thinking... <scr"))
+        self.assertIsNone(stream.feed("ipt>intros.</scr"))
+        result = stream.feed("ipt> more text")
+        self.assertEqual(result, ("coq-prover", "intros.", 12, 36))
+        # Later chunks are ignored
+        self.assertEqual(stream.feed("<search>x</search>"), result)
+
 
 if __name__ == "__main__":
     unittest.main()
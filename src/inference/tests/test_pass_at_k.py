@@ -28,6 +28,7 @@ class MockVLLM(VLLM):
         self.calls = []
         self.prompts = []
         self.verbose = False
+        self.stream = False
 
     def build_prompt(
         self, goals: str, coq_tag: str, context: str = "", goals_tag: str = "GOALS"
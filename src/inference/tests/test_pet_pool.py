@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from ..benchmark_runner import BenchmarkRunner
+from ..pet_pool import PetServerPool
+
+
+class FakePytanque:
+    """A Pytanque connection recording whether it is open."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connected = False
+
+    def connect(self):
+        self.connected = True
+
+    def set_workspace(self, debug, workspace):
+        self.workspace = workspace
+
+    def close(self):
+        self.connected = False
+
+
+class TestPetServerPool(unittest.TestCase):
+    """Test cases for the pool of pet-server connections (no server needed)."""
+
+    def setUp(self):
+        patcher = mock.patch("src.inference.pet_pool.Pytanque", FakePytanque)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_acquire_and_release(self):
+        """Test that each server has one connection, borrowed by one worker at a time."""
+        pool = PetServerPool("workspace", port=9000, num_servers=2)
+        self.assertEqual(len(pool), 2)
+        first, second = pool.acquire(), pool.acquire()
+        self.assertEqual({first.port, second.port}, {9000, 9001})
+        self.assertTrue(pool.connections.empty())
+
+        # A worker waits for a connection to be released
+        borrowed = []
+        waiting = threading.Thread(target=lambda: borrowed.append(pool.acquire()))
+        waiting.start()
+        waiting.join(0.05)
+        self.assertEqual(borrowed, [])
+        pool.release(first)
+        waiting.join(1)
+        self.assertEqual(borrowed, [first])
+
+        pool.release(second)
+        pool.release(first)
+        pool.close()
+        self.assertFalse(first.connected or second.connected)
+
+    def test_reconnect(self):
+        """Test that a connection is replaced by a new one to the same server."""
+        pool = PetServerPool("workspace", port=9000, num_servers=1)
+        pet = pool.acquire()
+        new = pool.reconnect(pet)
+        self.assertIsNot(new, pet)
+        self.assertFalse(pet.connected)
+        self.assertTrue(new.connected)
+        self.assertEqual((new.port, new.workspace), (9000, "workspace"))
+        pool.release(new)
+        pool.close()
+
+
+class TestParallelRunner(unittest.TestCase):
+    """Test cases for the parallel benchmark runner, with stubbed connections and proofs."""
+
+    def setUp(self):
+        patcher = mock.patch("src.inference.pet_pool.Pytanque", FakePytanque)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.benchmark_dir = os.path.join(self.tmp.name, "benchmark")
+        os.makedirs(self.benchmark_dir)
+        for theorem in ("t1", "t2", "t3", "t4"):
+            open(os.path.join(self.benchmark_dir, f"{theorem}.v"), "w").close()
+
+    def make_runner(self):
+        runner = BenchmarkRunner(
+            self.benchmark_dir,
+            parallel=True,
+            num_servers=2,
+            llm_log_dir=os.path.join(self.tmp.name, "llm_logs"),
+        )
+        self.addCleanup(runner.llm.close)
+        self.addCleanup(runner.pool.close)
+        return runner
+
+    def test_failed_proof_reconnects(self):
+        """Test that theorems share the pool, and that an error or a timeout reconnects the connection."""
+        runner = self.make_runner()
+        initial = list(runner.pool.connections.queue)
+        errors = {"t2": "connection lost", "t4": "timeout"}
+
+        def prove_theorem(filename, theorem_name, pet=None):
+            result = {"theorem": theorem_name, "file": filename, "success": theorem_name not in errors,
+                      "duration": 0.0, "proof": [], "proof_length": 0}
+            if theorem_name in errors:
+                result["error"] = errors[theorem_name]
+            return result
+
+        runner.prove_theorem = prove_theorem
+        with mock.patch.object(runner.pool, "reconnect", wraps=runner.pool.reconnect) as reconnect:
+            summary = runner.run_benchmark()
+
+        self.assertEqual(len(summary["results"]), 4)
+        connections = list(runner.pool.connections.queue)
+        self.assertEqual(len(connections), 2)
+        self.assertTrue(all(pet.connected for pet in connections))
+        # The connections used by the failed proofs were replaced
+        self.assertEqual(reconnect.call_count, 2)
+        self.assertLess(sum(pet in initial for pet in connections), 2)
+
+    def test_start_failure_is_a_result(self):
+        """Test that a proof failing to start is reported without aborting the other theorems."""
+        runner = self.make_runner()
+
+        def script_tool(pet, workspace, file, theorem, context):
+            if theorem == "t3":
+                raise RuntimeError("theorem not found")
+            raise TimeoutError("Deadline reached")
+
+        with mock.patch("src.inference.benchmark_runner.ScriptTool", side_effect=script_tool):
+            summary = runner.run_benchmark()
+
+        errors = {result["theorem"]: result["error"] for result in summary["results"].values()}
+        self.assertEqual(errors, {"t1": "timeout", "t2": "timeout", "t3": "theorem not found", "t4": "timeout"})
+
+
+if __name__ == "__main__":
+    unittest.main()
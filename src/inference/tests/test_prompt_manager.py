@@ -0,0 +1,99 @@
+import unittest
+from typing import List, Optional
+
+from ..llm import LLM
+from ..prompt_manager import PromptManager
+
+
+class WordCountLLM(LLM):
+    """An LLM stub whose tokens are the words of the text."""
+
+    def __init__(self):
+        self.counted = []
+
+    def generate(self, prompt: str, stop_sequences: Optional[List[str]] = None) -> str:
+        return ""
+
+    def generate_batch(self, prompts: List[str], stop_sequences: Optional[List[str]] = None) -> List[str]:
+        return [""] * len(prompts)
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        self.counted.extend(texts)
+        return [len(text.split()) for text in texts]
+
+
+def feedback(step: int) -> str:
+    """A long turn whose script is `step_<step>.`"""
+    reasoning = " ".join(["reasoning"] * 50)
+    return f"\n{reasoning}\n<script>\nstep_{step}.\n</script>\nGoals {step}\n"
+
+
+class TestPromptManager(unittest.TestCase):
+    """Test cases for the PromptManager class."""
+
+    def setUp(self):
+        self.llm = WordCountLLM()
+
+    def add_turns(self, manager, num_turns, success=True):
+        prompts = []
+        for step in range(num_turns):
+            text = feedback(step)
+            response = text.split("</script>")[0]
+            manager.add_turn(0, text, response, success, f"goal_{step}")
+            prompts.append(manager.prompt(0))
+        return prompts
+
+    def test_no_budget(self):
+        """Test that without budget the turns are appended as they are."""
+        manager = PromptManager(self.llm)
+        manager.start(0, "head")
+        prompts = self.add_turns(manager, 3)
+        self.assertEqual(prompts[-1], "head" + "".join(feedback(i) for i in range(3)))
+        # Tokens are only counted when needed
+        self.assertEqual(self.llm.counted, [])
+
+    def test_budget(self):
+        """Test that older turns are compacted to stay within the budget."""
+        manager = PromptManager(self.llm, budget=200, keep_recent=1)
+        manager.start(0, "head")
+        prompts = self.add_turns(manager, 10)
+
+        for step in range(10):
+            self.assertLessEqual(len(prompts[step].split()), 200)
+        last = prompts[-1]
+        # The last turn is kept in full, the others keep their script and goals
+        self.assertTrue(last.endswith(feedback(9)))
+        self.assertIn("step_0.", last)
+        self.assertIn("goal_0", last)
+        self.assertEqual(last.count("reasoning"), 50)
+        self.assertGreater(manager.stats()["compactions"], 0)
+
+        self.assertEqual(manager.stats()["dropped_turns"], 0)
+        # Each part is counted once
+        self.assertEqual(len(self.llm.counted), len(set(self.llm.counted)))
+
+    def test_stable_prefix(self):
+        """Test that a compacted prompt stays the prefix of the next ones."""
+        manager = PromptManager(self.llm, budget=200, keep_recent=2)
+        manager.start(0, "head")
+        prompts = self.add_turns(manager, 6)
+        self.assertEqual(manager.stats()["dropped_turns"], 0)
+        for previous, current in zip(prompts, prompts[1:]):
+            # The initial prompt and the compacted turns, before the first full turn
+            compacted = previous[: previous.index("\nreasoning")]
+            self.assertTrue(current.startswith(compacted))
+        self.assertIn("step_3.", prompts[-1][: prompts[-1].index("\nreasoning")])
+
+    def test_drop(self):
+        """Test that compacted turns are dropped when compacting is not enough."""
+        manager = PromptManager(self.llm, budget=80, keep_recent=1)
+        manager.start(0, "head")
+        prompts = self.add_turns(manager, 20, success=False)
+        self.assertLessEqual(len(prompts[-1].split()), 80)
+        self.assertIn("earlier steps omitted", prompts[-1])
+        self.assertTrue(prompts[-1].endswith(feedback(19)))
+        self.assertGreater(manager.stats()["dropped_turns"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import unittest
+import tempfile
+
+import numpy as np
+
+from src.embedding.index.query_cache import QueryCache, QueryEmbeddingStore, normalize_query
+
+
+class TestQueryCache(unittest.TestCase):
+    """Test cases for the query cache of the search tool."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.cache_dir.name, "model", "queries.sqlite")
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  lemma  about\n lists "), "lemma about lists")
+        self.assertNotEqual(normalize_query("Nat.add"), normalize_query("nat.add"))
+
+    def test_lru(self):
+        """Test hits, misses, evictions, and that cached results are copies."""
+        cache = QueryCache(maxsize=2)
+        results = [(0.9, {"fullname": "Nat.add_comm", "docstring": "..."}, "Nat.add_comm")]
+        self.assertIsNone(cache.get("add comm", 10))
+        cache.put("add comm", 10, results)
+        results[0][1]["fullname"] = "changed"
+
+        cached = cache.get("add comm", 10)
+        self.assertEqual(cached[0][1]["fullname"], "Nat.add_comm")
+        cached[0][1]["fullname"] = "changed"
+        self.assertEqual(cache.get("add comm", 10)[0][1]["fullname"], "Nat.add_comm")
+        # Results depend on top_k
+        self.assertIsNone(cache.get("add comm", 5))
+
+        cache.put("b", 10, [])
+        cache.get("add comm", 10)
+        cache.put("c", 10, [])
+        self.assertIsNone(cache.get("b", 10))
+        self.assertIsNotNone(cache.get("add comm", 10))
+
+        stats = cache.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual((stats["hits"], stats["misses"]), (4, 3))
+        self.assertAlmostEqual(stats["hit_rate"], 4 / 7)
+        self.assertNotIn("embedding_hits", stats)
+
+    def test_store_survives_restarts(self):
+        """Test that query embeddings are read back by a new store."""
+        embedding = np.arange(4, dtype=np.float32).reshape(1, 4)
+        store = QueryEmbeddingStore(self.path)
+        self.assertIsNone(store.get("add comm"))
+        store.put("add comm", embedding)
+        store.close()
+
+        store = QueryEmbeddingStore(self.path)
+        cache = QueryCache(maxsize=0, store=store)
+        np.testing.assert_array_equal(store.get("add comm"), embedding)
+        self.assertEqual(len(store), 1)
+        # The LRU is disabled
+        cache.put("add comm", 10, [])
+        self.assertIsNone(cache.get("add comm", 10))
+
+        stats = cache.stats()
+        self.assertEqual((stats["embedding_hits"], stats["embedding_misses"]), (1, 0))
+        self.assertEqual(stats["embedding_hit_rate"], 1.0)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import tempfile
+
+from ..results_log import ResultsLog
+
+
+def make_result(theorem: str, success: bool, duration: float, error: str = None) -> dict:
+    result = {
+        "theorem": theorem,
+        "file": f"{theorem}.v",
+        "success": success,
+        "duration": duration,
+        "proof": ["lia."] if success else None,
+        "proof_length": 1 if success else 0,
+    }
+    if error:
+        result["error"] = error
+    return result
+
+
+class TestResultsLog(unittest.TestCase):
+    """Test cases for the ResultsLog class."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "results.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_results_survive_restart(self):
+        """Test that a new log on the same file loads the previous results."""
+        log = ResultsLog(self.path)
+        log.add(make_result("a", True, 2.0))
+        log.add(make_result("b", False, 10.0, error="timeout"))
+        log.add(make_result("c", False, 1.0, error="Connection reset"))
+
+        restarted = ResultsLog(self.path)
+        self.assertTrue(restarted.is_done("a"))
+        self.assertTrue(restarted.is_done("b"))
+        # Other errors are retried
+        self.assertFalse(restarted.is_done("c"))
+        self.assertFalse(restarted.is_done("d"))
+        self.assertEqual(restarted.summary(), log.summary())
+
+    def test_cut_last_line(self):
+        """Test that a line cut by a crash is ignored and not merged with the next one."""
+        log = ResultsLog(self.path)
+        log.add(make_result("a", True, 2.0))
+        with open(self.path, "a") as f:
+            f.write('{"theorem": "b", "succ')
+
+        restarted = ResultsLog(self.path)
+        self.assertEqual(list(restarted.results), ["a"])
+        restarted.add(make_result("b", True, 1.0))
+        self.assertEqual(sorted(ResultsLog(self.path).results), ["a", "b"])
+
+    def test_incremental_summary(self):
+        """Test the summary statistics, including a retried theorem."""
+        log = ResultsLog()
+        log.add(make_result("a", True, 2.0))
+        log.add(make_result("b", False, 8.0, error="Connection reset"))
+        log.add(make_result("c", True, 4.0))
+
+        summary = log.summary()
+        self.assertEqual(summary["total_theorems"], 3)
+        self.assertEqual(summary["successful_theorems"], 2)
+        self.assertEqual(summary["slowest_theorem"], "b")
+        self.assertEqual(summary["fastest_theorem"], "a")
+
+        log.add(make_result("b", True, 1.0))
+        summary = log.summary()
+        self.assertEqual(summary["total_theorems"], 3)
+        self.assertEqual(summary["successful_theorems"], 3)
+        self.assertEqual(summary["total_duration"], 7.0)
+        self.assertEqual(summary["fastest_theorem"], "b")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -168,7 +168,50 @@ class TestScriptToolIntegration(unittest.TestCase):
             result["goal"],
             "Goal should be reset to initial state",
         )
-    
+
+    def test_fork_shares_initial_state(self):
+        """Test that forks share the initial state but not the proof."""
+        tool = ScriptTool(
+            pet=self.pet,
+            workspace=self.workspace,
+            file=self.file,
+            theorem="foo",
+        )
+        tool.run("intros n.")
+
+        fork = tool.fork()
+
+        # The theorem is not started again
+        self.assertIs(fork.env.initial_state, tool.env.initial_state)
+        self.assertEqual(fork.env.thm_code, tool.env.thm_code)
+        self.assertEqual(fork.env.proof, ["intros n."])
+
+        # The proofs of the fork and the original are independent
+        result = fork.run("lia.")
+        self.assertTrue(result.get("is_complete", False))
+        self.assertEqual(fork.env.proof, ["intros n.", "lia."])
+        self.assertEqual(tool.env.proof, ["intros n."])
+
+    def test_proof_finished_tracks_goals(self):
+        """Test that the proof is finished only once no goal is left."""
+        tool = ScriptTool(
+            pet=self.pet,
+            workspace=self.workspace,
+            file=self.file,
+            theorem="foo",
+        )
+        self.assertEqual(tool.env.new_goal_pp, tool.env.thm_code)
+        self.assertFalse(tool.env.proof_finished)
+
+        tool.run("intros n.")
+        self.assertTrue(tool.env.goals)
+        self.assertFalse(tool.env.proof_finished)
+
+        tool.run("lia.")
+        self.assertEqual(tool.env.goals, [])
+        self.assertTrue(tool.env.proof_finished)
+        self.assertTrue(tool.env.check_proof())
+
 
 if __name__ == "__main__":
     unittest.main()
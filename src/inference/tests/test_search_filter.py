@@ -0,0 +1,111 @@
+import unittest
+import tempfile
+from unittest import mock
+
+import numpy as np
+
+from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.index.hybrid_index import HybridIndex
+from src.embedding.index.index_config import IndexConfig
+from src.embedding.index.search_filter import EntryMetadata, SearchFilter
+from .test_hybrid_index import FakeEmbedding
+
+
+class TestSearchFilter(unittest.TestCase):
+    """Test cases for the metadata-filtered search."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.content = {
+            f"mathcomp.{file}.lemma{i}": {
+                "fullname": f"lemma{i}",
+                "docstring": f"Statement {i} of {file}.",
+                "parent": f"mathcomp.{file}",
+                "start_line": 10 * i,
+                "kind": "Lemma" if i % 2 else "Definition",
+            }
+            for file in ("ssrnat", "poly")
+            for i in range(300)
+        }
+        self.model = FakeEmbedding()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def index(self, **kwargs):
+        return FaissIndex(self.model, self.content, cache_path=self.cache_dir.name, batch_size=128, **kwargs)
+
+    def test_mask(self):
+        fqns = list(self.content)
+        metadata = EntryMetadata(fqns, list(self.content.values()))
+        mask = SearchFilter(before=("mathcomp.poly", 100)).mask(metadata)
+        hidden = {fqn for fqn, kept in zip(fqns, mask) if not kept}
+        self.assertEqual(hidden, {f"mathcomp.poly.lemma{i}" for i in range(10, 300)})
+
+        mask = SearchFilter(kinds=["Lemma"], exclude=["mathcomp.poly.lemma1"]).mask(metadata)
+        self.assertEqual(mask.sum(), 299)
+        mask = SearchFilter(include=["mathcomp.poly.lemma1", "unknown"]).mask(metadata)
+        self.assertEqual([fqn for fqn, kept in zip(fqns, mask) if kept], ["mathcomp.poly.lemma1"])
+
+        # Entries of another file, or without metadata, are kept
+        element = {"parent": "mathcomp.other", "start_line": 0}
+        self.assertTrue(SearchFilter.defined_before(element).mask(metadata).all())
+        self.assertEqual(SearchFilter.defined_before({}), SearchFilter())
+
+    def test_exactly_top_k(self):
+        """Test that filtered searches return exactly top_k valid results."""
+        index = self.index()
+        search_filter = index.filter_before("poly.lemma20")
+        self.assertEqual(search_filter.before, ("mathcomp.poly", 200))
+        results = index.query_batch(["Statement 5 of poly.", "Statement 250 of poly."], top_k=25, filters=search_filter)
+        for result in results:
+            self.assertEqual(len(result), 25)
+            for _, element, _ in result:
+                self.assertFalse(element["parent"] == "mathcomp.poly" and element["start_line"] >= 200)
+
+        # The filter is part of the cache key
+        unfiltered = index.query("Statement 250 of poly.", top_k=25)
+        self.assertIn("mathcomp.poly.lemma250", [fqn for _, _, fqn in unfiltered])
+        self.assertNotIn("mathcomp.poly.lemma250", [fqn for _, _, fqn in results[1]])
+
+        # Fewer valid entries than top_k
+        result = index.query("lemma", top_k=10, filter=SearchFilter(include=["mathcomp.poly.lemma3"]))
+        self.assertEqual([fqn for _, _, fqn in result], ["mathcomp.poly.lemma3"])
+
+    def test_approximate_index(self):
+        """Test that valid entries missed by an approximate index are found by an exact search."""
+        index = self.index(index_config=IndexConfig("ivf_flat", nlist=8, nprobe=1))
+        keep = ["mathcomp.ssrnat.lemma7", "mathcomp.poly.lemma100", "mathcomp.poly.lemma299"]
+        for query in ["Statement 1 of poly.", "Statement 2 of ssrnat.", "Statement 3 of poly."]:
+            result = index.query(query, top_k=3, filter=SearchFilter(include=keep))
+            self.assertEqual(sorted(fqn for _, _, fqn in result), sorted(keep))
+            scores = [score for score, _, _ in result]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+        exact = index.all_embeddings[[index.metadata.positions[fqn] for fqn in keep]] @ index.embed_query(query)[0]
+        np.testing.assert_allclose(sorted(scores), sorted(exact), rtol=1e-5)
+
+        # The valid embeddings are read once for a batch of queries
+        index.query_cache.clear()
+        queries = [f"Statement {i} of poly." for i in range(4, 8)]
+        with mock.patch.object(index.store, "get", wraps=index.store.get) as get:
+            results = index.query_batch(queries, top_k=3, filters=SearchFilter(include=keep))
+        self.assertEqual(get.call_count, 1)
+        for result in results:
+            self.assertEqual(sorted(fqn for _, _, fqn in result), sorted(keep))
+
+    def test_hybrid(self):
+        index = HybridIndex(self.index())
+        search_filter = SearchFilter(before=("mathcomp.poly", 0))
+        # Exact name, lemma20 of poly is hidden
+        result = index.query("lemma20", top_k=10, filter=search_filter)
+        self.assertEqual(len(result), 10)
+        self.assertEqual(result[0][2], "mathcomp.ssrnat.lemma20")
+        self.assertTrue(all(element["parent"] == "mathcomp.ssrnat" for _, element, _ in result))
+
+        result = index.query("Statement 20 of poly.", top_k=10, filter=search_filter)
+        self.assertEqual(len(result), 10)
+        self.assertTrue(all(element["parent"] == "mathcomp.ssrnat" for _, element, _ in result))
+
+
+if __name__ == "__main__":
+    unittest.main()
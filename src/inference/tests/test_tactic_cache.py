@@ -0,0 +1,91 @@
+import unittest
+from types import SimpleNamespace
+
+from pytanque import PetanqueError
+
+from ..tactic_cache import TacticCache, normalize_tactic
+
+
+class CountingPet:
+    """A stub Pytanque connection counting the tactics it runs."""
+
+    def __init__(self):
+        self.calls = 0
+        self.next_id = 1
+
+    def run(self, state, tac, timeout=None):
+        self.calls += 1
+        if "fail" in tac:
+            raise PetanqueError(1, f"{tac} failed")
+        if "slow" in tac:
+            raise PetanqueError(-32001, "Timeout")
+        self.next_id += 1
+        return SimpleNamespace(st=self.next_id)
+
+
+class TestTacticCache(unittest.TestCase):
+    """Test cases for the TacticCache class."""
+
+    def setUp(self):
+        self.pet = CountingPet()
+        self.state = SimpleNamespace(st=0)
+
+    def test_normalize_tactic(self):
+        """Test that whitespace differences are ignored."""
+        self.assertEqual(normalize_tactic("  intros   n .\n"), "intros n .")
+
+    def test_success_is_cached(self):
+        """Test that the same tactic on the same state reaches Coq once."""
+        cache = TacticCache()
+        first = cache.run(self.pet, self.state, "intros n.")
+        second = cache.run(self.pet, self.state, "intros  n. ")
+
+        self.assertIs(first, second)
+        self.assertEqual(self.pet.calls, 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+
+        # Another state is another entry
+        cache.run(self.pet, first, "intros n.")
+        self.assertEqual(self.pet.calls, 2)
+
+    def test_error_is_cached(self):
+        """Test that a failing tactic raises the same error without reaching Coq."""
+        cache = TacticCache()
+        for _ in range(3):
+            with self.assertRaises(PetanqueError) as ctx:
+                cache.run(self.pet, self.state, "fail.")
+            self.assertIn("fail. failed", str(ctx.exception.message))
+
+        self.assertEqual(self.pet.calls, 1)
+        self.assertEqual(cache.stats()["error_hits"], 2)
+
+    def test_timeout_is_not_cached(self):
+        """Test that a tactic cut by its timeout is run again."""
+        cache = TacticCache()
+        for _ in range(2):
+            with self.assertRaises(PetanqueError):
+                cache.run(self.pet, self.state, "slow.")
+
+        self.assertEqual(self.pet.calls, 2)
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        cache = TacticCache(maxsize=2)
+        cache.run(self.pet, self.state, "a.")
+        cache.run(self.pet, self.state, "b.")
+        cache.run(self.pet, self.state, "a.")  # a is now the most recent
+        cache.run(self.pet, self.state, "c.")  # evicts b
+
+        calls = self.pet.calls
+        cache.run(self.pet, self.state, "a.")
+        self.assertEqual(self.pet.calls, calls)
+        cache.run(self.pet, self.state, "b.")
+        self.assertEqual(self.pet.calls, calls + 1)
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import json
+import unittest
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from ..tracing import Tracer, current_tracer, set_iteration, span
+from ..deadline import propagate
+from ..results_log import ResultsLog
+
+
+class TestTracer(unittest.TestCase):
+    """Test cases for the Tracer class."""
+
+    def test_span_without_tracer(self):
+        """Test that spans are no-ops when no tracer is active."""
+        self.assertIsNone(current_tracer())
+        with span("llm.generate_batch"):
+            pass
+        set_iteration(0)
+
+    def test_phase_stats(self):
+        """Test that spans are aggregated per phase and per iteration."""
+        tracer = Tracer()
+        with tracer.activate():
+            for iteration in range(2):
+                set_iteration(iteration)
+                with span("llm.generate_batch"):
+                    pass
+                for _ in range(iteration + 1):
+                    with span("coq.exec"):
+                        pass
+
+        summary = tracer.summary()
+        self.assertEqual(summary["phases"]["llm.generate_batch"]["count"], 2)
+        self.assertEqual(summary["phases"]["coq.exec"]["count"], 3)
+        coq = summary["phases"]["coq.exec"]
+        self.assertAlmostEqual(coq["mean"], coq["total"] / 3)
+        self.assertGreaterEqual(coq["max"], coq["mean"])
+        self.assertEqual(len(summary["iterations"]), 2)
+        self.assertEqual(set(summary["iterations"][1]), {"llm.generate_batch", "coq.exec"})
+        # No events are kept unless requested
+        self.assertEqual(tracer.to_chrome_trace()["traceEvents"], [])
+
+    def test_span_records_on_error(self):
+        """Test that a span is recorded when its block raises."""
+        tracer = Tracer()
+        with tracer.activate():
+            with self.assertRaises(ValueError):
+                with span("coq.exec"):
+                    raise ValueError
+        self.assertEqual(tracer.summary()["phases"]["coq.exec"]["count"], 1)
+
+    def test_propagate(self):
+        """Test that spans of executor threads are recorded by the tracer of the caller."""
+        tracer = Tracer()
+
+        def task():
+            with span("search"):
+                pass
+
+        with tracer.activate():
+            func = propagate(task)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(func) for _ in range(4)]:
+                future.result()
+        self.assertEqual(tracer.summary()["phases"]["search"]["count"], 4)
+
+    def test_export(self):
+        """Test the Chrome trace export."""
+        tracer = Tracer(record_events=True)
+        with tracer.activate():
+            set_iteration(3)
+            with span("coq.exec", tactics=2):
+                pass
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "traces", "thm.json")
+            tracer.export(path)
+            with open(path) as f:
+                trace = json.load(f)
+
+        (event,) = trace["traceEvents"]
+        self.assertEqual(event["name"], "coq.exec")
+        self.assertEqual(event["ph"], "X")
+        self.assertEqual(event["args"], {"tactics": 2, "iteration": 3})
+        self.assertGreaterEqual(event["dur"], 0)
+
+
+class TestResultsLogTimings(unittest.TestCase):
+    """Test cases for the timings of the benchmark summary."""
+
+    def test_timings_summary(self):
+        """Test that the phase timings of the theorems are summed in the summary."""
+        log = ResultsLog()
+        for name, total in [("a", 1.0), ("b", 3.0)]:
+            log.add(
+                {
+                    "theorem": name,
+                    "success": False,
+                    "duration": 5.0,
+                    "proof_length": 0,
+                    "timings": {
+                        "phases": {"coq.exec": {"count": 2, "total": total}},
+                        "iterations": [],
+                    },
+                }
+            )
+        # A result without timings (e.g. from an older log)
+        log.add({"theorem": "c", "success": False, "duration": 1.0, "proof_length": 0})
+
+        timings = log.summary()["timings"]
+        self.assertEqual(timings["coq.exec"]["count"], 4)
+        self.assertAlmostEqual(timings["coq.exec"]["total"], 4.0)
+        self.assertAlmostEqual(timings["coq.exec"]["per_theorem"], 4.0 / 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from types import SimpleNamespace
+
+from ..transposition import TranspositionTable
+from ..env import goals_key
+
+
+def make_goal(ty: str, hyps=()) -> SimpleNamespace:
+    """Build a goal with the fields read by `goals_key`."""
+    return SimpleNamespace(
+        ty=ty,
+        hyps=[SimpleNamespace(names=names, def_=None, ty=t) for names, t in hyps],
+    )
+
+
+class TestTranspositionTable(unittest.TestCase):
+    """Test cases for the TranspositionTable class."""
+
+    def test_first_beam_owns_state(self):
+        """Test that the first beam reaching a state becomes its owner."""
+        table = TranspositionTable()
+        self.assertIsNone(table.claim("s", 0))
+        self.assertIsNone(table.claim("s", 0))
+        self.assertEqual(table.claim("s", 1), 0)
+        self.assertEqual(
+            table.stats(), {"states": 1, "lookups": 3, "hits": 1, "merges": 1}
+        )
+
+    def test_abandoned_owner_is_replaced(self):
+        """Test that a state owned by an inactive beam is taken over."""
+        table = TranspositionTable()
+        table.claim("s", 0)
+        self.assertIsNone(table.claim("s", 1, active={1, 2}))
+        self.assertEqual(table.claim("s", 2, active={1, 2}), 1)
+        self.assertEqual(table.stats()["hits"], 2)
+        self.assertEqual(table.stats()["merges"], 1)
+
+
+class TestGoalsKey(unittest.TestCase):
+    """Test cases for the canonical key of a list of goals."""
+
+    def test_same_goals_same_key(self):
+        """Test that equal goals built separately have the same key."""
+        a = [make_goal("n + 0 = n", [(["n"], "nat")])]
+        b = [make_goal("n + 0 = n", [(["n"], "nat")])]
+        self.assertEqual(goals_key(a), goals_key(b))
+
+    def test_different_goals_different_key(self):
+        """Test that goals differing in a hypothesis or their order differ."""
+        g1 = make_goal("P", [(["H"], "Q")])
+        g2 = make_goal("P", [(["H"], "R")])
+        g3 = make_goal("Q")
+        self.assertNotEqual(goals_key([g1]), goals_key([g2]))
+        self.assertNotEqual(goals_key([g1, g3]), goals_key([g3, g1]))
+        self.assertNotEqual(goals_key([]), goals_key([g3]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+import os
+from typing import List, Optional
+
+from pytanque import Pytanque
+
+from ..tree_search_prover import BestFirstProver, SearchBudget, SearchNode
+from ..tools import ScriptTool
+from ..llm import VLLM, Completion
+
+
+class ScriptedLLM(VLLM):
+    """A mock VLLM returning scripted completions in sequence."""
+
+    def __init__(self, completions: List[Completion]):
+        self.completions = list(completions)
+        self.batches = []
+        self.verbose = False
+        self.stream = False
+
+    def generate_batch_scored(
+        self, prompts: List[str], stop_sequences: Optional[List[str]] = None
+    ) -> List[Completion]:
+        self.batches.append(prompts)
+        return [
+            self.completions.pop(0) if self.completions else Completion("No more responses")
+            for _ in prompts
+        ]
+
+
+class TestBestFirstProver(unittest.TestCase):
+    """Integration tests for the BestFirstProver class using a real pet-server."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures that are reused across all tests."""
+        cls.workspace = os.path.abspath("examples")
+        cls.file = "foo.v"
+
+        cls.pet = Pytanque("127.0.0.1", 8765)
+        cls.pet.connect()
+        cls.pet.set_workspace(False, str(cls.workspace))
+
+    def setUp(self):
+        """Set up test fixtures before each test."""
+        self.coq_tool = ScriptTool(
+            pet=self.pet,
+            workspace=self.workspace,
+            file=self.file,
+            theorem="foo",
+        )
+
+    def script(self, tactics: str, logprob: float = -1.0) -> Completion:
+        tag = self.coq_tool.tag
+        return Completion(f"<{tag}>{tactics}</{tag}>", logprob=logprob, num_tokens=10)
+
+    def test_multi_step_proof(self):
+        """Test that the search goes deeper from the state that made progress."""
+        llm = ScriptedLLM(
+            [self.script("invalid_tactic."), self.script("intros n."), self.script("lia.")]
+        )
+        prover = BestFirstProver(
+            llm=llm, coq_tool=self.coq_tool, expand_width=1, samples_per_node=2
+        )
+
+        success, proof = prover.run_search()
+
+        self.assertTrue(success)
+        self.assertEqual(proof, ["intros n.", "lia."])
+        self.assertEqual(len(llm.batches), 2)
+        self.assertEqual(len(llm.batches[0]), 2)
+        # The initial tool is not modified by the search
+        self.assertEqual(self.coq_tool.env.proof, [])
+
+    def test_duplicate_states_are_pruned(self):
+        """Test that two completions reaching the same state create one node."""
+        llm = ScriptedLLM([self.script("intros n."), self.script("intros  n.")])
+        prover = BestFirstProver(
+            llm=llm,
+            coq_tool=self.coq_tool,
+            budget=SearchBudget(max_iterations=1),
+            expand_width=1,
+            samples_per_node=2,
+        )
+
+        success, _ = prover.run_search()
+
+        self.assertFalse(success)
+        self.assertEqual(prover.stats["nodes"], 2)
+        self.assertEqual(prover.stats["duplicates"], 1)
+        self.assertEqual(prover.stats["stopped_by"], "iterations")
+
+    def test_token_budget(self):
+        """Test that the search stops once the token budget is spent."""
+        llm = ScriptedLLM([self.script("invalid_tactic.")] * 10)
+        prover = BestFirstProver(
+            llm=llm,
+            coq_tool=self.coq_tool,
+            budget=SearchBudget(max_tokens=20),
+            expand_width=1,
+            samples_per_node=2,
+        )
+
+        success, _ = prover.run_search()
+
+        self.assertFalse(success)
+        self.assertEqual(prover.stats["stopped_by"], "tokens")
+        self.assertEqual(len(llm.batches), 1)
+
+    def test_coq_call_budget_with_tokens_spent(self):
+        """Test that the Coq call budget stops the checks of a batch whose tokens exceed the budget."""
+        llm = ScriptedLLM(
+            [self.script("invalid_tactic."), self.script("intros n."), self.script("lia.")]
+        )
+        prover = BestFirstProver(
+            llm=llm,
+            coq_tool=self.coq_tool,
+            budget=SearchBudget(max_tokens=5, max_coq_calls=1),
+            expand_width=1,
+            samples_per_node=3,
+        )
+
+        success, _ = prover.run_search()
+
+        self.assertFalse(success)
+        self.assertEqual(prover.stats["stopped_by"], "coq_calls")
+        self.assertEqual(prover.stats["coq_calls"], 1)
+        self.assertEqual(len(llm.batches), 1)
+
+    def test_score_prefers_fewer_goals_and_likely_steps(self):
+        """Test the ordering of the frontier."""
+        prover = BestFirstProver(llm=ScriptedLLM([]), coq_tool=self.coq_tool)
+        node = lambda num_goals, logprob: SearchNode(
+            coq_tool=self.coq_tool, prompt="", goals="", num_goals=num_goals, logprob=logprob
+        )
+        self.assertGreater(prover.score(node(1, -0.1)), prover.score(node(2, -0.1)))
+        self.assertGreater(prover.score(node(1, -0.1)), prover.score(node(1, -2.0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,21 @@
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional, Union, Tuple
 from dataclasses import dataclass
+import copy
 import json
 
+from pytanque import Pytanque
+
 from .env import ScriptEnv
+from .tactic_cache import TacticCache
+from .deadline import DeadlineExceeded
+from .tracing import span
 from .llm import LLM
 from src.embedding.models.base import BaseEmbedding
 from src.embedding.index.cosim_index import FaissIndex
+from src.embedding.index.index_config import IndexConfig
+from src.embedding.index.hybrid_index import HybridIndex
+from src.embedding.index.search_filter import SearchFilter
 
 # ===============================================
 # Tool Interface
@@ -45,6 +54,22 @@ class Tool(ABC):
         """Execute the tool functionality."""
         pass
 
+    def run_batch(self, inputs: List[str]) -> List[Any]:
+        """Execute the tool on several inputs (one after the other by default)."""
+        return [self.run(input_text) for input_text in inputs]
+
+    def fork(self, new_connection: bool = False) -> "Tool":
+        """
+        Create a copy of the tool for a new beam.
+
+        Tools without per-beam state return themselves, and are shared by the beams.
+        """
+        return self
+
+    def close(self) -> None:
+        """Release the resources owned by the tool (e.g. a connection opened by `fork`)."""
+        pass
+
 
 # ===============================================
 # Tool Implementations
@@ -54,11 +79,22 @@ class Tool(ABC):
 class SearchTool(Tool):
     """Tool for searching relevant information."""
 
-    def __init__(self, embedding_model:BaseEmbedding, docstrings_path="", batch_size=16, cache_path=None):
+    def __init__(self, embedding_model:BaseEmbedding, docstrings_path="", batch_size=16, cache_path=None, query_cache_size=1024,
+                 index_config: Optional[IndexConfig] = None, hybrid=False, dense_weight=1.0, lexical_weight=1.0,
+                 max_tokens: Optional[int] = None):
         super().__init__()
         with open(docstrings_path, 'r') as file:
             docstrings = json.load(file)
-        self.index = FaissIndex(embedding_model, docstrings, batch_size=batch_size, cache_path=cache_path, load_cache_index=True if cache_path else False)
+        self.dense_index = FaissIndex(
+            embedding_model, docstrings, batch_size=batch_size, cache_path=cache_path, load_cache_index=True if cache_path else False,
+            query_cache_size=query_cache_size, index_config=index_config, max_tokens=max_tokens,
+        )
+        self.index = self.dense_index
+        if hybrid:
+            # Fused with BM25, exact names skip the embedding model
+            self.index = HybridIndex(self.dense_index, dense_weight=dense_weight, lexical_weight=lexical_weight)
+        # Filter applied to all the searches
+        self.search_filter: Optional[SearchFilter] = None
 
     @property
     def name(self) -> str:
@@ -85,10 +121,22 @@ class SearchTool(Tool):
     def run(self, input_text: str, top_k=10) -> str:
         """
         Execute a search and return results.
+        """
+        return self.run_batch([input_text], top_k=top_k)[0]
 
-        Note: This is a placeholder. Implement actual search functionality here.
+    def run_batch(self, inputs: List[str], top_k=10) -> List[Dict[str, Any]]:
+        """
+        Execute several searches at once (one forward pass of the embedding model).
         """
-        search_result = self.index.query(input_text, top_k=top_k)
+        with span("search", batch=len(inputs)):
+            search_results = self.index.query_batch(inputs, top_k=top_k, filters=self.search_filter)
+        return [self._format(search_result) for search_result in search_results]
+
+    def hide_after(self, theorem: str) -> None:
+        """Hide the lemmas defined after `theorem` in its file from the searches."""
+        self.search_filter = self.dense_index.filter_before(theorem)
+
+    def _format(self, search_result) -> Dict[str, Any]:
         output = ""
         # TODO: retrain with clean format
         for k, (_, element, _) in enumerate(search_result, start=1):
@@ -96,12 +144,16 @@ class SearchTool(Tool):
             output += f"{k}. {fullname}\n{docstring}\n\n"
         return {"content": output, "search_result": search_result}
 
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit rate statistics of the query cache (results in memory, embeddings on disk)."""
+        return self.index.cache_stats()
+
 
 
 class ScriptTool(Tool):
     """Tool for interacting with the Coq theorem prover."""
 
-    def __init__(self, pet, workspace, file, theorem, context=False):
+    def __init__(self, pet, workspace, file, theorem, context=False, tactic_cache: TacticCache = None):
         """
         Initialize the Coq prover tool.
 
@@ -111,13 +163,16 @@ class ScriptTool(Tool):
             file: Coq file name
             theorem: Name of the theorem to prove
             context: Whether to include context in output
+            tactic_cache: Cache of tactic results (default: a new cache, shared by the forks)
         """
         self.pet = pet
         self.workspace = workspace
         self.file = file
         self.theorem = theorem
-        self.env = ScriptEnv(pet, workspace, file, theorem, context=context)
+        self.env = ScriptEnv(pet, workspace, file, theorem, context=context, tactic_cache=tactic_cache)
         self.context = self.env.context
+        # Whether `pet` was opened by `fork`, and is closed with the tool
+        self.owns_connection = False
 
     @property
     def name(self) -> str:
@@ -174,18 +229,48 @@ class ScriptTool(Tool):
 
             return {"status": "success", "is_complete": False}  # "goal": new_goal,
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
     def reset(self) -> None:
         """Reset the prover to the initial state."""
-        self.env = ScriptEnv(self.pet, self.workspace, self.file, self.theorem)
+        self.env = ScriptEnv(
+            self.pet, self.workspace, self.file, self.theorem, tactic_cache=self.env.tactic_cache
+        )
+
+    def fork(self, new_connection: bool = False) -> "ScriptTool":
+        """
+        Create a copy of the ScriptTool instance for a new beam.
 
-    def deepcopy(self) -> "ScriptTool":
-        """Create a deep copy of the ScriptTool instance."""
-        new = self.__class__(self.pet, self.workspace, self.file, self.theorem)
-        new.env = self.env.deepcopy()
+        The theorem is not started again: the clone shares the initial state,
+        theorem code and context, and only copies the per-beam proof state.
+
+        Args:
+            new_connection: Whether the copy gets its own Pytanque connection,
+                            so that it can run tactics concurrently with the original
+        """
+        pet = self.pet
+        if new_connection:
+            pet = Pytanque(self.pet.host, self.pet.port)
+            pet.connect()
+            pet.set_workspace(False, str(self.workspace))
+        new = copy.copy(self)
+        new.pet = pet
+        new.env = self.env.fork(pet)
+        new.owns_connection = new_connection
         return new
+
+    def close(self) -> None:
+        """Close the Pytanque connection of the tool if it was opened by `fork`."""
+        if self.owns_connection:
+            self.owns_connection = False
+            self.pet.close()
+
+    def deepcopy(self, new_connection: bool = False) -> "ScriptTool":
+        """Create a deep copy of the ScriptTool instance (see `fork`)."""
+        return self.fork(new_connection)
     
 class HaveTool(ScriptTool):
     @property
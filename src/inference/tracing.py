@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Tracer:
+    """
+    Lightweight latency tracer for the phases of a proof search.
+
+    Code paths wrap their phases in `span(name)`, which records nothing unless a
+    tracer is active in the current context (see `activate`). The tracer keeps
+    per-phase statistics for the whole task and for each iteration of the search,
+    and optionally the individual spans to export a Chrome trace / Perfetto timeline.
+    """
+
+    def __init__(self, record_events: bool = False):
+        """
+        Initialize the tracer.
+
+        Args:
+            record_events: Whether to keep every span for `to_chrome_trace`
+        """
+        self.record_events = record_events
+        self.events: List[Dict[str, Any]] = []
+        # phase -> [count, total seconds, max seconds]
+        self.phases: Dict[str, List[float]] = {}
+        # iteration -> phase -> total seconds
+        self.iterations: Dict[int, Dict[str, float]] = {}
+        self.iteration: Optional[int] = None
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def set_iteration(self, iteration: Optional[int]) -> None:
+        """Attribute the next spans to an iteration of the search."""
+        self.iteration = iteration
+
+    def record(self, name: str, start: float, end: float, args: Dict[str, Any]) -> None:
+        """Record a span, with `time.perf_counter()` start and end times."""
+        duration = end - start
+        with self.lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += duration
+            phase[2] = max(phase[2], duration)
+
+            if self.iteration is not None:
+                totals = self.iterations.setdefault(self.iteration, {})
+                totals[name] = totals.get(name, 0.0) + duration
+
+            if self.record_events:
+                self.events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": (start - self.origin) * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": {**args, "iteration": self.iteration},
+                    }
+                )
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return the statistics of each phase, in total and per iteration.
+
+        Phases can overlap (e.g. streamed generation and Coq checks), so their
+        totals are not expected to add up to the duration of the task.
+        """
+        with self.lock:
+            return {
+                "phases": {
+                    name: {
+                        "count": count,
+                        "total": total,
+                        "mean": total / count if count else 0.0,
+                        "max": max_duration,
+                    }
+                    for name, (count, total, max_duration) in self.phases.items()
+                },
+                "iterations": [
+                    self.iterations[i] for i in sorted(self.iterations)
+                ],
+            }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Return the recorded spans in the Chrome trace event format (also read by Perfetto)."""
+        with self.lock:
+            return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+    def export(self, path: str) -> None:
+        """Write the Chrome trace to `path`."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    @contextmanager
+    def activate(self) -> Iterator["Tracer"]:
+        """Make this tracer the current one in the block."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+_current: ContextVar[Optional[Tracer]] = ContextVar("tracer", default=None)
+
+
+def current_tracer() -> Optional[Tracer]:
+    """Return the tracer of the current task, if any."""
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **args) -> Iterator[None]:
+    """Measure the block as a span of the current tracer (no-op without tracer)."""
+    tracer = _current.get()
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, start, time.perf_counter(), args)
+
+
+def set_iteration(iteration: Optional[int]) -> None:
+    """Attribute the next spans of the current tracer to an iteration (no-op without tracer)."""
+    tracer = _current.get()
+    if tracer is not None:
+        tracer.set_iteration(iteration)
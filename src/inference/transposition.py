@@ -0,0 +1,50 @@
+from typing import Dict, Optional
+
+
+class TranspositionTable:
+    """
+    Table of the proof states reached by the beams of a proof search.
+
+    Each state is owned by the first beam that reached it. When another beam reaches
+    a state that is owned by a beam still being explored, the search merges it into
+    the owner instead of paying twice for the same subtree.
+    """
+
+    def __init__(self):
+        self.owners: Dict[str, int] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.merges = 0
+
+    def claim(self, key: str, beam: int, active: Optional[set] = None) -> Optional[int]:
+        """
+        Register that `beam` reached the state `key`.
+
+        Args:
+            key: Canonical key of the state (see `env.goals_key`)
+            beam: Index of the beam that reached the state
+            active: Indices of the beams still being explored (default: all beams)
+
+        Returns:
+            The index of another active beam that already explores this state,
+            or None if `beam` is now the owner of the state
+        """
+        self.lookups += 1
+        owner = self.owners.get(key)
+        if owner is not None and owner != beam:
+            self.hits += 1
+            if active is None or owner in active:
+                self.merges += 1
+                return owner
+        # New state, or its owner was abandoned: the beam takes it over
+        self.owners[key] = beam
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit and merge statistics."""
+        return {
+            "states": len(self.owners),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "merges": self.merges,
+        }
@@ -0,0 +1,438 @@
+import argparse
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Dict, Any
+
+from pytanque import Pytanque
+
+from .prover_agent import CoqProofManager
+from .tools import ScriptTool
+from .llm import LLM, VLLM, Completion
+from .transposition import TranspositionTable
+from .tracing import set_iteration
+from .llm_logger import log_context
+
+
+@dataclass
+class SearchBudget:
+    """Global budgets of a proof search (None means unlimited)."""
+
+    # Generated tokens
+    max_tokens: Optional[int] = None
+    # Tactics sent to the Coq server (cache hits are free)
+    max_coq_calls: Optional[int] = None
+    # Wall-clock time in seconds
+    max_seconds: Optional[float] = None
+    # Number of batched LLM calls
+    max_iterations: int = 50
+
+
+@dataclass
+class SearchNode:
+    """A proof state in the search tree."""
+
+    coq_tool: ScriptTool
+    prompt: str
+    goals: str
+    num_goals: int
+    depth: int = 0
+    is_complete: bool = False
+    # Sum of the mean token log-probabilities of the steps leading to this node
+    logprob: float = 0.0
+    expansions: int = 0
+    # Latest failed response and error messages, fed back on the next expansion
+    failed_response: str = ""
+    failures: List[str] = field(default_factory=list)
+
+    @property
+    def proof(self) -> List[str]:
+        return self.coq_tool.env.proof
+
+
+class BestFirstProver:
+    """
+    Best-first proof search using CoqProofManager and an LLM.
+
+    The search keeps a priority frontier of proof states. At each iteration, the most
+    promising nodes are expanded with a single batched LLM call, each completion is
+    checked with `CoqProofManager.process_response`, and the new states are pushed back
+    on the frontier. Nodes are scored by number and size of remaining goals and by the
+    log-probability of the steps leading to them; nodes that were already expanded are
+    penalized so that the search widens instead of insisting on the same state.
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        coq_tool: ScriptTool,
+        budget: Optional[SearchBudget] = None,
+        expand_width: int = 4,
+        samples_per_node: int = 4,
+        max_expansions_per_node: int = 4,
+        goal_weight: float = 1.0,
+        size_weight: float = 0.1,
+        logprob_weight: float = 1.0,
+        expansion_penalty: float = 0.5,
+        verbose: bool = False,
+        goals_tag: str = "GOALS",
+    ):
+        """
+        Initialize the best-first prover.
+
+        Args:
+            llm: LLM instance for generating completions
+            coq_tool: ScriptTool instance for theorem proving
+            budget: Global budgets of the search (default: SearchBudget())
+            expand_width: Number of nodes expanded per iteration
+            samples_per_node: Number of completions sampled per expanded node
+            max_expansions_per_node: Number of times a node can be expanded
+            goal_weight: Score penalty per remaining goal
+            size_weight: Score penalty per 100 characters of remaining goals
+            logprob_weight: Weight of the path log-probability in the score
+            expansion_penalty: Score penalty per previous expansion of a node
+            verbose: Whether to print verbose output
+            goals_tag: The XML tag to use for goals (default: "GOALS")
+        """
+        self.llm = llm
+        self.coq_tool = coq_tool
+        self.proof_manager = CoqProofManager(coq_tool)
+        self.budget = budget or SearchBudget()
+        self.expand_width = expand_width
+        self.samples_per_node = samples_per_node
+        self.max_expansions_per_node = max_expansions_per_node
+        self.goal_weight = goal_weight
+        self.size_weight = size_weight
+        self.logprob_weight = logprob_weight
+        self.expansion_penalty = expansion_penalty
+        self.verbose = verbose
+        self.goals_tag = goals_tag
+        self.context = coq_tool.env.context
+        self.transpositions = TranspositionTable()
+        self.stats: Dict[str, Any] = {}
+
+    def score(self, node: SearchNode) -> float:
+        """Score a node, higher is more promising."""
+        return (
+            self.logprob_weight * node.logprob
+            - self.goal_weight * node.num_goals
+            - self.size_weight * len(node.goals) / 100
+            - self.expansion_penalty * node.expansions
+        )
+
+    def expansion_prompt(self, node: SearchNode) -> str:
+        """Build the prompt to expand a node, with the feedback of its failed expansions."""
+        if not node.failures:
+            return node.prompt
+        return node.prompt + self.llm.build_prompt_with_feedback(
+            goals=node.goals,
+            coq_tag=self.coq_tool.tag,
+            response=node.failed_response,
+            success=False,
+            previous_attempts=node.failures[-3:],
+            context=self.context,
+            goals_tag=self.goals_tag,
+        )
+
+    def _coq_calls(self) -> int:
+        return self.coq_tool.env.tactic_cache.misses - self._coq_calls_start
+
+    def _budget_exceeded(self, *budgets: str) -> Optional[str]:
+        """
+        Return the name of the first exhausted budget, if any.
+
+        Args:
+            budgets: Budgets to check, among "tokens", "coq_calls" and "time" (default: all)
+        """
+        exceeded = {
+            "tokens": lambda: self.budget.max_tokens is not None
+            and self.stats["tokens"] >= self.budget.max_tokens,
+            "coq_calls": lambda: self.budget.max_coq_calls is not None
+            and self._coq_calls() >= self.budget.max_coq_calls,
+            "time": lambda: self.budget.max_seconds is not None
+            and time.monotonic() - self._start_time >= self.budget.max_seconds,
+        }
+        return next((name for name in budgets or exceeded if exceeded[name]()), None)
+
+    def run_search(self) -> Tuple[bool, List[str]]:
+        """
+        Run the best-first search to find a proof.
+
+        Returns:
+            Tuple of (success flag, proof steps)
+        """
+        self._start_time = time.monotonic()
+        self._coq_calls_start = self.coq_tool.env.tactic_cache.misses
+        self.transpositions = TranspositionTable()
+        self.stats = {
+            "iterations": 0,
+            "tokens": 0,
+            "coq_calls": 0,
+            "nodes": 1,
+            "duplicates": 0,
+            "stopped_by": None,
+        }
+
+        stop_sequences = self.proof_manager.get_stop_sequences()
+        root_tool = self.coq_tool.fork()
+        root = SearchNode(
+            coq_tool=root_tool,
+            prompt=self.llm.build_prompt(
+                root_tool.env.thm_code, root_tool.tag, self.context, self.goals_tag
+            ),
+            goals=root_tool.env.new_goal_pp,
+            num_goals=len(root_tool.env.goals),
+        )
+        ids = itertools.count()
+        self.transpositions.claim(root_tool.env.state_key, next(ids))
+
+        # Max-heap on the score, ties broken by creation order
+        frontier = [(-self.score(root), next(ids), root)]
+
+        try:
+            while frontier and self.stats["iterations"] < self.budget.max_iterations:
+                self.stats["stopped_by"] = self._budget_exceeded()
+                if self.stats["stopped_by"]:
+                    break
+                set_iteration(self.stats["iterations"])
+                self.stats["iterations"] += 1
+
+                batch = [
+                    heapq.heappop(frontier)[2]
+                    for _ in range(min(self.expand_width, len(frontier)))
+                ]
+                if self.verbose:
+                    print(
+                        f"\nIteration {self.stats['iterations']}: expanding {len(batch)} nodes "
+                        f"(frontier: {len(frontier)}, depths: {[n.depth for n in batch]})"
+                    )
+
+                # One batched LLM call for all the expanded nodes
+                parents = [node for node in batch for _ in range(self.samples_per_node)]
+                completions = self.llm.generate_batch_scored(
+                    [self.expansion_prompt(node) for node in parents], stop_sequences
+                )
+                self.stats["tokens"] += sum(c.num_tokens for c in completions)
+                # The completions are paid for and still checked, but none are generated after them
+                out_of_tokens = self._budget_exceeded("tokens")
+
+                for node, completion in zip(parents, completions):
+                    self.stats["stopped_by"] = self._budget_exceeded("coq_calls", "time")
+                    if self.stats["stopped_by"]:
+                        break
+                    child = self._expand(node, completion)
+                    if child is None:
+                        continue
+                    if child.is_complete:
+                        if self.verbose:
+                            print("Found successful proof!")
+                        return True, child.proof
+                    child_id = next(ids)
+                    if self.transpositions.claim(child.coq_tool.env.state_key, child_id) is not None:
+                        # Another node already explores this state
+                        self.stats["duplicates"] += 1
+                        continue
+                    self.stats["nodes"] += 1
+                    heapq.heappush(frontier, (-self.score(child), child_id, child))
+
+                self.stats["stopped_by"] = self.stats["stopped_by"] or out_of_tokens
+                if self.stats["stopped_by"]:
+                    break
+
+                # Put the expanded nodes back, with a lower priority
+                for node in batch:
+                    node.expansions += 1
+                    if node.expansions < self.max_expansions_per_node:
+                        heapq.heappush(frontier, (-self.score(node), next(ids), node))
+            else:
+                # Out of iterations, or no node left to expand
+                self.stats["stopped_by"] = "iterations" if frontier else "frontier"
+        finally:
+            self.stats["coq_calls"] = self._coq_calls()
+            self.stats["seconds"] = time.monotonic() - self._start_time
+
+        if self.verbose:
+            print(f"Search failed: {self.stats}")
+        return False, []
+
+    def _expand(self, node: SearchNode, completion: Completion) -> Optional[SearchNode]:
+        """
+        Check a completion from a node with Coq.
+
+        Returns:
+            The new node if the completion made progress, None otherwise
+        """
+        coq_tool = node.coq_tool.fork()
+        result = self.proof_manager.process_response(
+            response=completion.text, coq_tool=coq_tool, verbose=self.verbose
+        )
+
+        if result.success and result.is_complete:
+            return SearchNode(
+                coq_tool=coq_tool,
+                prompt=node.prompt,
+                goals="",
+                num_goals=0,
+                depth=node.depth + 1,
+                is_complete=True,
+                logprob=node.logprob + completion.mean_logprob,
+            )
+
+        if not result.success or len(result.proof) == len(node.proof):
+            node.failed_response = completion.text
+            node.failures.extend(result.previous_unsuccessful or [])
+            return None
+
+        return SearchNode(
+            coq_tool=coq_tool,
+            prompt=node.prompt
+            + self.llm.build_prompt_with_feedback(
+                goals=result.new_goals,
+                coq_tag=coq_tool.tag,
+                response=completion.text,
+                success=True,
+                current_proof=result.proof,
+                previous_attempts=result.previous_unsuccessful,
+                context=self.context,
+                goals_tag=self.goals_tag,
+            ),
+            goals=result.new_goals,
+            num_goals=len(coq_tool.env.goals),
+            depth=node.depth + 1,
+            logprob=node.logprob + completion.mean_logprob,
+        )
+
+
+def main():
+    """Main entry point for the best-first prover CLI."""
+    parser = argparse.ArgumentParser(description="Best-first Coq Prover")
+    parser.add_argument(
+        "--workspace",
+        type=str,
+        default="examples",
+        help="Path to the workspace directory",
+    )
+    parser.add_argument("--file", type=str, default="foo.v", help="Coq file name")
+    parser.add_argument(
+        "--theorem", type=str, required=True, help="Name of the theorem to prove"
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Pytanque server host"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Pytanque server port")
+    parser.add_argument(
+        "--llm-url", type=str, default="http://localhost:8000", help="LLM API URL"
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default="deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B",
+        help="LLM model name",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.7,
+        help="Temperature for the LLM generation (higher values increase diversity)",
+    )
+    parser.add_argument(
+        "--expand-width", type=int, default=4, help="Number of nodes expanded per iteration"
+    )
+    parser.add_argument(
+        "--samples-per-node",
+        type=int,
+        default=4,
+        help="Number of completions sampled per expanded node",
+    )
+    parser.add_argument(
+        "--max-iterations", type=int, default=50, help="Maximum number of batched LLM calls"
+    )
+    parser.add_argument(
+        "--max-tokens", type=int, default=None, help="Budget of generated tokens"
+    )
+    parser.add_argument(
+        "--max-coq-calls", type=int, default=None, help="Budget of tactics sent to Coq"
+    )
+    parser.add_argument(
+        "--max-seconds", type=float, default=None, help="Wall-clock budget in seconds"
+    )
+    parser.add_argument(
+        "--goals-tag", type=str, default="GOALS", help="XML tag to use for goals"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose output")
+    parser.add_argument(
+        "--context", action="store_true", help="Include context in prompts"
+    )
+    parser.add_argument(
+        "--n-sampling",
+        action="store_true",
+        help="Send identical prompts once and sample them n times",
+    )
+    parser.add_argument(
+        "--llm-log-dir",
+        type=str,
+        default="llm_logs",
+        help="Directory to store LLM interaction logs",
+    )
+
+    args = parser.parse_args()
+
+    # Setup Pytanque
+    pet = Pytanque(args.host, args.port)
+    pet.connect()
+    pet.set_workspace(False, str(args.workspace))
+
+    # Setup ScriptTool
+    script_tool = ScriptTool(
+        pet=pet,
+        workspace=args.workspace,
+        file=args.file,
+        theorem=args.theorem,
+        context=args.context,
+    )
+
+    # Setup LLM
+    llm = VLLM(
+        api_url=args.llm_url,
+        model=args.model,
+        temperature=args.temperature,
+        verbose=args.verbose,
+        log_dir=args.llm_log_dir,
+        log_to_console=args.verbose,
+        n_sampling=args.n_sampling,
+    )
+
+    prover = BestFirstProver(
+        llm=llm,
+        coq_tool=script_tool,
+        budget=SearchBudget(
+            max_tokens=args.max_tokens,
+            max_coq_calls=args.max_coq_calls,
+            max_seconds=args.max_seconds,
+            max_iterations=args.max_iterations,
+        ),
+        expand_width=args.expand_width,
+        samples_per_node=args.samples_per_node,
+        verbose=args.verbose,
+        goals_tag=args.goals_tag,
+    )
+
+    with log_context(theorem=args.theorem, file=args.file):
+        success, proof = prover.run_search()
+
+    # Print results
+    if success:
+        print("\nProof completed successfully!")
+        print("\nProof tactics:")
+        for tactic in proof:
+            print(f"  {tactic}")
+    else:
+        print("\nProof incomplete.")
+        print("Hint: Try increasing the budgets, the expansion width, or the temperature.")
+
+    print(f"\nSearch statistics: {prover.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,10 @@ import json
 import argparse
 import glob
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, List, Any, Optional
+
+from .llm_logger import LLMLogger, read_segment
+from .log_index import LogIndex
 
 
 def load_log_files(log_dir: str, sort_by_time: bool = True) -> List[Dict[str, Any]]:
@@ -20,40 +23,46 @@ def load_log_files(log_dir: str, sort_by_time: bool = True) -> List[Dict[str, An
     Returns:
         List of log data dictionaries
     """
-    # Find all JSON files in the directory
+    # Find the log segments, and the JSON files of older runs
+    segment_files = sorted(glob.glob(os.path.join(log_dir, LLMLogger.SEGMENT_PATTERN)))
     log_files = glob.glob(os.path.join(log_dir, "*.json"))
 
-    if not log_files:
+    if not log_files and not segment_files:
         print(f"No log files found in {log_dir}")
         return []
 
     logs = []
 
-    for file_path in log_files:
-        try:
+    def records(file_path):
+        if file_path in segment_files:
+            yield from read_segment(file_path)
+        else:
             with open(file_path, "r") as f:
-                log_data = json.load(f)
-
-            # Add filename to the log data
-            log_data["_filename"] = os.path.basename(file_path)
-
-            # Handle both single and batch interactions
-            if "interactions" in log_data:
-                # For batch logs, create separate entries for each interaction
-                for idx, interaction in enumerate(log_data["interactions"]):
-                    # Create a copy of the log data for each interaction
-                    interaction_log = log_data.copy()
-                    # Remove the interactions list
-                    interaction_log.pop("interactions")
-                    # Add the individual prompt and response
-                    interaction_log["prompt"] = interaction["prompt"]
-                    interaction_log["response"] = interaction["response"]
-                    # Add interaction index to differentiate
-                    interaction_log["_interaction_idx"] = idx
-                    logs.append(interaction_log)
-            else:
-                # For single interaction logs
-                logs.append(log_data)
+                yield json.load(f)
+
+    for file_path in segment_files + log_files:
+        try:
+            for log_data in records(file_path):
+                # Add filename to the log data
+                log_data["_filename"] = os.path.basename(file_path)
+
+                # Handle both single and batch interactions
+                if "interactions" in log_data:
+                    # For batch logs, create separate entries for each interaction
+                    for idx, interaction in enumerate(log_data["interactions"]):
+                        # Create a copy of the log data for each interaction
+                        interaction_log = log_data.copy()
+                        # Remove the interactions list
+                        interaction_log.pop("interactions")
+                        # Add the individual prompt and response
+                        interaction_log["prompt"] = interaction["prompt"]
+                        interaction_log["response"] = interaction["response"]
+                        # Add interaction index to differentiate
+                        interaction_log["_interaction_idx"] = idx
+                        logs.append(interaction_log)
+                else:
+                    # For single interaction logs
+                    logs.append(log_data)
         except Exception as e:
             print(f"Error loading {file_path}: {e}")
 
@@ -65,7 +74,7 @@ def load_log_files(log_dir: str, sort_by_time: bool = True) -> List[Dict[str, An
 
 
 def display_chat_interface(
-    logs: List[Dict[str, Any]],
+    logs: Iterable[Dict[str, Any]],
     max_width: int = 80,
     show_metadata: bool = False,
     show_timestamps: bool = True,
@@ -76,17 +85,13 @@ def display_chat_interface(
     Display logs in a chat-like interface.
 
     Args:
-        logs: List of log data dictionaries
+        logs: Log data dictionaries, read as they are displayed
         max_width: Maximum width of the display
         show_metadata: Whether to show metadata
         show_timestamps: Whether to show timestamps
         truncate_long_messages: Whether to truncate long messages
         max_lines: Maximum number of lines to show per message when truncated
     """
-    if not logs:
-        print("No logs to display.")
-        return
-
     # Terminal colors
     BLUE = "\033[94m"
     GREEN = "\033[92m"
@@ -94,6 +99,7 @@ def display_chat_interface(
     RESET = "\033[0m"
     BOLD = "\033[1m"
 
+    idx = -1
     for idx, log in enumerate(logs):
         # Extract data
         timestamp = log.get("timestamp", "Unknown time")
@@ -125,6 +131,8 @@ def display_chat_interface(
                 print(
                     f"{GRAY}Temperature: {metadata.get('temperature', 'Unknown')}{RESET}"
                 )
+                if "theorem" in metadata:
+                    print(f"{GRAY}Theorem: {metadata['theorem']}{RESET}")
             print()
         elif show_timestamps:
             print(f"{GRAY}[{formatted_time}]{RESET}")
@@ -158,6 +166,9 @@ def display_chat_interface(
         print(f"{GREEN}<<< RESPONSE:{RESET}")
         print(f"{GREEN}{displayed_response}{RESET}")
 
+    if idx < 0:
+        print("No logs to display.")
+
 
 def main():
     """Main entry point for viewing LLM logs."""
@@ -194,24 +205,37 @@ def main():
         type=str,
         help="Only show logs containing this string in prompt or response",
     )
+    parser.add_argument("--model", type=str, help="Only show logs of this model")
+    parser.add_argument("--theorem", type=str, help="Only show logs of this theorem")
+    parser.add_argument(
+        "--since", type=str, help="Only show logs from this time (ISO format, e.g. 2024-05-01T12:00)"
+    )
+    parser.add_argument(
+        "--until", type=str, help="Only show logs until this time (ISO format)"
+    )
+    parser.add_argument("--limit", type=int, help="Maximum number of logs to show")
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=None,
+        help="Path of the log index (default: llm_logs.sqlite in the log directory)",
+    )
 
     args = parser.parse_args()
 
-    # Load logs
-    logs = load_log_files(args.log_dir, sort_by_time=not args.no_sort)
-
-    # Apply filters
-    if args.filter:
-        logs = [
-            log
-            for log in logs
-            if args.filter.lower() in log.get("prompt", "").lower()
-            or args.filter.lower() in log.get("response", "").lower()
-        ]
-
-    # Get only the latest log if requested
-    if args.latest and logs:
-        logs = [logs[-1]]
+    # Index the new log files, and read the matching logs as they are displayed
+    index = LogIndex(args.log_dir, args.index)
+    index.update()
+    logs = index.query(
+        model=args.model,
+        theorem=args.theorem,
+        since=args.since,
+        until=args.until,
+        contains=args.filter,
+        latest=args.latest,
+        limit=1 if args.latest else args.limit,
+        sort_by_time=not args.no_sort,
+    )
 
     # Display logs
     display_chat_interface(
@@ -222,6 +246,7 @@ def main():
         truncate_long_messages=not args.show_full,
         max_lines=args.max_lines,
     )
+    index.close()
 
 
 if __name__ == "__main__":
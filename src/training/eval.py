@@ -1,8 +1,9 @@
 import subprocess
 import time
-import signal
 import random
 
+from src.inference.deadline import Deadline, DeadlineExceeded
+
 
 def start_pet_server(port=8765, mean_wait=10):
     """
@@ -33,19 +34,23 @@ def timeout(seconds=5, error_message="Function call timed out"):
     """
     A decorator that raises a TimeoutError if the decorated function
     does not return within 'seconds' seconds.
+
+    The function runs under its own `Deadline`, so unlike SIGALRM the decorator
+    works in any thread and for several calls at once. The deadline is
+    cooperative: the LLM client and the Coq environment stop by themselves when
+    it is reached, other code is not interrupted (e.g. give `pet.run` its own
+    timeout) and the TimeoutError is raised when it returns.
     """
     def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise TimeoutError(error_message)
         def wrapper(*args, **kwargs):
-            # Set the signal handler and a timeout alarm
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
+            deadline = Deadline(seconds)
             try:
-                result = func(*args, **kwargs)
-            finally:
-                # Cancel the alarm
-                signal.alarm(0)
+                with deadline.activate():
+                    result = func(*args, **kwargs)
+            except DeadlineExceeded as e:
+                raise TimeoutError(error_message) from e
+            if deadline.expired:
+                raise TimeoutError(error_message)
             return result
         return wrapper
     return decorator